@@ -0,0 +1,165 @@
+import os
+import json
+import math
+import shutil
+import hashlib
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from matplotlib import colormaps
+from matplotlib.image import imsave
+from pyproj import Transformer
+from scipy.spatial import cKDTree
+from routing_engine import compile_graph
+from import_graphs import nearest_destination_csr
+from node_snapper import nearest_nodes
+
+
+TILE_SIZE = 256
+# Half the width of the web mercator world, in metres
+ORIGIN_SHIFT = math.pi * 6378137.0
+# Colour scale of the tiles and the map legend
+CMAP = 'viridis'
+
+# Node distances and colour scale, set once in every worker process
+_tile_state = {}
+
+
+def node_distance_layer(graph_proj, destinations):
+    """Web mercator x/y and distance to the nearest destination of every reached node, and the destination nodes.
+
+    Uses the same multi-source search as get_nearest_point_graph(engine='csr').
+    """
+    dest_utm = destinations.to_crs(crs=graph_proj.graph['crs'])
+    closest_target_nodes = nearest_nodes(G=graph_proj, X=dest_utm.geometry.x, Y=dest_utm.geometry.y)
+    path_data = nearest_destination_csr(graph_proj, closest_target_nodes)
+
+    compiled = compile_graph(graph_proj)
+    node_idx = compiled.index_of(path_data['source_node'].values)
+    x, y = Transformer.from_crs(graph_proj.graph['crs'], 'EPSG:3857', always_xy=True).transform(compiled.x[node_idx], compiled.y[node_idx])
+    return np.asarray(x), np.asarray(y), path_data['distance'].values, np.asarray(closest_target_nodes)
+
+
+def tile_range(bounds, zoom):
+    """Columns and rows of the XYZ tiles covering mercator bounds (xmin, ymin, xmax, ymax)"""
+    size = 2 * ORIGIN_SHIFT / 2 ** zoom
+    xmin, ymin, xmax, ymax = bounds
+    col_min, col_max = int((xmin + ORIGIN_SHIFT) // size), int((xmax + ORIGIN_SHIFT) // size)
+    row_min, row_max = int((ORIGIN_SHIFT - ymax) // size), int((ORIGIN_SHIFT - ymin) // size)
+    last = 2 ** zoom - 1
+    return range(max(col_min, 0), min(col_max, last) + 1), range(max(row_min, 0), min(row_max, last) + 1)
+
+
+def tile_bounds(zoom, col, row):
+    size = 2 * ORIGIN_SHIFT / 2 ** zoom
+    xmin = col * size - ORIGIN_SHIFT
+    ymax = ORIGIN_SHIFT - row * size
+    return xmin, ymax - size, xmin + size, ymax
+
+
+def _init_worker(x, y, distances, vmax, radius, alpha):
+    _tile_state['tree'] = cKDTree(np.column_stack([x, y]))
+    _tile_state['distances'] = distances
+    _tile_state['vmax'] = vmax
+    _tile_state['radius'] = radius
+    _tile_state['alpha'] = alpha
+
+
+def render_tile(zoom, col, row):
+    """RGBA array of one tile: each pixel takes the colour of the nearest node within reach"""
+    xmin, ymin, xmax, ymax = tile_bounds(zoom, col, row)
+    resolution = (xmax - xmin) / TILE_SIZE
+    centres = (np.arange(TILE_SIZE) + 0.5) * resolution
+    px, py = np.meshgrid(xmin + centres, ymax - centres)
+
+    # Ground metres are mercator metres times cos(latitude)
+    lat = math.atan(math.sinh((ymin + ymax) / 2 / 6378137.0))
+    radius = max(_tile_state['radius'] / math.cos(lat), 1.5 * resolution)
+    _, idx = _tile_state['tree'].query(np.column_stack([px.ravel(), py.ravel()]), distance_upper_bound=radius)
+    covered = idx < len(_tile_state['distances'])
+
+    rgba = np.zeros((TILE_SIZE * TILE_SIZE, 4), dtype=np.uint8)
+    if covered.any():
+        values = _tile_state['distances'][idx[covered]] / _tile_state['vmax']
+        rgba[covered] = colormaps[CMAP](np.clip(values, 0, 1), bytes=True)
+        rgba[covered, 3] = _tile_state['alpha']
+    return rgba.reshape(TILE_SIZE, TILE_SIZE, 4), covered.any()
+
+
+def inputs_hash(destination_nodes, x, y, distances, vmax, cmap, zooms, radius, alpha):
+    """Digest of everything a tile depends on, to tell whether a tile cache is stale"""
+    digest = hashlib.sha1()
+    digest.update(json.dumps({'vmax': float(vmax), 'cmap': cmap, 'zooms': sorted(int(z) for z in zooms),
+                              'radius': float(radius), 'alpha': int(alpha)}, sort_keys=True).encode())
+    for array in (np.unique(destination_nodes), x, y, distances):
+        digest.update(np.ascontiguousarray(array).tobytes())
+    return digest.hexdigest()
+
+
+def clear_tiles(tile_dir):
+    """Delete the zoom folders and meta.json of a tile cache"""
+    for name in os.listdir(tile_dir):
+        path = os.path.join(tile_dir, name)
+        if name.isdigit() and os.path.isdir(path):
+            shutil.rmtree(path)
+    if os.path.exists(os.path.join(tile_dir, 'meta.json')):
+        os.remove(os.path.join(tile_dir, 'meta.json'))
+
+
+def render_column(tile_dir, zoom, col, rows, overwrite=False):
+    """Write the tiles of one tile column, skipping tiles already in the cache"""
+    written = 0
+    for row in rows:
+        path = os.path.join(tile_dir, str(zoom), str(col), f'{row}.png')
+        if os.path.exists(path) and not overwrite:
+            continue
+        rgba, covered = render_tile(zoom, col, row)
+        # Empty tiles are left out, the map shows nothing where a tile is missing
+        if covered:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            imsave(path, rgba)
+            written += 1
+    return written
+
+
+def build_accessibility_tiles(graph_proj, destinations, tile_dir, zooms=range(11, 17), vmax=None,
+                              radius=60.0, alpha=190, max_workers=None, overwrite=False):
+    """Render the distance to the nearest destination as an XYZ tile cache in tile_dir.
+
+    Tiles are written as tile_dir/{z}/{x}/{y}.png, one tile column per task
+    on a process pool, and tiles already in the cache are kept unless
+    overwrite is set. Pixels within radius metres of a reached node take its
+    distance on the viridis scale, from 0 to vmax (by default the 95th
+    percentile of the distances). The scale, extent and a hash of the inputs
+    (node distances, destination nodes, scale, zooms, radius and alpha) go
+    to meta.json; a cache built from other inputs is cleared first. Returns
+    the number of tiles written.
+    """
+    x, y, distances, destination_nodes = node_distance_layer(graph_proj, destinations)
+    if vmax is None:
+        vmax = float(np.percentile(distances, 95))
+    bounds = (x.min(), y.min(), x.max(), y.max())
+    jobs = [(zoom, col, rows) for zoom in zooms for cols, rows in [tile_range(bounds, zoom)] for col in cols]
+
+    # Tiles of other inputs must not be mixed in, so a stale cache is cleared
+    key = inputs_hash(destination_nodes, x, y, distances, vmax, CMAP, zooms, radius, alpha)
+    meta_path = os.path.join(tile_dir, 'meta.json')
+    if os.path.exists(meta_path):
+        with open(meta_path) as f:
+            if json.load(f).get('inputs_hash') != key:
+                clear_tiles(tile_dir)
+    elif os.path.isdir(tile_dir):
+        clear_tiles(tile_dir)
+
+    # meta.json goes first so an interrupted run resumes with the tiles it wrote
+    lon, lat = Transformer.from_crs('EPSG:3857', 'EPSG:4326', always_xy=True).transform([bounds[0], bounds[2]], [bounds[1], bounds[3]])
+    meta = {'vmin': 0.0, 'vmax': vmax, 'cmap': CMAP, 'minzoom': min(zooms), 'maxzoom': max(zooms),
+            'bounds': [[lat[0], lon[0]], [lat[1], lon[1]]], 'inputs_hash': key}
+    os.makedirs(tile_dir, exist_ok=True)
+    with open(meta_path, 'w') as f:
+        json.dump(meta, f)
+
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker,
+                             initargs=(x, y, distances, vmax, radius, alpha)) as pool:
+        futures = [pool.submit(render_column, tile_dir, zoom, col, rows, overwrite) for zoom, col, rows in jobs]
+        written = sum(future.result() for future in futures)
+    return written
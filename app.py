@@ -1,106 +1,213 @@
+import os
+import json
 import random
-import matplotlib.colors as mcolors
-import matplotlib.pyplot as plt
+import asyncio
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from matplotlib import colormaps, colors
+from matplotlib.collections import LineCollection
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 import osmnx as ox
-import networkx as nx
 import geopandas as gpd
-from shiny import App, Inputs, Outputs, Session, render, ui, reactive
-from shapely.geometry import LineString
-
-
-
-def compute_distances_and_paths_from_single_node(node_id, graph_utm, closest_target_nodes, weight):
-    distances, paths = nx.single_source_dijkstra(graph_utm, node_id, weight=weight)
-    # Filter the results to only include the specified destinations
-    filtered_distances = {destination: distances[destination] for destination in closest_target_nodes if destination in distances}
-    filtered_paths = {destination: paths[destination] for destination in closest_target_nodes if destination in paths}
-    return node_id, filtered_distances, filtered_paths
-
-
-def load_graph(filename):
-    return ox.load_graphml(filename)
-
-graph_utm = load_graph("data/graph_utm.graphml")
+from shiny import App, Inputs, Outputs, Session, render, ui, reactive, req
+import shapely
+from routing_engine import compile_graph
+from nearest_destination import load_or_build_field
+from graph_snapshot import find_snapshot
+from node_snapper import nearest_nodes
+
+
+# Memory-mapped snapshot when there is one; rebuilding the graph from its arrays skips parsing GraphML
+snapshot = find_snapshot("data/graph_utm.graphml")
+if snapshot is not None:
+    graph_utm = snapshot.to_graph()
+    edges = snapshot.edges_gdf()
+else:
+    graph_utm = ox.load_graphml("data/graph_utm.graphml")
+    edges = ox.graph_to_gdfs(graph_utm, nodes=False)
 dest_utm = gpd.read_file("data/destinations_4326.gpkg").to_crs(crs=graph_utm.graph['crs'])
-nodes = ox.graph_to_gdfs(graph_utm, edges=False)
-edges = ox.graph_to_gdfs(graph_utm, nodes=False)
-closest_target_nodes = ox.distance.nearest_nodes(G=graph_utm, X=dest_utm.geometry.x, Y=dest_utm.geometry.y)
+closest_target_nodes = nearest_nodes(G=graph_utm, X=dest_utm.geometry.x, Y=dest_utm.geometry.y)
+# One reverse search per destination at startup (or from disk), so a click is a lookup and a short walk
+destination_field = load_or_build_field(compile_graph(graph_utm), closest_target_nodes, "data/destination_field")
+compiled = destination_field.compiled
+
+
+def edge_segments(edges):
+    """Coordinate arrays of the edge geometries, ready for a LineCollection"""
+    coords, index = shapely.get_coordinates(edges.geometry.values, return_index=True)
+    return np.split(coords, np.flatnonzero(np.diff(index)) + 1)
+
+
+def render_basemap(edges, extent, width=1200, dpi=100):
+    """Rasterize the street edges once, so a render only has to draw one image"""
+    xmin, xmax, ymin, ymax = extent
+    height = max(1, round(width * (ymax - ymin) / (xmax - xmin)))
+    basemap_fig = Figure(figsize=(width / dpi, height / dpi), dpi=dpi)
+    FigureCanvasAgg(basemap_fig)
+    basemap_fig.patch.set_alpha(0)
+    basemap_ax = basemap_fig.add_axes([0, 0, 1, 1])
+    basemap_ax.add_collection(LineCollection(edge_segments(edges), colors='gray', linewidths=0.5, alpha=0.7))
+    basemap_ax.set_xlim(xmin, xmax)
+    basemap_ax.set_ylim(ymin, ymax)
+    basemap_ax.axis('off')
+    basemap_fig.canvas.draw()
+    return np.asarray(basemap_fig.canvas.buffer_rgba()).copy()
+
+
+xmin, ymin, xmax, ymax = edges.total_bounds
+extent = (xmin, xmax, ymin, ymax)
+# Data shared read-only by every session: the graph, the destination field and the basemap
+basemap = render_basemap(edges, extent)
+basemap.flags.writeable = False
+del edges
+
+# Coordinates of the destinations and of the nodes they are snapped to
+dest_x, dest_y = dest_utm.geometry.x.values, dest_utm.geometry.y.values
+destination_idx = compiled.index_of(closest_target_nodes)
+dest_node_x, dest_node_y = compiled.x[destination_idx], compiled.y[destination_idx]
+
+
+
+# Distance tiles from accessibility_tiles.build_accessibility_tiles, served as static files
+tile_dir = "data/tiles"
+has_tiles = os.path.exists(os.path.join(tile_dir, "meta.json"))
+
+
+def accessibility_map(tile_dir):
+    """Leaflet map of the pre-rendered distance tiles; panning and zooming only fetch static files"""
+    with open(os.path.join(tile_dir, "meta.json")) as f:
+        meta = json.load(f)
+    stops = ", ".join(colors.to_hex(colormaps[meta['cmap']](v)) for v in np.linspace(0, 1, 6))
+    script = f"""
+    var map = L.map('accessibility_map').fitBounds({json.dumps(meta['bounds'])});
+    L.tileLayer('https://tile.openstreetmap.org/{{z}}/{{x}}/{{y}}.png', {{
+        maxZoom: 19, attribution: '&copy; OpenStreetMap contributors'}}).addTo(map);
+    L.tileLayer('tiles/{{z}}/{{x}}/{{y}}.png', {{
+        minNativeZoom: {meta['minzoom']}, maxNativeZoom: {meta['maxzoom']}, maxZoom: 19}}).addTo(map);
+    """
+    return ui.TagList(
+        ui.head_content(
+            ui.tags.link(rel="stylesheet", href="https://unpkg.com/leaflet@1.9.4/dist/leaflet.css"),
+            ui.tags.script(src="https://unpkg.com/leaflet@1.9.4/dist/leaflet.js"),
+        ),
+        ui.tags.div(id="accessibility_map", style="height: 800px; width: 100%;"),
+        ui.tags.div(
+            ui.tags.span(f"{meta['vmin']:.0f} m"),
+            ui.tags.span(style=f"display: inline-block; width: 200px; height: 12px; margin: 0 8px; background: linear-gradient(to right, {stops});"),
+            ui.tags.span(f"{meta['vmax']:.0f} m to the nearest destination"),
+        ),
+        ui.tags.script(script),
+    )
 
-fig, ax = plt.subplots()
-crs = graph_utm.graph['crs']
-edges.plot(ax=ax, color='gray', linewidth=0.5, alpha=0.7)
-dest_utm.plot(ax=ax, color='blue', label='Destinations')
-plt.axis('off')
-list_axes_children_before = list(ax.get_children())
 
 app_ui = ui.page_fluid(
   
         ui.panel_main(ui.output_text("click_info"), 
-                      ui.output_plot("plot1", click=True, height = "800px",width="100%")
+                      ui.output_plot("plot1", click=True, height = "800px",width="100%"),
+                      accessibility_map(tile_dir) if has_tiles else None,
                       )
     
 )
 
-def server(input: Inputs, output: Outputs, session: Session):
-    def remove_diff_list(temp1, temp2): 
-       return [item.remove() for item in temp2 if item not in temp1]
-   
-    origin_node_reactive = reactive.Value(None)  # Add a new reactive value to store the updated origin_node
 
-    @output
-    @render.plot()
-    def plot1():
-        origin_node = origin_node_reactive.get()
-        if origin_node is None:
-            origin_node = random.sample(list(nodes.index), 1)[0]
+# Route lookups run off the event loop, on threads shared by every session
+route_pool = ThreadPoolExecutor(max_workers=os.cpu_count())
+
+
+def compute_routes(origin_node):
+    """Coordinates and distances of the routes from an origin to every reachable destination"""
+    node_idx = compiled.index_of(origin_node)
+    distances = np.asarray(destination_field.distances[:, node_idx])
+    reachable = np.flatnonzero(np.isfinite(distances))
+    coords, walker = destination_field.path_coords(np.full(len(reachable), node_idx), reachable)
+    return {
+        'origin': (compiled.x[node_idx], compiled.y[node_idx]),
+        'reachable': reachable,
+        'distances': distances[reachable],
+        'segments': np.split(coords, np.flatnonzero(np.diff(walker)) + 1) if len(reachable) else [],
+    }
+
+
+class RouteMap:
+    """Figure and overlay artists of one session, drawn over the shared basemap.
+
+    Every session gets its own figure, so concurrent users never touch each
+    other's artists. Everything they read (graph, destination field, basemap
+    raster) is module-level and never written after startup.
+    """
+
+    def __init__(self):
+        self.fig = Figure()
+        ax = self.fig.add_subplot()
+        ax.imshow(basemap, extent=extent)
+        ax.scatter(dest_x, dest_y, color='blue', label='Destinations')
+        # Overlay artists are created once and updated in place on every render
+        self.origin_marker, = ax.plot([], [], 'o', color='red', label='Origin', zorder=3)
+        self.route_lines = ax.add_collection(LineCollection([], linewidths=3, alpha=0.8))
+        self.route_labels = [ax.annotate("", xy=(x, y), xytext=(-10, -15), textcoords='offset points', fontsize=10, color="black", visible=False)
+                             for x, y in zip(dest_node_x, dest_node_y)]
+        ax.legend(loc='upper center', bbox_to_anchor=(0.5, -0.1), fancybox=False, shadow=False, ncol=2, fontsize=13)
+        ax.axis('off')
 
-        remove_diff_list(list_axes_children_before, list(ax.get_children()))
+    def draw(self, routes):
+        """Point the origin marker, route lines and distance labels at computed routes"""
+        x, y = routes['origin']
+        self.origin_marker.set_data([x], [y])
+        self.route_lines.set_segments(routes['segments'])
+        # A different colour for each route
+        n_routes = len(routes['reachable'])
+        self.route_lines.set_color(colormaps['viridis'].resampled(max(n_routes, 1))(np.arange(n_routes)))
 
+        for label in self.route_labels:
+            label.set_visible(False)
+        for idx, distance in zip(routes['reachable'].tolist(), routes['distances'].tolist()):
+            self.route_labels[idx].set_text(f"{distance:.0f} m")
+            self.route_labels[idx].set_visible(True)
+        return self.fig
 
 
-        nodes.loc[[origin_node]].plot(ax=ax, color='red', label='Origin')
-        ax.legend(loc='upper center', bbox_to_anchor=(0.5, -0.1), fancybox=False, shadow=False, ncol=2, fontsize=13)
-        plt.xlabel("x (m)")
-        plt.ylabel("y (m)")
-
-        node_id, filtered_distances, filtered_paths = compute_distances_and_paths_from_single_node(origin_node, graph_utm, closest_target_nodes, weight='length')
-
-        paths = [LineString(list(nodes.loc[filtered_paths[destination]].geometry.values)) for destination in filtered_paths]
-        # Create GeoDataFrame from paths
-        routes = gpd.GeoDataFrame(geometry=paths, crs=crs)
-
-        # Set up a colormap to get unique colors
-        cmap = plt.cm.get_cmap('viridis', len(routes))
-
-        # Plot each route with a different color
-        for idx, route in routes.iterrows():
-            color = mcolors.to_hex(cmap(idx))
-            temp_gdf = gpd.GeoDataFrame({'geometry': [route['geometry']]}, crs=crs)
-            temp_gdf.plot(ax=ax, linewidth=3, alpha=0.8, color=color)
-
-            # Annotate the distance
-            dest_node = closest_target_nodes[idx]
-            dest_lat, dest_lon = nodes.loc[dest_node].geometry.y, nodes.loc[dest_node].geometry.x
-            distance = filtered_distances[dest_node]
-            ax.annotate(
-                f"{distance:.0f} m",
-                xy=(dest_lon, dest_lat),
-                xytext=(dest_lon - 0.001, dest_lat - 0.0015),
-                fontsize=10,
-                color="black"
-            )
-
-        return fig
-
-    @output
-    @render.text()
-    def click_info():
+def server(input: Inputs, output: Outputs, session: Session):
+    route_map = RouteMap()
+    origin_node_reactive = reactive.Value(compiled.node_ids[random.randrange(len(compiled))].item())  # Add a new reactive value to store the updated origin_node
+
+    @reactive.extended_task
+    async def route_task(origin_node):
+        # Cancelling the task also drops the lookup if it is still waiting for a thread
+        return await asyncio.wrap_future(route_pool.submit(compute_routes, origin_node))
+
+    @reactive.Effect
+    @reactive.event(origin_node_reactive)
+    def start_route_task():
+        # A newer click supersedes the lookup still in flight instead of queueing behind it
+        route_task.cancel()
+        route_task.invoke(origin_node_reactive.get())
+
+    @reactive.Effect
+    @reactive.event(input.plot1_click)
+    def update_origin():
         click_data = input.plot1_click()
         if click_data:
             x, y = click_data['x'], click_data['y']
-            origin_node = ox.distance.nearest_nodes(graph_utm, X=[x], Y=[y])[0]
+            origin_node = nearest_nodes(graph_utm, X=[x], Y=[y])[0]
             origin_node_reactive.set(origin_node)  # Update the reactive value with the new origin_node
 
-app = App(app_ui, server, debug=True)
+    @output
+    @render.plot()
+    def plot1():
+        if route_task.status() == 'cancelled':
+            # Superseded by a newer click, keep the last routes on screen until that one is done
+            req(False, cancel_output=True)
+        # Shows the previous plot as recalculating while the routes are computed
+        return route_map.draw(route_task.result())
 
+    @output
+    @render.text()
+    def click_info():
+        # A cancelled task always has a newer one queued behind it
+        if route_task.status() in ('running', 'cancelled'):
+            return f"Computing routes from node {origin_node_reactive.get()}..."
+        return f"Routes from node {origin_node_reactive.get()}"
 
+app = App(app_ui, server, debug=True, static_assets={"/tiles": Path(tile_dir).resolve()} if has_tiles else None)
@@ -1,14 +1,12 @@
 import matplotlib.pyplot as plt
-import osmnx as ox
 from interactive_map import PointBrowser3
 import geopandas as gpd
 from shiny import App, ui
+from graph_snapshot import load_graph
 
 
-def load_graph(filename):
-    return ox.load_graphml(filename)
-
-graph_utm= load_graph("data/graph_utm.graphml")
+# Routes and draws only, so the snapshot (lengths and geometries) is enough
+graph_utm= load_graph("data/graph_utm.graphml", prefer_snapshot=True)
 dest_utm = gpd.read_file("data/destinations_4326.gpkg").to_crs(crs=graph_utm.graph['crs'])
 
 
@@ -0,0 +1,271 @@
+"""Run the accessibility pipeline for many places on a process pool.
+
+    python batch_runner.py "Derby, England" "Leicester, England" \
+        --destinations data/destinations_4326.gpkg --out output/batch
+
+Each place goes through four stages (graph, project, snap, accessibility),
+each one checkpointed under <out>/<place>/, so a rerun skips the stages and
+places that already finished. A summary table with per-stage timings and the
+peak RSS of every place is written to <out>/summary.csv.
+"""
+import os
+import json
+import time
+import argparse
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
+from profiling import peak_rss_mb
+
+
+STAGES = ['graph', 'project', 'snap', 'accessibility']
+
+
+def place_slug(place_name):
+    # Same naming as download_graphs.py
+    return place_name.strip().replace(',', '').replace(' ', '_')
+
+
+def layer_name(layer):
+    path, name = layer
+    return name or os.path.splitext(os.path.basename(path))[0]
+
+
+def parse_layer(spec):
+    """'path.gpkg' or 'path.gpkg:layer' to (path, layer)"""
+    # Drive letters have a colon too (C:\data.gpkg), so only a suffix after an existing file is a layer
+    path, _, name = spec.rpartition(':')
+    if path and name and os.path.isfile(path):
+        return path, name
+    return spec, None
+
+
+def available_memory():
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def pool_size(n_places, memory_per_worker_gb, max_workers=None):
+    """Workers for the pool: no more than the cores, the places, or what fits in free memory"""
+    workers = os.cpu_count() or 1
+    memory = available_memory()
+    if memory is not None and memory_per_worker_gb:
+        workers = min(workers, int(memory // (memory_per_worker_gb * 2**30)))
+    if max_workers:
+        workers = min(workers, max_workers)
+    return max(1, min(workers, n_places))
+
+
+class Checkpoints:
+    """Marker files for the finished stages of one place.
+
+    A marker is written only once every output of its stage is in place, so a
+    crash mid-stage reruns that stage from scratch.
+    """
+
+    def __init__(self, city_dir):
+        self.city_dir = city_dir
+
+    def marker(self, stage):
+        return os.path.join(self.city_dir, f'{stage}.done.json')
+
+    def done(self, stage, inputs=None):
+        """Whether the stage finished, for the same inputs when it records any"""
+        if not os.path.exists(self.marker(stage)):
+            return False
+        return self.read(stage).get('inputs') == inputs
+
+    def read(self, stage):
+        with open(self.marker(stage)) as f:
+            return json.load(f)
+
+    def write(self, stage, info):
+        tmp = self.marker(stage) + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(info, f)
+        os.replace(tmp, self.marker(stage))
+
+    def clear(self):
+        for stage in STAGES:
+            if os.path.exists(self.marker(stage)):
+                os.remove(self.marker(stage))
+
+
+def stage_graph(place, city_dir, network_type):
+    import osmnx as ox
+    from graph_snapshot import save_snapshot, snapshot_path
+
+    graph = ox.graph_from_place(place, network_type=network_type, simplify=True)
+    filename = os.path.join(city_dir, 'graph.graphml')
+    ox.save_graphml(graph, filename)
+    save_snapshot(graph, snapshot_path(filename))
+    return {'n_nodes': len(graph), 'n_edges': graph.number_of_edges()}
+
+
+def stage_project(place, city_dir):
+    import osmnx as ox
+    from graph_snapshot import load_graph, save_snapshot
+
+    # Only the projected snapshot is written, so the OSM attributes GraphML carries are not needed
+    graph = load_graph(os.path.join(city_dir, 'graph.graphml'), prefer_snapshot=True)
+    graph_utm = ox.project_graph(graph)
+    # The app reads data/graph_utm.graphml through its snapshot, so the snapshot alone is enough
+    save_snapshot(graph_utm, os.path.join(city_dir, 'graph_utm.snapshot'))
+    return {'crs': str(graph_utm.graph['crs'])}
+
+
+def stage_snap(place, city_dir, layers):
+    import geopandas as gpd
+    from shapely.geometry import box
+    from graph_snapshot import load_snapshot
+    from node_snapper import NodeSnapper
+
+    snapshot = load_snapshot(os.path.join(city_dir, 'graph_utm.snapshot'))
+    compiled = snapshot.compiled_graph(projected=True)
+    # Only read the destinations within the extent of the place
+    bounds = gpd.GeoDataFrame(geometry=[box(snapshot.x.min(), snapshot.y.min(), snapshot.x.max(), snapshot.y.max())], crs='EPSG:4326')
+
+    snapper = NodeSnapper.from_compiled(compiled)
+    info = {}
+    for layer in layers:
+        path, name = layer
+        destinations = gpd.read_file(path, layer=name, bbox=bounds)
+        points = destinations.geometry.to_crs(crs=compiled.crs)
+        destinations['node'], destinations['snap_distance'] = snapper.query(points.x, points.y)
+        destinations.to_file(os.path.join(city_dir, f'destinations_{layer_name(layer)}.gpkg'), driver='GPKG')
+        info[layer_name(layer)] = len(destinations)
+    return {'n_destinations': info}
+
+
+def stage_accessibility(place, city_dir, layers):
+    import geopandas as gpd
+    from graph_snapshot import load_snapshot
+
+    snapshot = load_snapshot(os.path.join(city_dir, 'graph_utm.snapshot'))
+    compiled = snapshot.compiled_graph(projected=True)
+    info = {}
+    for layer in layers:
+        name = layer_name(layer)
+        destinations = gpd.read_file(os.path.join(city_dir, f'destinations_{name}.gpkg'))
+        node_distance = np.full(len(compiled), np.inf)
+        nearest = np.full(len(compiled), -1)
+        if len(destinations):
+            # Walking distance from every node to its nearest destination
+            node_distance, _, origin = compiled.multi_source(destinations['node'].values, reverse=True)
+            nearest = np.where(origin >= 0, compiled.node_ids[np.maximum(origin, 0)], -1)
+        pd.DataFrame({
+            'node': compiled.node_ids,
+            'lon': snapshot.x,
+            'lat': snapshot.y,
+            'distance': node_distance,
+            'destination_node': nearest,
+        }).to_csv(os.path.join(city_dir, f'accessibility_{name}.csv'), index=False)
+        reachable = np.isfinite(node_distance)
+        info[name] = {
+            'mean_distance': float(node_distance[reachable].mean()) if reachable.any() else None,
+            'median_distance': float(np.median(node_distance[reachable])) if reachable.any() else None,
+        }
+    return {'accessibility': info}
+
+
+def run_city(place, layers, out_dir, network_type='walk', force=False):
+    """Run every unfinished stage for one place and return its summary row"""
+    city_dir = os.path.join(out_dir, place_slug(place))
+    os.makedirs(city_dir, exist_ok=True)
+    checkpoints = Checkpoints(city_dir)
+    if force:
+        checkpoints.clear()
+
+    stages = {
+        'graph': lambda: stage_graph(place, city_dir, network_type),
+        'project': lambda: stage_project(place, city_dir),
+        'snap': lambda: stage_snap(place, city_dir, layers),
+        'accessibility': lambda: stage_accessibility(place, city_dir, layers),
+    }
+    # The destination stages are redone when the layers differ from the ones their marker covered
+    layer_inputs = [[path, name] for path, name in layers]
+    inputs = {'snap': layer_inputs, 'accessibility': layer_inputs}
+    row = {'place': place, 'status': 'ok'}
+    for stage in STAGES:
+        if checkpoints.done(stage, inputs.get(stage)):
+            info = checkpoints.read(stage)
+            row[f'{stage}_s'] = 0.0
+            row[f'{stage}_cached'] = True
+        else:
+            start = time.perf_counter()
+            try:
+                info = stages[stage]()
+            except Exception:
+                row['status'] = f'failed at {stage}'
+                row['error'] = traceback.format_exc(limit=3)
+                break
+            info['seconds'] = time.perf_counter() - start
+            if stage in inputs:
+                info['inputs'] = inputs[stage]
+            checkpoints.write(stage, info)
+            row[f'{stage}_s'] = info['seconds']
+            row[f'{stage}_cached'] = False
+        row.update({key: value for key, value in info.items() if key in ('n_nodes', 'n_edges')})
+    # Each worker handles a single place, so this is the peak of this place alone
+    row['peak_rss_mb'] = peak_rss_mb()
+    return row
+
+
+def run_batch(places, layers, out_dir, network_type='walk', memory_per_worker_gb=4.0, max_workers=None, force=False):
+    """Run every place on a process pool and write the summary table to out_dir/summary.csv"""
+    os.makedirs(out_dir, exist_ok=True)
+    workers = pool_size(len(places), memory_per_worker_gb, max_workers)
+    print(f"{len(places)} places on {workers} workers")
+
+    rows = []
+    # A fresh process per place keeps peak RSS per place and returns its memory to the system
+    with ProcessPoolExecutor(max_workers=workers, max_tasks_per_child=1) as pool:
+        futures = {pool.submit(run_city, place, layers, out_dir, network_type, force): place for place in places}
+        for future in as_completed(futures):
+            place = futures[future]
+            try:
+                row = future.result()
+            except Exception as error:
+                # The worker itself died, e.g. killed for running out of memory
+                row = {'place': place, 'status': 'crashed', 'error': repr(error)}
+            print(f"{place}: {row['status']}")
+            rows.append(row)
+
+    summary = pd.DataFrame(rows).set_index('place').reindex(places)
+    summary.to_csv(os.path.join(out_dir, 'summary.csv'))
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('places', nargs='*', help='place names, e.g. "Derby, England"')
+    parser.add_argument('--places-file', help='text file with one place name per line')
+    parser.add_argument('--destinations', action='append', required=True, metavar='PATH[:LAYER]',
+                        help='destination points, any format geopandas reads; repeat for more layers')
+    parser.add_argument('--out', default='output/batch', help='output directory')
+    parser.add_argument('--network-type', default='walk')
+    parser.add_argument('--workers', type=int, help='upper bound on the number of worker processes')
+    parser.add_argument('--memory-per-worker', type=float, default=4.0, metavar='GB',
+                        help='memory to budget for each place')
+    parser.add_argument('--force', action='store_true', help='ignore checkpoints and recompute everything')
+    args = parser.parse_args(argv)
+
+    places = list(args.places)
+    if args.places_file:
+        with open(args.places_file) as f:
+            places += [line.strip() for line in f if line.strip() and not line.startswith('#')]
+    if not places:
+        parser.error('no places given')
+
+    summary = run_batch(places, [parse_layer(spec) for spec in args.destinations], args.out,
+                        network_type=args.network_type, memory_per_worker_gb=args.memory_per_worker,
+                        max_workers=args.workers, force=args.force)
+    with pd.option_context('display.width', 200, 'display.max_columns', None):
+        print(summary.drop(columns=[c for c in summary.columns if c.endswith('_cached') or c == 'error']))
+
+
+if __name__ == '__main__':
+    main()
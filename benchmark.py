@@ -0,0 +1,355 @@
+"""Offline benchmarks of every stage of the accessibility pipeline.
+
+    python benchmark.py --sizes 10000 100000 --kinds grid planar
+    python benchmark.py --sizes 10000 --save-baseline
+
+Each case is a street graph, either synthetic (a square grid or a random
+planar Delaunay graph of about n nodes, placed in lat/lon like a downloaded
+graph) or a real extract: the one main.py saves to data/graph.graphml, or
+else a small walk network around Derby downloaded once with osmnx to
+data/benchmark_extract.graphml. Sources and destinations are drawn from the
+nodes with a fixed seed, so a case is the same from run to run.
+
+The stages are timed and memory-profiled one at a time: load, load_snapshot,
+project, snap, route, route_csr, merge, straight, all_paths, stats and
+render. load and route are what main.py runs (GraphML and the default
+networkx engine), load_snapshot and route_csr the fast paths next to them;
+the later stages use the outputs of the default ones. The first run of a stage
+is traced with tracemalloc for its peak memory, then it is timed repeat times
+without tracing, with the caches of the compiled graph and the KD-tree
+cleared so every run starts cold. Every run is appended to a JSON history and
+compared with a baseline run; stages slower or larger than the baseline by
+more than the tolerance are flagged as regressions.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import warnings
+import contextlib
+import subprocess
+import tracemalloc
+from datetime import datetime, timezone
+import numpy as np
+import pandas as pd
+import networkx as nx
+import geopandas as gpd
+from scipy.spatial import Delaunay
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import routing_engine
+import node_snapper
+from import_graphs import load_graph, save_graph, project_graph, nearest_destination_csr, nearest_destination_networkx
+from import_graphs import snap_sources_destinations, merge_nearest_destinations
+from nearest_point import get_nearest_point
+from interactive_map import compute_all_distances_and_paths
+from descriptive_stats import distance_stats
+from streaming_stats import DistanceStats
+from plot_lines_nearest_point import plot_connected_points
+from profiling import peak_rss_mb
+
+
+STAGES = ['load', 'load_snapshot', 'project', 'snap', 'route', 'route_csr', 'merge', 'straight', 'all_paths', 'stats', 'render']
+REAL_GRAPH = 'data/graph.graphml'
+# Downloaded once when there is no REAL_GRAPH, small enough for every run
+REAL_EXTRACT = 'data/benchmark_extract.graphml'
+REAL_EXTRACT_RADIUS = 1000
+# Synthetic graphs are centred on Derby, as the real extract
+CENTRE_LAT, CENTRE_LON = 52.92, -1.47
+METRES_PER_DEGREE = 111_320.0
+
+
+def synthetic_graph(n_nodes, kind='grid', spacing=80.0, seed=0):
+    """Street-like MultiDiGraph of about n_nodes nodes in lat/lon, every street in both directions"""
+    rng = np.random.default_rng(seed)
+    if kind == 'grid':
+        side = int(np.ceil(np.sqrt(n_nodes)))
+        col, row = np.divmod(np.arange(side * side), side)
+        # A little jitter so distances are not all ties
+        xy = np.column_stack([col, row]) * spacing + rng.normal(0, spacing / 10, (side * side, 2))
+        index = np.arange(side * side).reshape(side, side)
+        pairs = np.concatenate([np.column_stack([index[:-1].ravel(), index[1:].ravel()]),
+                                np.column_stack([index[:, :-1].ravel(), index[:, 1:].ravel()])])
+    elif kind == 'planar':
+        xy = rng.uniform(0, np.sqrt(n_nodes) * spacing, (n_nodes, 2))
+        simplices = Delaunay(xy).simplices
+        pairs = np.sort(np.concatenate([simplices[:, [0, 1]], simplices[:, [1, 2]], simplices[:, [0, 2]]]), axis=1)
+        pairs = np.unique(pairs, axis=0)
+    else:
+        raise ValueError(f"Unknown graph kind {kind!r}, expected 'grid' or 'planar'")
+
+    length = np.hypot(*(xy[pairs[:, 0]] - xy[pairs[:, 1]]).T)
+    lon = CENTRE_LON + (xy[:, 0] - xy[:, 0].mean()) / (METRES_PER_DEGREE * np.cos(np.radians(CENTRE_LAT)))
+    lat = CENTRE_LAT + (xy[:, 1] - xy[:, 1].mean()) / METRES_PER_DEGREE
+
+    graph = nx.MultiDiGraph(crs='epsg:4326')
+    graph.add_nodes_from((node, {'x': x, 'y': y}) for node, x, y in zip(range(len(xy)), lon.tolist(), lat.tolist()))
+    pairs, length = pairs.tolist(), length.tolist()
+    graph.add_edges_from((u, v, 0, {'length': d}) for (u, v), d in zip(pairs, length))
+    graph.add_edges_from((v, u, 0, {'length': d}) for (u, v), d in zip(pairs, length))
+    return graph
+
+
+def sample_points(graph, n, seed):
+    """Random nodes of the graph as lat/lon points, as generate_random_points_from_nodes"""
+    rng = np.random.default_rng(seed)
+    nodes = np.array(list(graph.nodes))
+    chosen = nodes[rng.choice(len(nodes), size=min(n, len(nodes)), replace=False)]
+    x = [graph.nodes[node]['x'] for node in chosen.tolist()]
+    y = [graph.nodes[node]['y'] for node in chosen.tolist()]
+    return gpd.GeoSeries(gpd.points_from_xy(x, y), crs=graph.graph['crs'])
+
+
+def clear_caches(graph):
+    # Cold start: no compiled graph or KD-tree left over from an earlier run
+    routing_engine._compiled_graphs.pop(graph, None)
+    node_snapper._snappers.pop(graph, None)
+
+
+# Each stage reads what earlier stages left in state and returns (outputs, items processed)
+
+def stage_load(state):
+    # GraphML with every OSM attribute, as main.py loads it
+    graph = load_graph(state['graph_file'])
+    return {'graph': graph}, graph.number_of_nodes()
+
+
+def stage_load_snapshot(state):
+    graph = load_graph(state['graph_file'], prefer_snapshot=True)
+    return {}, graph.number_of_nodes()
+
+
+def stage_project(state):
+    graph_proj, nodes_proj, edges_proj = project_graph(state['graph'])
+    return {'graph_proj': graph_proj}, len(edges_proj)
+
+
+def stage_snap(state):
+    clear_caches(state['graph_proj'])
+    closest_target_nodes, closest_sources_nodes = snap_sources_destinations(state['graph_proj'], state['sources'], state['destinations'])
+    return {'closest_target_nodes': closest_target_nodes, 'closest_sources_nodes': closest_sources_nodes}, len(closest_sources_nodes) + len(closest_target_nodes)
+
+
+def stage_route(state):
+    # The default engine of get_nearest_point_graph
+    path_data = nearest_destination_networkx(state['graph_proj'], state['closest_target_nodes'])
+    return {'path_data': path_data}, len(path_data)
+
+
+def stage_route_csr(state):
+    clear_caches(state['graph_proj'])
+    path_data = nearest_destination_csr(state['graph_proj'], state['closest_target_nodes'])
+    return {}, len(path_data)
+
+
+def stage_merge(state):
+    origin_points, destination_points, distances = merge_nearest_destinations(
+        state['sources'], state['destinations'], state['closest_sources_nodes'], state['closest_target_nodes'], state['path_data'])
+    outputs = {'origin_points': origin_points, 'destination_points': destination_points, 'distances': distances}
+    return outputs, len(distances)
+
+
+def stage_straight(state):
+    closest_points, closest_distances = get_nearest_point(state['sources'], state['destinations'], k_neighbors=1)
+    return {}, len(closest_distances)
+
+
+def stage_all_paths(state):
+    clear_caches(state['graph_proj'])
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        all_distances, all_paths = compute_all_distances_and_paths(state['graph_proj'], state['destinations'], engine='csr')
+    return {}, len(state['destinations'])
+
+
+def stage_stats(state):
+    distances = state['distances'].values
+    distance_stats(distances)
+    DistanceStats.from_array(distances).stats()
+    return {}, len(distances)
+
+
+def stage_render(state):
+    with warnings.catch_warnings():
+        # plt.show() warns that Agg cannot show figures
+        warnings.simplefilter('ignore', UserWarning)
+        fig, ax = plot_connected_points(state['origin_points'], state['destination_points'], state['distances'])
+        fig.canvas.draw()
+    plt.close('all')
+    return {}, len(state['distances'])
+
+
+STAGE_FUNCTIONS = {'load': stage_load, 'load_snapshot': stage_load_snapshot, 'project': stage_project,
+                   'snap': stage_snap, 'route': stage_route, 'route_csr': stage_route_csr, 'merge': stage_merge, 'straight': stage_straight, 'all_paths': stage_all_paths,
+                   'stats': stage_stats, 'render': stage_render}
+
+
+def measure(func, state, repeat):
+    """Peak traced memory of a first run, then the best and median of repeat untraced runs"""
+    tracemalloc.start()
+    outputs, items = func(state)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(state)
+        times.append(time.perf_counter() - start)
+    result = {'seconds': min(times), 'median_seconds': float(np.median(times)),
+              'peak_mb': peak / 2**20, 'rss_mb': peak_rss_mb(), 'items': int(items)}
+    return outputs, result
+
+
+def run_case(name, graph_file, n_sources, n_destinations, stages, repeat, seed=0):
+    graph = load_graph(graph_file, prefer_snapshot=True)
+    state = {'graph_file': graph_file,
+             'sources': sample_points(graph, n_sources, seed),
+             'destinations': sample_points(graph, n_destinations, seed + 1)}
+    del graph
+
+    results = {}
+    for stage in STAGES:
+        if stage not in stages:
+            continue
+        outputs, results[stage] = measure(STAGE_FUNCTIONS[stage], state, repeat)
+        state.update(outputs)
+        print(f"{name:>16} {stage:>13} {results[stage]['seconds']:9.3f} s {results[stage]['peak_mb']:9.1f} MB", flush=True)
+    return results
+
+
+def real_graph_file():
+    """The real extract to benchmark, downloading the small one the first time; None when there is none"""
+    if os.path.exists(REAL_GRAPH):
+        return REAL_GRAPH
+    if not os.path.exists(REAL_EXTRACT):
+        import osmnx as ox
+        try:
+            graph = ox.graph_from_point((CENTRE_LAT, CENTRE_LON), dist=REAL_EXTRACT_RADIUS, network_type='walk')
+        except Exception as error:
+            print(f"No real extract, could not download one: {error}")
+            return None
+        os.makedirs(os.path.dirname(REAL_EXTRACT), exist_ok=True)
+        save_graph(graph, REAL_EXTRACT)
+    return REAL_EXTRACT
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(sizes, kinds, stages=STAGES, repeat=3, n_sources=None, n_destinations=50, real=True, work_dir=None):
+    """Run every case and return the run record that goes to the history"""
+    # Stages need the outputs of the stages before them
+    needed = {STAGES[i] for i in range(max(STAGES.index(stage) for stage in stages) + 1)}
+    cases = {}
+    work_dir = work_dir or tempfile.mkdtemp(prefix='how_close_benchmark_')
+    try:
+        for kind in kinds:
+            for size in sizes:
+                name = f'{kind}-{size}'
+                # Written once as GraphML plus snapshot, for both load stages
+                graph_file = os.path.join(work_dir, f'{name}.graphml')
+                if not os.path.exists(graph_file):
+                    save_graph(synthetic_graph(size, kind), graph_file)
+                results = run_case(name, graph_file, n_sources or max(1000, size // 10), n_destinations, needed, repeat)
+                cases[name] = {stage: result for stage, result in results.items() if stage in stages}
+        real_graph = real_graph_file() if real else None
+        if real_graph:
+            results = run_case('real', real_graph, n_sources or 1000, n_destinations, needed, repeat)
+            cases['real'] = {stage: result for stage, result in results.items() if stage in stages}
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return {'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'machine': platform.platform(),
+            'cpus': os.cpu_count(),
+            'repeat': repeat,
+            'cases': cases}
+
+
+def load_history(path):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_json(obj, path):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(obj, f, indent=1)
+    os.replace(tmp, path)
+
+
+def compare(run, baseline, tolerance=0.2, min_seconds=0.05, min_mb=5.0):
+    """Stage by stage comparison with a baseline run; regressions have to clear both the tolerance and the floor"""
+    rows = []
+    for case, stages in run['cases'].items():
+        for stage, result in stages.items():
+            base = baseline['cases'].get(case, {}).get(stage) if baseline else None
+            # Cases and stages missing from the baseline are not regressions
+            row = {'case': case, 'stage': stage, 'seconds': result['seconds'], 'peak_mb': result['peak_mb'], 'items': result['items'],
+                   'regression': ''}
+            if base:
+                row['base_seconds'], row['base_mb'] = base['seconds'], base['peak_mb']
+                row['time_ratio'] = result['seconds'] / base['seconds'] if base['seconds'] > 0 else np.nan
+                slower = result['seconds'] > base['seconds'] * (1 + tolerance) and result['seconds'] - base['seconds'] > min_seconds
+                larger = result['peak_mb'] > base['peak_mb'] * (1 + tolerance) and result['peak_mb'] - base['peak_mb'] > min_mb
+                row['regression'] = ', '.join(name for name, flag in [('time', slower), ('memory', larger)] if flag)
+            rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000], help='Node counts of the synthetic graphs')
+    parser.add_argument('--kinds', nargs='+', default=['grid', 'planar'], choices=['grid', 'planar'])
+    parser.add_argument('--stages', nargs='+', default=STAGES, choices=STAGES)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--sources', type=int, default=None, help='Source points per case (default a tenth of the nodes, at least 1000)')
+    parser.add_argument('--destinations', type=int, default=50)
+    parser.add_argument('--no-real', action='store_true', help=f'Skip the real extract ({REAL_GRAPH} or {REAL_EXTRACT})')
+    parser.add_argument('--history', default='output/benchmarks/history.json')
+    parser.add_argument('--baseline', default='output/benchmarks/baseline.json')
+    parser.add_argument('--save-baseline', action='store_true', help='Make this run the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed slowdown or memory growth, as a fraction')
+    parser.add_argument('--fail-on-regression', action='store_true')
+    args = parser.parse_args(argv)
+
+    run = run_benchmarks(args.sizes, args.kinds, args.stages, args.repeat, args.sources, args.destinations, real=not args.no_real)
+    history = load_history(args.history)
+    history.append(run)
+    write_json(history, args.history)
+
+    baseline = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    table = compare(run, baseline, args.tolerance)
+    with pd.option_context('display.max_rows', None, 'display.width', 200, 'display.float_format', '{:.3f}'.format):
+        print(table.to_string(index=False))
+
+    if args.save_baseline or baseline is None:
+        write_json(run, args.baseline)
+        print(f"Baseline saved to {args.baseline}")
+
+    regressions = table[table['regression'].fillna('').astype(bool)] if len(table) else table
+    if len(regressions):
+        print(f"{len(regressions)} regressions against the baseline from {baseline['timestamp']} ({baseline['commit']})")
+        return 1 if args.fail_on_regression else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
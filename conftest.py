@@ -0,0 +1,26 @@
+import numpy as np
+import pytest
+from routing_engine import CompiledGraph
+
+
+def build_random_graph(seed, n=60, m=180):
+    """Small random directed graph with parallel edges, and its dense shortest-edge matrix for scipy"""
+    rng = np.random.default_rng(seed)
+    u = rng.integers(0, n, m)
+    v = rng.integers(0, n, m)
+    keep = u != v
+    u, v = u[keep], v[keep]
+    weights = rng.uniform(1, 10, len(u)).round(1)
+    # Ids unlike positions, so a mix-up between the two shows
+    node_ids = np.arange(n) * 10 + 7
+    compiled = CompiledGraph.from_edges(node_ids, u, v, weights)
+    dense = np.full((n, n), np.inf)
+    np.minimum.at(dense, (u, v), weights)
+    dense[np.isinf(dense)] = 0
+    return compiled, dense, rng
+
+
+@pytest.fixture
+def random_graph():
+    """build_random_graph(seed), to compare the searches with scipy's dijkstra"""
+    return build_random_graph
@@ -0,0 +1,281 @@
+import heapq
+import math
+import time
+import tracemalloc
+import os
+import numpy as np
+import pandas as pd
+from routing_engine import compile_graph, node_positions
+from node_snapper import nearest_nodes
+
+
+class ContractionHierarchy:
+    """Contraction hierarchy over a CompiledGraph for many-to-many distance matrices.
+
+    Nodes are contracted one at a time, cheapest first, adding shortcut edges
+    wherever a contraction would break a shortest path. Queries then only
+    search upwards in the hierarchy: one small search per target fills
+    buckets, one per source scans them.
+    """
+
+    ARRAYS = ['node_ids', 'rank', 'up_indptr', 'up_indices', 'up_weights',
+              'down_indptr', 'down_indices', 'down_weights']
+
+    def __init__(self, node_ids, rank, up_indptr, up_indices, up_weights,
+                 down_indptr, down_indices, down_weights, preprocessing_seconds=np.nan, graph_fingerprint=''):
+        self.node_ids = np.asarray(node_ids)
+        self.rank = np.asarray(rank)
+        self.up_indptr = np.asarray(up_indptr)
+        self.up_indices = np.asarray(up_indices)
+        self.up_weights = np.asarray(up_weights)
+        self.down_indptr = np.asarray(down_indptr)
+        self.down_indices = np.asarray(down_indices)
+        self.down_weights = np.asarray(down_weights)
+        self.preprocessing_seconds = float(preprocessing_seconds)
+        # CompiledGraph.fingerprint of the graph the hierarchy was built from
+        self.graph_fingerprint = str(graph_fingerprint)
+        self._sorter = np.argsort(self.node_ids, kind='stable')
+        self._lists = None
+
+    @classmethod
+    def build(cls, compiled, settle_limit=50, verbose=False):
+        """Contract every node of a CompiledGraph.
+
+        Witness searches give up after settle_limit nodes, which only ever adds
+        unnecessary shortcuts, never wrong distances.
+        """
+        start = time.perf_counter()
+        n = len(compiled)
+        indptr, indices, weights = compiled.indptr.tolist(), compiled.indices.tolist(), compiled.weights.tolist()
+
+        # Remaining graph as dicts, self loops are never part of a shortest path
+        out = [{} for _ in range(n)]
+        inc = [{} for _ in range(n)]
+        for u in range(n):
+            for e in range(indptr[u], indptr[u + 1]):
+                v, w = indices[e], weights[e]
+                if v != u and w < out[u].get(v, math.inf):
+                    out[u][v] = w
+                    inc[v][u] = w
+
+        def witness_distances(u, skip, limit, targets):
+            distances = {u: 0.0}
+            heap = [(0.0, u)]
+            remaining = set(targets)
+            settled = 0
+            while heap and remaining and settled < settle_limit:
+                d, x = heapq.heappop(heap)
+                if d > distances[x]:
+                    continue
+                if d > limit:
+                    break
+                remaining.discard(x)
+                settled += 1
+                for y, w in out[x].items():
+                    nd = d + w
+                    if y != skip and nd < distances.get(y, math.inf):
+                        distances[y] = nd
+                        heapq.heappush(heap, (nd, y))
+            return distances
+
+        def needed_shortcuts(v):
+            shortcuts = []
+            for u, w_in in inc[v].items():
+                candidates = [(x, w_in + w_out) for x, w_out in out[v].items() if x != u]
+                if not candidates:
+                    continue
+                distances = witness_distances(u, v, max(c for _, c in candidates), [x for x, _ in candidates])
+                shortcuts.extend((u, x, c) for x, c in candidates if distances.get(x, math.inf) > c)
+            return shortcuts
+
+        contracted_neighbours = [0] * n
+        level = [0] * n
+
+        def priority(v):
+            # Edge difference, spread over the graph by contracted neighbours and hierarchy depth
+            shortcuts = needed_shortcuts(v)
+            edge_difference = len(shortcuts) - len(inc[v]) - len(out[v])
+            return 2 * edge_difference + contracted_neighbours[v] + level[v], shortcuts
+
+        heap = [(priority(v)[0], v) for v in range(n)]
+        heapq.heapify(heap)
+        rank = np.empty(n, dtype=np.int64)
+        up_out = [None] * n
+        up_in = [None] * n
+        order = 0
+        while heap:
+            _, v = heapq.heappop(heap)
+            # Lazy update: contract v only if it is still the cheapest node
+            current, shortcuts = priority(v)
+            if heap and current > heap[0][0]:
+                heapq.heappush(heap, (current, v))
+                continue
+
+            rank[v] = order
+            order += 1
+            # Edges still in the remaining graph all lead to higher ranked nodes
+            up_out[v], up_in[v] = out[v], inc[v]
+            for u in inc[v]:
+                del out[u][v]
+            for x in out[v]:
+                del inc[x][v]
+            for neighbour in set(inc[v]) | set(out[v]):
+                contracted_neighbours[neighbour] += 1
+                level[neighbour] = max(level[neighbour], level[v] + 1)
+            out[v], inc[v] = {}, {}
+            for u, x, c in shortcuts:
+                if c < out[u].get(x, math.inf):
+                    out[u][x] = c
+                    inc[x][u] = c
+            if verbose and order % 10_000 == 0:
+                print(f"contracted {order}/{n} nodes")
+
+        up = cls._pack(up_out)
+        down = cls._pack(up_in)
+        return cls(compiled.node_ids, rank, *up, *down, preprocessing_seconds=time.perf_counter() - start,
+                   graph_fingerprint=compiled.fingerprint)
+
+    @staticmethod
+    def _pack(adjacency):
+        lengths = np.fromiter((len(a) for a in adjacency), dtype=np.int64, count=len(adjacency))
+        indptr = np.zeros(len(adjacency) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=indptr[1:])
+        indices = np.fromiter((v for a in adjacency for v in a), dtype=np.int32, count=indptr[-1])
+        weights = np.fromiter((w for a in adjacency for w in a.values()), dtype=np.float64, count=indptr[-1])
+        return indptr, indices, weights
+
+    def __len__(self):
+        return len(self.node_ids)
+
+    @property
+    def n_edges(self):
+        return len(self.up_indices) + len(self.down_indices)
+
+    @property
+    def nbytes(self):
+        return sum(getattr(self, name).nbytes for name in self.ARRAYS) + self._sorter.nbytes
+
+    def index_of(self, nodes):
+        return node_positions(self.node_ids, self._sorter, nodes)
+
+    def _upward_search(self, start, direction):
+        if self._lists is None:
+            self._lists = {
+                'up': (self.up_indptr.tolist(), self.up_indices.tolist(), self.up_weights.tolist()),
+                'down': (self.down_indptr.tolist(), self.down_indices.tolist(), self.down_weights.tolist()),
+            }
+        indptr, indices, weights = self._lists[direction]
+        distances = {start: 0.0}
+        settled = {}
+        heap = [(0.0, start)]
+        while heap:
+            d, x = heapq.heappop(heap)
+            if x in settled:
+                continue
+            settled[x] = d
+            for e in range(indptr[x], indptr[x + 1]):
+                y = indices[e]
+                nd = d + weights[e]
+                if nd < distances.get(y, math.inf):
+                    distances[y] = nd
+                    heapq.heappush(heap, (nd, y))
+        return settled
+
+    def many_to_many(self, sources, targets):
+        """Dense (sources x targets) matrix of shortest path distances, inf where unreachable"""
+        src_idx = np.atleast_1d(self.index_of(sources)).tolist()
+        tgt_idx = np.atleast_1d(self.index_of(targets)).tolist()
+
+        # Backward upward search from every target leaves (target, distance) in buckets
+        buckets = {}
+        for col, t in enumerate(tgt_idx):
+            for x, d in self._upward_search(t, 'down').items():
+                buckets.setdefault(x, []).append((col, d))
+        buckets = {x: (np.array([col for col, _ in bucket]), np.array([d for _, d in bucket]))
+                   for x, bucket in buckets.items()}
+
+        # Forward upward search from every source meets them at the highest node of each path
+        distances = np.full((len(src_idx), len(tgt_idx)), np.inf)
+        for row, s in zip(distances, src_idx):
+            for x, d in self._upward_search(s, 'up').items():
+                if x in buckets:
+                    cols, bucket_distances = buckets[x]
+                    row[cols] = np.minimum(row[cols], d + bucket_distances)
+        return distances
+
+    def save(self, filename):
+        np.savez(filename, preprocessing_seconds=self.preprocessing_seconds, graph_fingerprint=self.graph_fingerprint,
+                 **{name: getattr(self, name) for name in self.ARRAYS})
+
+    @classmethod
+    def load(cls, filename):
+        with np.load(filename) as data:
+            # Files saved before the fingerprint was stored load as stale
+            fingerprint = data['graph_fingerprint'].item() if 'graph_fingerprint' in data else ''
+            return cls(*(data[name] for name in cls.ARRAYS), preprocessing_seconds=data['preprocessing_seconds'],
+                       graph_fingerprint=fingerprint)
+
+
+def load_or_build_hierarchy(graph_proj, filename):
+    """Hierarchy of a projected graph (see import_graphs.project_graph), cached in filename.
+
+    np.savez adds .npz to the name, so filename is given that suffix first.
+    The cache is rebuilt when the graph's nodes, edges or weights changed.
+    """
+    if not str(filename).endswith('.npz'):
+        filename = f'{filename}.npz'
+    compiled = compile_graph(graph_proj)
+    if os.path.exists(filename):
+        ch = ContractionHierarchy.load(filename)
+        if ch.graph_fingerprint == compiled.fingerprint:
+            return ch
+    ch = ContractionHierarchy.build(compiled)
+    ch.save(filename)
+    return ch
+
+
+def od_distance_matrix(graph_proj, sources, destinations, ch):
+    """Network distances between every source and destination point, as a DataFrame"""
+    CRS = graph_proj.graph['crs']
+    src_utm = sources.to_crs(crs=CRS)
+    dest_utm = destinations.to_crs(crs=CRS)
+    source_nodes = nearest_nodes(G=graph_proj, X=src_utm.geometry.x, Y=src_utm.geometry.y)
+    destination_nodes = nearest_nodes(G=graph_proj, X=dest_utm.geometry.x, Y=dest_utm.geometry.y)
+    return pd.DataFrame(ch.many_to_many(source_nodes, destination_nodes), index=sources.index, columns=destinations.index)
+
+
+def compare_with_dijkstra(compiled, sources, targets, ch=None):
+    """Preprocessing time, query throughput and memory of a hierarchy next to plain Dijkstra.
+
+    Builds the hierarchy when none is given. Returns one row per method with
+    the largest absolute difference to the Dijkstra matrix as a check.
+    """
+    if ch is None:
+        ch = ContractionHierarchy.build(compiled)
+    n_pairs = len(sources) * len(targets)
+    rows = []
+    for method, structure_bytes, preprocessing, query in [
+        ('dijkstra', compiled.nbytes, 0.0, lambda: compiled.many_to_many(sources, targets)),
+        ('contraction_hierarchy', ch.nbytes, ch.preprocessing_seconds, lambda: ch.many_to_many(sources, targets)),
+    ]:
+        start = time.perf_counter()
+        distances = query()
+        seconds = time.perf_counter() - start
+        # Memory on a second run, tracing slows the pure Python searches down
+        tracemalloc.start()
+        query()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        if method == 'dijkstra':
+            reference = distances
+        finite = np.isfinite(reference)
+        rows.append({
+            'method': method,
+            'preprocessing_s': preprocessing,
+            'query_s': seconds,
+            'pairs_per_s': n_pairs / seconds if seconds else np.inf,
+            'structure_mb': structure_bytes / 1e6,
+            'query_peak_mb': peak / 1e6,
+            'max_abs_diff': float(np.abs(distances[finite] - reference[finite]).max()) if finite.any() else 0.0,
+        })
+    return pd.DataFrame(rows).set_index('method')
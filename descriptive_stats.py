@@ -1,9 +1,15 @@
 import numpy as np
 import matplotlib.pyplot as plt
 import seaborn as sns
+from streaming_stats import DistanceStats
+from profiling import profiled
 
 
+@profiled
 def distance_stats(closest_distances):
+    # Accumulated over a stream of chunks, nothing left to compute
+    if isinstance(closest_distances, DistanceStats):
+        return closest_distances.stats()
     stats = {
         'min': np.min(closest_distances),
         'max': np.max(closest_distances),
@@ -13,6 +19,7 @@ def distance_stats(closest_distances):
     }
     return stats
 
+@profiled
 def plot_distance_stats(closest_distances, bins=10, figsize=(10, 5)):
     stats = distance_stats(closest_distances)
     
@@ -20,7 +27,13 @@ def plot_distance_stats(closest_distances, bins=10, figsize=(10, 5)):
     plt.title('Distance Statistics')
 
     # Plot histogram of distances
-    ax.hist(closest_distances, bins=bins, alpha=0.8, color='blue')
+    if isinstance(closest_distances, DistanceStats):
+        # Already binned on the accumulator's fixed edges (bins is not used), empty bins past the data are left out
+        edges, counts = binned_counts(closest_distances)
+        ax.hist(edges[:-1], bins=edges, weights=counts, alpha=0.8, color='blue')
+        report_out_of_range(closest_distances)
+    else:
+        ax.hist(closest_distances, bins=bins, alpha=0.8, color='blue')
     ax.set_xlabel('Distance (m)')
     ax.set_ylabel('Frequency')
 
@@ -32,17 +45,112 @@ def plot_distance_stats(closest_distances, bins=10, figsize=(10, 5)):
     plt.show()
     
 
-def plot_distance_comparison(distances1, distances2, labels=['Method 1', 'Method 2'], title='Distance Comparison'):
-    fig, ax = plt.subplots(figsize=(8, 6))
-    sns.histplot(distances1, kde=True, color='blue', label=labels[0], ax=ax)
-    sns.histplot(distances2, kde=True, color='green', label=labels[1], ax=ax)
-    ax.set(xlabel='Distance (m)', ylabel='Frequency', title=title)
-    plt.legend()
-    plt.show()
-    
+def binned_counts(stats):
+    """Bin edges and counts of a DistanceStats, up to its last non-empty bin"""
+    used = np.flatnonzero(stats.counts)
+    last = used[-1] + 1 if len(used) else 1
+    return stats.bin_edges[:last + 1], stats.counts[:last]
+
+
+def report_out_of_range(stats, label=None):
+    """Print how many distances fell outside the histogram range of a DistanceStats"""
+    prefix = f"{label}: " if label else ""
+    if stats.overflow:
+        print(f"{prefix}{stats.overflow:g} distances above {stats.bin_edges[-1]:g} m are not shown in the histogram")
+    if stats.underflow:
+        print(f"{prefix}{stats.underflow:g} distances below {stats.bin_edges[0]:g} m are not shown in the histogram")
+
+
+def binned_kde(edges, counts, n=None, bandwidth=None):
+    """Gaussian KDE of a histogram on uniform bins, as smoothed counts per bin.
+
+    The counts are convolved with the kernel by FFT, so the cost depends on
+    the number of bins and not on the number of samples. The bandwidth
+    defaults to Silverman's rule from the binned mean and spread.
+    """
+    width = edges[1] - edges[0]
+    centres = (edges[:-1] + edges[1:]) / 2
+    total = counts.sum()
+    if total <= 0:
+        return np.zeros(len(counts))
+    if bandwidth is None:
+        mean = np.dot(counts, centres) / total
+        std = np.sqrt(np.dot(counts, (centres - mean) ** 2) / total)
+        cdf = np.cumsum(counts) / total
+        iqr = np.interp(0.75, cdf, centres) - np.interp(0.25, cdf, centres)
+        spread = min(std, iqr / 1.34) if iqr > 0 else std
+        bandwidth = max(0.9 * spread * (n or total) ** -0.2, width)
+
+    # Kernel over +-4 bandwidths, zero padding keeps the circular convolution from wrapping around
+    half = int(np.ceil(4 * bandwidth / width))
+    kernel = np.exp(-0.5 * (np.arange(-half, half + 1) * width / bandwidth) ** 2)
+    kernel /= kernel.sum()
+    size = len(counts) + len(kernel) - 1
+    smoothed = np.fft.irfft(np.fft.rfft(counts, size) * np.fft.rfft(kernel, size), size)
+    return np.clip(smoothed[half:half + len(counts)], 0, None)
 
 
+def as_distance_stats(distances, bin_edges):
+    if isinstance(distances, DistanceStats):
+        return distances
+    return DistanceStats.from_array(distances, bin_edges=bin_edges)
+
+
+@profiled
+def plot_distance_comparison(distances1, distances2, labels=['Method 1', 'Method 2'], title='Distance Comparison',
+                             binned=None, bins=200):
+    """Compare two distance distributions.
+
+    With binned (the default for DistanceStats inputs or more than 100,000
+    distances) both distributions are reduced to fixed-bin histograms and a
+    t-digest first, and the figure is drawn from those alone: histograms with
+    an FFT-binned KDE, the ECDFs and the quantile difference. Otherwise the
+    raw samples go to seaborn's histplot with a KDE.
+    """
+    if binned is None:
+        binned = any(isinstance(d, DistanceStats) or np.size(d) > 100_000 for d in [distances1, distances2])
+    if not binned:
+        fig, ax = plt.subplots(figsize=(8, 6))
+        sns.histplot(distances1, kde=True, color='blue', label=labels[0], ax=ax)
+        sns.histplot(distances2, kde=True, color='green', label=labels[1], ax=ax)
+        ax.set(xlabel='Distance (m)', ylabel='Frequency', title=title)
+        plt.legend()
+        plt.show()
+        return
+
+    # Raw arrays are binned on shared edges spanning both
+    raw = [np.asarray(d, dtype=np.float64) for d in [distances1, distances2] if not isinstance(d, DistanceStats)]
+    upper = max([np.nanmax(d[np.isfinite(d)], initial=0) for d in raw], default=0) or 1
+    bin_edges = np.linspace(0, upper, bins + 1)
+    stats1, stats2 = as_distance_stats(distances1, bin_edges), as_distance_stats(distances2, bin_edges)
+
+    fig, (ax_hist, ax_ecdf, ax_diff) = plt.subplots(1, 3, figsize=(18, 5))
+    fig.suptitle(title)
+    for stats, color, label in zip([stats1, stats2], ['blue', 'green'], labels):
+        edges, counts = binned_counts(stats)
+        centres = (edges[:-1] + edges[1:]) / 2
+        ax_hist.hist(centres, bins=edges, weights=counts, color=color, alpha=0.5, label=label)
+        report_out_of_range(stats, label)
+        if np.allclose(np.diff(edges), edges[1] - edges[0]):
+            ax_hist.plot(centres, binned_kde(edges, counts, n=stats.n), color=color)
+
+        # ECDF at the bin edges, counting values below the first edge
+        cumulative = stats.underflow + np.r_[0, np.cumsum(counts)]
+        ax_ecdf.step(edges, cumulative / stats.weight, where='post', color=color, label=label)
+
+    q = np.linspace(0.01, 0.99, 99)
+    ax_diff.plot(q * 100, stats2.quantile(q) - stats1.quantile(q), color='black')
+    ax_diff.axhline(0, color='gray', linewidth=0.8)
+
+    ax_hist.set(xlabel='Distance (m)', ylabel='Frequency')
+    ax_ecdf.set(xlabel='Distance (m)', ylabel='Cumulative share', ylim=(0, 1.02))
+    ax_diff.set(xlabel='Percentile', ylabel=f'{labels[1]} - {labels[0]} (m)', title='Quantile difference')
+    ax_hist.legend()
+    ax_ecdf.legend()
+    plt.show()
+
 
+@profiled
 def plot_coordinate_comparison(closest_points, path_destinations):
     closest_x = [point.x for point in closest_points]
     closest_y = [point.y for point in closest_points]
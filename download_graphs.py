@@ -1,4 +1,5 @@
 import osmnx as ox
+from graph_snapshot import save_snapshot
 
 
 def download_place(place_name):
@@ -6,6 +7,7 @@ def download_place(place_name):
      filename = f"data/graph_{place_name.strip().replace(',', '').replace(' ', '_')}"
      ox.save_graph_geopackage(graph,f"{filename}.gpkg")
      ox.save_graphml(graph,f"{filename}.graphml")
+     save_snapshot(graph,f"{filename}.snapshot")
 
 list_places = ["Derby,England","London,England"]
 for place in list_places:
@@ -0,0 +1,229 @@
+import os
+import json
+import numpy as np
+import networkx as nx
+import osmnx as ox
+import shapely
+import geopandas as gpd
+import pandas as pd
+from pyproj import CRS, Transformer
+from routing_engine import CompiledGraph, register_compiled
+
+
+SNAPSHOT_VERSION = 1
+LATLON_CRS = 'EPSG:4326'
+
+NODE_ARRAYS = ['node_ids', 'x', 'y', 'x_proj', 'y_proj']
+EDGE_ARRAYS = ['u', 'v', 'key', 'length', 'has_geometry', 'geometry_offsets', 'geometry_coords']
+
+
+def snapshot_path(filename):
+    """Directory of the snapshot that sits next to a GraphML file"""
+    return os.path.splitext(filename)[0] + '.snapshot'
+
+
+def is_snapshot(path):
+    return os.path.isfile(os.path.join(path, 'meta.json'))
+
+
+def save_snapshot(graph, path):
+    """Write a street graph as columnar .npy arrays plus a small JSON header.
+
+    Node coordinates are kept in lat/lon (x, y) and in the projected CRS
+    (x_proj, y_proj) whatever the CRS of the input graph. Edge geometries are
+    packed into one coordinate array, in the CRS of the input graph, indexed by
+    geometry_offsets. Other node and edge attributes are not kept.
+    """
+    os.makedirs(path, exist_ok=True)
+    crs = CRS.from_user_input(graph.graph['crs'])
+
+    # Nodes
+    node_ids = np.array(list(graph.nodes), dtype=np.int64)
+    index = {node: idx for idx, node in enumerate(node_ids.tolist())}
+    node_x = np.fromiter((d for n, d in graph.nodes(data='x')), dtype=np.float64, count=len(node_ids))
+    node_y = np.fromiter((d for n, d in graph.nodes(data='y')), dtype=np.float64, count=len(node_ids))
+    if crs.is_projected:
+        crs_proj = crs
+        x_proj, y_proj = node_x, node_y
+        x, y = Transformer.from_crs(crs, LATLON_CRS, always_xy=True).transform(node_x, node_y)
+    else:
+        # Same UTM zone osmnx would pick when projecting the graph
+        centre = gpd.GeoDataFrame(geometry=gpd.points_from_xy([node_x.mean()], [node_y.mean()]), crs=crs)
+        crs_proj = CRS.from_user_input(ox.projection.project_gdf(centre).crs)
+        x, y = Transformer.from_crs(crs, LATLON_CRS, always_xy=True).transform(node_x, node_y)
+        x_proj, y_proj = Transformer.from_crs(crs, crs_proj, always_xy=True).transform(node_x, node_y)
+
+    # Edges, with geometries packed as one coordinate array
+    edges = list(graph.edges(keys=True, data=True))
+    u = np.fromiter((index[a] for a, b, k, d in edges), dtype=np.int32, count=len(edges))
+    v = np.fromiter((index[b] for a, b, k, d in edges), dtype=np.int32, count=len(edges))
+    key = np.fromiter((k for a, b, k, d in edges), dtype=np.int32, count=len(edges))
+    length = np.fromiter((d.get('length', np.nan) for a, b, k, d in edges), dtype=np.float64, count=len(edges))
+    geometries = np.array([d.get('geometry') for a, b, k, d in edges], dtype=object)
+    has_geometry = ~shapely.is_missing(geometries)
+    geometry_coords, geometry_index = shapely.get_coordinates(geometries, return_index=True)
+    geometry_offsets = np.searchsorted(geometry_index, np.arange(len(edges) + 1)).astype(np.int64)
+
+    arrays = {
+        'node_ids': node_ids, 'x': np.asarray(x), 'y': np.asarray(y),
+        'x_proj': np.asarray(x_proj), 'y_proj': np.asarray(y_proj),
+        'u': u, 'v': v, 'key': key, 'length': length, 'has_geometry': has_geometry,
+        'geometry_offsets': geometry_offsets, 'geometry_coords': geometry_coords,
+    }
+    for name, array in arrays.items():
+        np.save(os.path.join(path, f'{name}.npy'), np.ascontiguousarray(array))
+
+    graph_attrs = {key: value for key, value in graph.graph.items() if isinstance(value, (str, int, float, bool)) and key != 'crs'}
+    meta = {
+        'version': SNAPSHOT_VERSION,
+        'crs': crs.to_string(),
+        'crs_proj': crs_proj.to_string(),
+        'projected': crs.is_projected,
+        'graph_attrs': graph_attrs,
+    }
+    # Header last, so a half-written snapshot is never picked up
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+
+
+class GraphSnapshot:
+    """Memory-mapped street graph written by save_snapshot.
+
+    Opening a snapshot only maps the arrays; the networkx graph, the
+    GeoDataFrames and the compiled routing graph are built on first use.
+    """
+
+    def __init__(self, path, mmap_mode='r'):
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        if self.meta['version'] != SNAPSHOT_VERSION:
+            raise ValueError(f"{path} has snapshot version {self.meta['version']}, expected {SNAPSHOT_VERSION}")
+        self.path = path
+        self.arrays = {name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode=mmap_mode)
+                       for name in NODE_ARRAYS + EDGE_ARRAYS}
+        self._graphs = {}
+        self._compiled = {}
+
+    def __getattr__(self, name):
+        arrays = self.__dict__.get('arrays', {})
+        if name in arrays:
+            return arrays[name]
+        raise AttributeError(name)
+
+    def _resolve(self, projected):
+        return self.meta['projected'] if projected is None else projected
+
+    def crs(self, projected=None):
+        return self.meta['crs_proj'] if self._resolve(projected) else LATLON_CRS
+
+    def node_coords(self, projected=None):
+        if self._resolve(projected):
+            return self.x_proj, self.y_proj
+        return self.x, self.y
+
+    def geometry_coords_in(self, projected=None):
+        """Packed edge geometry coordinates in the requested CRS"""
+        coords = self.geometry_coords
+        if self._resolve(projected) == self.meta['projected'] or not len(coords):
+            return coords
+        source = self.meta['crs_proj'] if self.meta['projected'] else LATLON_CRS
+        x, y = Transformer.from_crs(source, self.crs(projected), always_xy=True).transform(coords[:, 0], coords[:, 1])
+        return np.column_stack([x, y])
+
+    def compiled_graph(self, projected=None):
+        """CompiledGraph straight from the arrays, without building a networkx graph"""
+        projected = self._resolve(projected)
+        if projected not in self._compiled:
+            x, y = self.node_coords(projected)
+            self._compiled[projected] = CompiledGraph.from_edges(self.node_ids, self.u, self.v, self.length,
+                                                                 x=x, y=y, crs=self.crs(projected))
+        return self._compiled[projected]
+
+    def to_graph(self, projected=None):
+        """Rebuild the osmnx MultiDiGraph, in the stored CRS unless projected says otherwise"""
+        projected = self._resolve(projected)
+        if projected in self._graphs:
+            return self._graphs[projected]
+
+        graph = nx.MultiDiGraph(crs=self.crs(projected), **self.meta['graph_attrs'])
+        node_ids = self.node_ids.tolist()
+        x, y = self.node_coords(projected)
+        if projected:
+            node_attrs = ({'x': a, 'y': b, 'lon': lon, 'lat': lat} for a, b, lon, lat in
+                          zip(x.tolist(), y.tolist(), self.x.tolist(), self.y.tolist()))
+        else:
+            node_attrs = ({'x': a, 'y': b} for a, b in zip(x.tolist(), y.tolist()))
+        graph.add_nodes_from(zip(node_ids, node_attrs))
+
+        # Unpack geometries only for the edges that had one
+        geometries = np.full(len(self.u), None, dtype=object)
+        if self.has_geometry.any():
+            geometries[self.has_geometry] = self._packed_linestrings(projected)
+        edge_ids = np.asarray(self.node_ids)
+        edge_attrs = ({'length': length} if geometry is None else {'length': length, 'geometry': geometry}
+                      for length, geometry in zip(self.length.tolist(), geometries))
+        graph.add_edges_from(zip(edge_ids[self.u].tolist(), edge_ids[self.v].tolist(), self.key.tolist(), edge_attrs))
+
+        register_compiled(graph, self.compiled_graph(projected))
+        self._graphs[projected] = graph
+        return graph
+
+    def _packed_linestrings(self, projected=None):
+        counts = np.diff(self.geometry_offsets)[self.has_geometry]
+        indices = np.repeat(np.arange(len(counts)), counts)
+        return shapely.linestrings(self.geometry_coords_in(projected), indices=indices)
+
+    def nodes_gdf(self, projected=None):
+        """Same layout as ox.graph_to_gdfs(graph, edges=False), built from the arrays"""
+        x, y = self.node_coords(projected)
+        index = pd.Index(np.asarray(self.node_ids), name='osmid')
+        return gpd.GeoDataFrame({'x': np.asarray(x), 'y': np.asarray(y)}, index=index,
+                                geometry=gpd.points_from_xy(x, y), crs=self.crs(projected))
+
+    def edges_gdf(self, projected=None):
+        """Same layout as ox.graph_to_gdfs(graph, nodes=False), built from the arrays.
+
+        Edges without a stored geometry get a straight line between their nodes.
+        """
+        x, y = self.node_coords(projected)
+        has_geometry = np.asarray(self.has_geometry)
+        counts = np.where(has_geometry, np.diff(self.geometry_offsets), 2)
+
+        coords = np.empty((counts.sum(), 2), dtype=np.float64)
+        from_geometry = np.repeat(has_geometry, counts)
+        coords[from_geometry] = self.geometry_coords_in(projected)
+        u, v = np.asarray(self.u)[~has_geometry], np.asarray(self.v)[~has_geometry]
+        coords[~from_geometry] = np.column_stack([x[u], y[u], x[v], y[v]]).reshape(-1, 2)
+        lines = shapely.linestrings(coords, indices=np.repeat(np.arange(len(counts)), counts))
+
+        node_ids = np.asarray(self.node_ids)
+        index = pd.MultiIndex.from_arrays([node_ids[self.u], node_ids[self.v], np.asarray(self.key)], names=['u', 'v', 'key'])
+        return gpd.GeoDataFrame({'length': np.asarray(self.length)}, index=index, geometry=lines, crs=self.crs(projected))
+
+
+def load_snapshot(path, mmap_mode='r'):
+    return GraphSnapshot(path, mmap_mode=mmap_mode)
+
+
+def find_snapshot(filename):
+    """Snapshot for a graph file, or None when there is none or the GraphML is newer"""
+    path = filename if is_snapshot(filename) else snapshot_path(filename)
+    if not is_snapshot(path):
+        return None
+    if path != filename and os.path.exists(filename):
+        if os.path.getmtime(os.path.join(path, 'meta.json')) < os.path.getmtime(filename):
+            return None
+    return load_snapshot(path)
+
+
+def load_graph(filename, prefer_snapshot=False):
+    """Load a graph from GraphML, or from its snapshot when prefer_snapshot is set and one is up to date.
+
+    The snapshot keeps node coordinates and edge keys, lengths and geometries
+    only (no osmid, highway, oneway, name or street_count), so it is opt-in
+    for callers that just route and draw.
+    """
+    snapshot = find_snapshot(filename) if prefer_snapshot else None
+    if snapshot is not None:
+        return snapshot.to_graph()
+    return ox.load_graphml(filename)
@@ -4,16 +4,24 @@ import networkx as nx
 import geopandas as gpd
 import matplotlib.pyplot as plt
 import random
+import numpy as np
+from routing_engine import check_engine, compile_graph
+import graph_snapshot
+from node_snapper import nearest_nodes
+from profiling import profiled, stage
 
 
+@profiled
 def get_graph_from_points(src_points, dest_points, network_type='walk'):
     bbox = pd.concat([src_points, dest_points]).total_bounds
     graph = ox.graph_from_bbox(bbox[3], bbox[1], bbox[2], bbox[0], network_type=network_type, simplify=False)
     return graph
+@profiled
 def get_graph_from_place(name, network_type='walk'):
     graph = ox.graph_from_place(name, network_type=network_type, simplify=True)
     return graph
 
+@profiled
 def nodes_edges(graph):
     # Get edges from the graph
     edges = ox.graph_to_gdfs(graph, nodes=False)
@@ -21,6 +29,7 @@ def nodes_edges(graph):
     nodes = ox.graph_to_gdfs(graph, edges=False)
     return nodes,edges
 
+@profiled
 def project_graph(graph):
     graph = ox.project_graph(graph)
     # Get the GeoDataFrame
@@ -29,11 +38,16 @@ def project_graph(graph):
     nodes = ox.graph_to_gdfs(graph, edges=False)
     return graph,nodes,edges
 
+@profiled
 def save_graph(graph,filename):
     ox.save_graphml(graph,filename)
+    # Binary snapshot next to the GraphML file for fast loading
+    graph_snapshot.save_snapshot(graph, graph_snapshot.snapshot_path(filename))
 
-def load_graph(filename):
-    return ox.load_graphml(filename)
+@profiled
+def load_graph(filename, prefer_snapshot=False):
+    # GraphML with all the OSM attributes, or the up to date snapshot (lengths and geometries only) when preferred
+    return graph_snapshot.load_graph(filename, prefer_snapshot=prefer_snapshot)
 
 def generate_random_points_from_nodes(nodes,n=100):
     random.seed(100)
@@ -43,51 +57,90 @@ def generate_random_points_from_nodes(nodes,n=100):
 
 
 
-def get_nearest_point_graph(graph, destinations, sources):
-    # Project graph to UTM for metric measurements
-    graph_proj, nodes_proj, edges_proj = project_graph(graph)
-    
-    # Get UTM coordinates
-    CRS_utm = nodes_proj.crs
-    
-    # Reproject sources and destinations data to UTM
+@profiled(name='snap', items=lambda result: len(result[0]) + len(result[1]))
+def snap_sources_destinations(graph_proj, sources, destinations):
+    # Reproject sources and destinations data to the CRS of the graph
+    CRS_utm = graph_proj.graph['crs']
     src_utm = sources.to_crs(crs=CRS_utm)
     dest_utm = destinations.to_crs(crs=CRS_utm)
-    
+
     # Get the closest nodes to each source and destination point
-    closest_target_nodes = ox.distance.nearest_nodes(G=graph_proj, X=dest_utm.geometry.x, Y=dest_utm.geometry.y)
-    closest_sources_nodes = ox.distance.nearest_nodes(G=graph_proj, X=src_utm.geometry.x, Y=src_utm.geometry.y)
-    
+    closest_target_nodes = nearest_nodes(G=graph_proj, X=dest_utm.geometry.x, Y=dest_utm.geometry.y)
+    closest_sources_nodes = nearest_nodes(G=graph_proj, X=src_utm.geometry.x, Y=src_utm.geometry.y)
+    return closest_target_nodes, closest_sources_nodes
+
+
+@profiled(name='merge', items=lambda result: len(result[2]))
+def merge_nearest_destinations(sources, destinations, closest_sources_nodes, closest_target_nodes, path_data):
     # Create DataFrames for sources and destinations with corresponding nodes
     sources_df = pd.DataFrame({'source_coords': sources, 'source_node': closest_sources_nodes})
     destinations_df = pd.DataFrame({'destination_coords': destinations, 'destination_node': closest_target_nodes})
+
+    # Merge DataFrames
+    df = pd.merge(destinations_df,path_data, on='destination_node')
+    df = pd.merge(sources_df,df, on='source_node',sort=False,how='left')
+
+    origin_points = gpd.GeoSeries(df['source_coords'])
+    destination_points = gpd.GeoSeries(df['destination_coords'])
+    closest_distances = df['distance']
+
+    return origin_points,destination_points,closest_distances
+
+
+@profiled(items=lambda result: len(result[2]))
+def get_nearest_point_graph(graph, destinations, sources, engine='networkx'):
+    check_engine(engine)
+    # Project graph to UTM for metric measurements
+    graph_proj, nodes_proj, edges_proj = project_graph(graph)
     
+    # Get the closest nodes to each source and destination point
+    closest_target_nodes, closest_sources_nodes = snap_sources_destinations(graph_proj, sources, destinations)
     
     # Get the shortest path based on the target_destinations
-    path_length, path_nodes = nx.multi_source_dijkstra(graph_proj, closest_target_nodes, weight='length')
+    if engine == 'csr':
+        path_data = nearest_destination_csr(graph_proj, closest_target_nodes)
+    else:
+        path_data = nearest_destination_networkx(graph_proj, closest_target_nodes)
+    
+    return merge_nearest_destinations(sources, destinations, closest_sources_nodes, closest_target_nodes, path_data)
+
+
+@profiled(items=len)
+def nearest_destination_networkx(graph_proj, closest_target_nodes, weight='length'):
+    with stage('dijkstra', items=len(graph_proj)):
+        path_length, path_nodes = nx.multi_source_dijkstra(graph_proj, closest_target_nodes, weight=weight)
     
     # Extract path nodes
     destination_node, origin_node = zip(*[(path[0], path[-1]) for path in path_nodes.values()])
     
     # Create a DataFrame from path
-    path_data = pd.DataFrame({"source_node": origin_node, 'destination_node': destination_node, "distance": list(path_length.values())})
-    
-    # Merge DataFrames
-    df = pd.merge(destinations_df,path_data, on='destination_node')
-    df = pd.merge(sources_df,df, on='source_node',sort=False,how='left')
+    return pd.DataFrame({"source_node": origin_node, 'destination_node': destination_node, "distance": list(path_length.values())})
+
 
+@profiled(items=len)
+def nearest_destination_csr(graph_proj, closest_target_nodes, weight='length'):
+    # One compiled multi-source search labels every node with its closest destination node
+    compiled = compile_graph(graph_proj, weight=weight)
+    distances, _, origins = compiled.multi_source(closest_target_nodes)
+    reached = np.flatnonzero(origins >= 0)
     
+    return pd.DataFrame({"source_node": compiled.node_ids[reached],
+                         'destination_node': compiled.node_ids[origins[reached]],
+                         "distance": distances[reached]})
 
-    origin_points = gpd.GeoSeries(df['source_coords'])
-    destination_points = gpd.GeoSeries(df['destination_coords'])
-    closest_distances = df['distance']
 
-    return origin_points,destination_points,closest_distances
+@profiled
+def k_nearest_destinations_csr(graph_proj, closest_target_nodes, k, weight='length', limit=np.inf):
+    # One multi-label search gives every node its k closest destinations, nearest first
+    compiled = compile_graph(graph_proj, weight=weight)
+    distances, labels = compiled.k_nearest_sources(closest_target_nodes, k, limit=limit)
+    return compiled.node_ids, distances, labels
 
 
 # # get the graph using the limits of the points
 # graph= get_graph_from_points(src_gdf, dest_gdf)
 
+@profiled
 def plot_edges(sources,destinations,graph):
     
     fig, ax = plt.subplots(1, figsize=(6,6),frameon=True)
@@ -0,0 +1,148 @@
+import heapq
+import numpy as np
+import pandas as pd
+from routing_engine import compile_graph
+from node_snapper import nearest_nodes
+
+
+class AccessibilityState:
+    """Distance to the nearest destination and its label for every node, kept up to date under edits.
+
+    Destinations are numbered slots; labels[i] is the slot of the destination
+    closest to node position i (-1 where none is reachable). Adding a
+    destination relaxes outwards from it only while it improves on the
+    current distances, and removing one clears the nodes it served and
+    repairs them from their neighbours outside that area. Both cost time in
+    proportion to the nodes whose answer changes, not to the size of the
+    city. With reverse=False (the default, as get_nearest_point_graph) the
+    searches follow edge direction from the destinations; with reverse=True
+    distances are from every node to the destinations.
+    """
+
+    def __init__(self, compiled, distances, labels, slot_nodes, active, reverse=False):
+        self.compiled = compiled
+        self.distances = distances
+        self.labels = labels
+        self.slot_nodes = slot_nodes
+        self.active = active
+        self.reverse = reverse
+
+    @classmethod
+    def build(cls, compiled, destination_nodes, reverse=False):
+        """One full multi-source search; slot k is destination_nodes[k]"""
+        destination_nodes = list(destination_nodes)
+        slot_nodes = [int(idx) for idx in np.atleast_1d(compiled.index_of(destination_nodes))] if destination_nodes else []
+        state = cls(compiled, np.full(len(compiled), np.inf), np.full(len(compiled), -1, dtype=np.int64),
+                    slot_nodes, [True] * len(slot_nodes), reverse)
+        if slot_nodes:
+            distances, _, origins = compiled.multi_source(destination_nodes, reverse=reverse)
+            # The first slot on a node owns the nodes that node is closest to
+            slot_at = np.full(len(compiled), -1, dtype=np.int64)
+            slot_at[slot_nodes[::-1]] = np.arange(len(slot_nodes))[::-1]
+            reached = origins >= 0
+            state.distances[reached] = distances[reached]
+            state.labels[reached] = slot_at[origins[reached]]
+        return state
+
+    @classmethod
+    def from_graph(cls, graph_proj, destinations, reverse=False):
+        """Build from a projected graph and destination points, snapped to their nearest nodes"""
+        dest_utm = destinations.to_crs(crs=graph_proj.graph['crs'])
+        closest_target_nodes = nearest_nodes(G=graph_proj, X=dest_utm.geometry.x, Y=dest_utm.geometry.y)
+        return cls.build(compile_graph(graph_proj), closest_target_nodes, reverse=reverse)
+
+    def copy(self):
+        """Independent state sharing the compiled graph, to explore a scenario and throw it away"""
+        return AccessibilityState(self.compiled, self.distances.copy(), self.labels.copy(),
+                                  list(self.slot_nodes), list(self.active), self.reverse)
+
+    def _adjacency(self):
+        # Edges the search moves along
+        forward, backward = self.compiled.adjacency_lists()
+        return backward if self.reverse else forward
+
+    def _relax(self, heap):
+        """Settle (distance, node, slot) entries while they beat the stored distance; returns the changed nodes"""
+        indptr, indices, weights = self._adjacency()
+        distances, labels = self.distances, self.labels
+        changed = []
+        heapq.heapify(heap)
+        while heap:
+            d, u, slot = heapq.heappop(heap)
+            if d >= distances[u]:
+                continue
+            distances[u] = d
+            labels[u] = slot
+            changed.append(u)
+            for e in range(indptr[u], indptr[u + 1]):
+                v = indices[e]
+                nd = d + weights[e]
+                if nd < distances[v]:
+                    heapq.heappush(heap, (nd, v, slot))
+        return np.unique(np.array(changed, dtype=np.int64))
+
+    def add_destination(self, node):
+        """Open a destination at a node id; returns its slot and the positions of the nodes it now serves"""
+        node_idx = int(self.compiled.index_of(node))
+        slot = len(self.slot_nodes)
+        self.slot_nodes.append(node_idx)
+        self.active.append(True)
+        return slot, self._relax([(0.0, node_idx, slot)])
+
+    def remove_destination(self, slot):
+        """Close the destination in a slot; returns the positions of the nodes it served, now repaired"""
+        if not self.active[slot]:
+            raise KeyError(f"Destination slot {slot} is not open")
+        self.active[slot] = False
+        affected = np.flatnonzero(self.labels == slot)
+        self.distances[affected] = np.inf
+        self.labels[affected] = -1
+        if not len(affected):
+            return affected
+
+        # Seeds on the boundary: every edge from a node outside the cleared area into an affected node
+        matrix = self.compiled.matrix if self.reverse else self.compiled.reverse_matrix
+        starts = matrix.indptr[affected]
+        counts = matrix.indptr[affected + 1] - starts
+        edges = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+        nodes = np.repeat(affected, counts)
+        neighbours = matrix.indices[edges]
+        outside = self.labels[neighbours] >= 0
+        nodes, neighbours = nodes[outside], neighbours[outside]
+        seeds = self.distances[neighbours] + matrix.data[edges[outside]]
+
+        # Several neighbours can reach the same node: keep only the closest one of each
+        order = np.lexsort((seeds, nodes))
+        nodes, neighbours, seeds = nodes[order], neighbours[order], seeds[order]
+        first = np.ones(len(nodes), dtype=bool)
+        first[1:] = nodes[1:] != nodes[:-1]
+        heap = list(zip(seeds[first].tolist(), nodes[first].tolist(), self.labels[neighbours[first]].tolist()))
+
+        # Other open destinations on the same nodes take over at distance zero, the first slot on a node as in build
+        slot_nodes = np.asarray(self.slot_nodes, dtype=np.int64)
+        open_slots = np.flatnonzero(np.asarray(self.active) & np.isin(slot_nodes, affected))
+        _, first_slot = np.unique(slot_nodes[open_slots], return_index=True)
+        heap.extend((0.0, int(slot_nodes[slot]), int(slot)) for slot in open_slots[first_slot])
+
+        self._relax(heap)
+        return affected
+
+    def move_destination(self, slot, node):
+        """Close a slot and open the destination again at another node; returns the new slot"""
+        self.remove_destination(slot)
+        return self.add_destination(node)[0]
+
+    @property
+    def destination_nodes(self):
+        """Node ids of the open destinations, by slot (None for closed slots)"""
+        node_ids = self.compiled.node_ids
+        return [node_ids[idx].item() if open_ else None for idx, open_ in zip(self.slot_nodes, self.active)]
+
+    def to_frame(self):
+        """Reached nodes with their closest destination node and distance, as nearest_destination_csr"""
+        reached = np.flatnonzero(self.labels >= 0)
+        slot_nodes = np.asarray(self.slot_nodes, dtype=np.int64)
+        return pd.DataFrame({"source_node": self.compiled.node_ids[reached],
+                             'destination_node': self.compiled.node_ids[slot_nodes[self.labels[reached]]],
+                             'slot': self.labels[reached],
+                             "distance": self.distances[reached]})
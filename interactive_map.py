@@ -7,48 +7,78 @@ from shapely.geometry import LineString
 import geopandas as gpd
 import matplotlib.pyplot as plt
 import matplotlib.colors as mcolors
-import pandas as pd
+import numpy as np
 import random
+from routing_engine import check_engine, compile_graph
+from nearest_destination import DestinationField
+from node_snapper import nearest_nodes
+from profiling import profiled
+
+def compute_distances_and_paths_from_single_node(node_id, graph_utm, closest_target_nodes, weight, engine='networkx'):
+    check_engine(engine)
+    if engine == 'csr':
+        return compute_distances_and_paths_from_single_node_csr(node_id, graph_utm, closest_target_nodes, weight)
 
-def compute_distances_and_paths_from_single_node(node_id, graph_utm, closest_target_nodes, weight):
     distances, paths = nx.single_source_dijkstra(graph_utm, node_id, weight=weight)
     # Filter the results to only include the specified destinations
     filtered_distances = {destination: distances[destination] for destination in closest_target_nodes if destination in distances}
     filtered_paths = {destination: paths[destination] for destination in closest_target_nodes if destination in paths}
     return node_id, filtered_distances, filtered_paths
 
-def compute_all_distances_and_paths(graph_utm, destinations, weight='length'):
+def compute_distances_and_paths_from_single_node_csr(node_id, graph_utm, closest_target_nodes, weight):
+    compiled = compile_graph(graph_utm, weight=weight)
+    distances, predecessors = compiled.single_source(node_id)
+
+    # Filter the results to only include the reachable destinations
+    destinations = list(closest_target_nodes)
+    destination_idx = compiled.index_of(destinations) if destinations else []
+    reached = [(destination, idx) for destination, idx in zip(destinations, destination_idx) if np.isfinite(distances[idx])]
+    filtered_distances = {destination: float(distances[idx]) for destination, idx in reached}
+    filtered_paths = {destination: compiled.node_ids[compiled.path_indices(predecessors, idx)].tolist() for destination, idx in reached}
+    return node_id, filtered_distances, filtered_paths
+
+def compute_distances_and_predecessors_from_single_node(node_id, graph_utm, weight):
+    predecessors, distances = nx.dijkstra_predecessor_and_distance(graph_utm, node_id, weight=weight)
+    # The first predecessor is the one single_source_dijkstra builds its paths from
+    return node_id, distances, {node: pred[0] for node, pred in predecessors.items() if pred}
+
+@profiled
+def compute_all_distances_and_paths(graph_utm, destinations, weight='length', engine='networkx'):
+    """Distances and paths between every node and every destination.
+
+    Returns dict-like (all_distances, all_paths) views, indexed
+    [node][destination node], over one DestinationField holding a float32
+    distance matrix and an int32 predecessor array per destination. Paths are
+    rebuilt on lookup; save with all_distances.field.save(path).
+    """
+    check_engine(engine)
     print("computing all distances and paths to destinations points")
     # Reproject destinations data to UTM
     dest_utm = destinations.to_crs(crs=graph_utm.graph['crs'])
     
     # Get the closest nodes to each destination point
-    closest_target_nodes = ox.distance.nearest_nodes(G=graph_utm, X=dest_utm.geometry.x, Y=dest_utm.geometry.y)
-
-    # Partially apply the function to be parallelized with the required arguments
-    compute_partial = partial(compute_distances_and_paths_from_single_node, graph_utm=graph_utm, closest_target_nodes=graph_utm.nodes, weight=weight)
+    closest_target_nodes = nearest_nodes(G=graph_utm, X=dest_utm.geometry.x, Y=dest_utm.geometry.y)
 
-    # Parallelize the calculations
-    with mp.Pool(mp.cpu_count()) as pool:
-        results = pool.map(compute_partial, closest_target_nodes)
+    compiled = compile_graph(graph_utm, weight=weight)
+    if engine == 'csr':
+        # The compiled searches run in C, share one compiled graph instead of a pool of copies
+        field = DestinationField.build(compiled, closest_target_nodes, reverse=False)
+    else:
+        # Partially apply the function to be parallelized with the required arguments
+        compute_partial = partial(compute_distances_and_predecessors_from_single_node, graph_utm=graph_utm, weight=weight)
 
-    # Initialize dictionaries for all_distances and all_paths
-    all_distances = {}
-    all_paths = {}
+        # Parallelize the calculations
+        with mp.Pool(mp.cpu_count()) as pool:
+            results = pool.map(compute_partial, closest_target_nodes)
 
-    # Iterate over the results from the parallelized calculations
-    for node_id, distances, paths in results:
-        all_distances[node_id] = distances
-        all_paths[node_id] = paths
-        
-    #inverse the order of dictionary
-    all_distances = pd.DataFrame(all_distances).transpose().to_dict()
-    all_paths = pd.DataFrame(all_paths).transpose().to_dict()
+        # Pack the searches from each destination into the compact arrays
+        field = DestinationField.from_searches(compiled, closest_target_nodes, results, reverse=False)
 
-    return all_distances, all_paths
+    return field.views()
 
 
 #plot an static map
+@profiled
 def plot_paths_routes_one_node(all_paths, all_distances, nodes,edges,closest_target_nodes, destinations, origin_node, ax=None):
     
     if ax is None:
@@ -112,7 +142,7 @@ class PointBrowser:
         self.ax = ax
         self.nodes = nodes
         self.edges = edges
-        self.closest_target_nodes = ox.distance.nearest_nodes(G=graph, X=destinations.geometry.x, Y=destinations.geometry.y)
+        self.closest_target_nodes = nearest_nodes(G=graph, X=destinations.geometry.x, Y=destinations.geometry.y)
         
         
         self.edges.plot(ax=self.ax, color='gray', linewidth=0.5, alpha=0.7)
@@ -131,7 +161,7 @@ class PointBrowser:
 
         # Find the nearest node to the click location
         clicked_point = (event.ydata, event.xdata)
-        origin_node = ox.distance.nearest_nodes(self.graph, X=[clicked_point[1]], Y=[clicked_point[0]])[0]
+        origin_node = nearest_nodes(self.graph, X=[clicked_point[1]], Y=[clicked_point[0]])[0]
 
         self.update_plot(origin_node)
         
@@ -191,7 +221,8 @@ class PointBrowser2:
         self.destinations.plot(ax=self.ax, color='blue', label='Destinations')
 
 
-        self.closest_target_nodes = ox.distance.nearest_nodes(G=self.graph, X=self.destinations.geometry.x, Y=self.destinations.geometry.y)
+        self.closest_target_nodes = nearest_nodes(G=self.graph, X=self.destinations.geometry.x, Y=self.destinations.geometry.y)
+        self.destination_field = DestinationField.build(compile_graph(self.graph), self.closest_target_nodes)
         self.list_axes_children_before = list(self.ax.get_children())
 
         # Initial plot
@@ -204,7 +235,7 @@ class PointBrowser2:
 
         # Find the nearest node to the click location
         clicked_point = (event.ydata, event.xdata)
-        origin_node = ox.distance.nearest_nodes(self.graph, X=[clicked_point[1]], Y=[clicked_point[0]])[0]
+        origin_node = nearest_nodes(self.graph, X=[clicked_point[1]], Y=[clicked_point[0]])[0]
 
         self.update_plot(origin_node)
 
@@ -220,7 +251,7 @@ class PointBrowser2:
         plt.xlabel("x (m)")
         plt.ylabel("y (m)")
         
-        node_id, filtered_distances, filtered_paths = compute_distances_and_paths_from_single_node(origin_node, self.graph, self.closest_target_nodes, weight='length')
+        filtered_distances, filtered_paths = self.destination_field.routes(origin_node)
         
         paths = [LineString(list(self.nodes.loc[filtered_paths[destination]].geometry.values)) for destination in filtered_paths]
         # Create GeoDataFrame from paths
@@ -260,7 +291,8 @@ class PointBrowser3:
         self.destinations.plot(ax=self.ax, color='blue', label='Destinations')
 
 
-        self.closest_target_nodes = ox.distance.nearest_nodes(G=self.graph, X=self.destinations.geometry.x, Y=self.destinations.geometry.y)
+        self.closest_target_nodes = nearest_nodes(G=self.graph, X=self.destinations.geometry.x, Y=self.destinations.geometry.y)
+        self.destination_field = DestinationField.build(compile_graph(self.graph), self.closest_target_nodes)
         self.list_axes_children_before = list(self.ax.get_children())
 
         # Initial plot
@@ -273,7 +305,7 @@ class PointBrowser3:
 
         # Find the nearest node to the click location
         clicked_point = (event.ydata, event.xdata)
-        origin_node = ox.distance.nearest_nodes(self.graph, X=[clicked_point[1]], Y=[clicked_point[0]])[0]
+        origin_node = nearest_nodes(self.graph, X=[clicked_point[1]], Y=[clicked_point[0]])[0]
 
         self.update_plot(origin_node)
 
@@ -289,7 +321,7 @@ class PointBrowser3:
         plt.xlabel("x (m)")
         plt.ylabel("y (m)")
         
-        node_id, filtered_distances, filtered_paths = compute_distances_and_paths_from_single_node(origin_node, self.graph, self.closest_target_nodes, weight='length')
+        filtered_distances, filtered_paths = self.destination_field.routes(origin_node)
         
         paths = [LineString(list(self.nodes.loc[filtered_paths[destination]].geometry.values)) for destination in filtered_paths]
         # Create GeoDataFrame from paths
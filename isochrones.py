@@ -0,0 +1,95 @@
+import numpy as np
+import shapely
+import geopandas as gpd
+from routing_engine import compile_graph
+from node_snapper import nearest_nodes
+
+
+# 4.8 km/h, a common planning assumption for walking
+WALKING_SPEED = 80.0  # metres per minute
+
+
+def service_area(compiled, reached, distances, limit, buffer=25.0):
+    """Polygon covering every point of the network within limit, buffered by `buffer` metres.
+
+    reached and distances are node positions and their distance to the
+    destinations (see CompiledGraph.bounded_multi_source with reverse=True).
+    An edge into a node within limit is covered for the length still left
+    at that node, cut along the straight line between its end nodes, so
+    edges only partly walked count only as far as they are walked.
+    """
+    remaining = np.full(len(compiled), -np.inf)
+    remaining[reached] = limit - distances
+    in_band = reached[distances <= limit]
+
+    # Every edge that leads into a node within limit
+    matrix = compiled.reverse_matrix
+    starts = matrix.indptr[in_band]
+    counts = matrix.indptr[in_band + 1] - starts
+    edges = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+    ends = np.repeat(in_band, counts)
+    others = matrix.indices[edges]
+    lengths = matrix.data[edges]
+
+    # Share of each edge that can be walked, measured back from the node within limit
+    covered = np.minimum(lengths, remaining[ends])
+    share = np.divide(covered, lengths, out=np.ones(len(lengths)), where=lengths > 0)
+    walked = (covered > 0) & (others != ends)
+    ends, others, share = ends[walked], others[walked], share[walked]
+
+    points = np.column_stack([compiled.x[in_band], compiled.y[in_band]])
+    area = shapely.buffer(shapely.multipoints(points), buffer)
+    if len(ends):
+        start = np.column_stack([compiled.x[ends], compiled.y[ends]])
+        stop = start + share[:, None] * (np.column_stack([compiled.x[others], compiled.y[others]]) - start)
+        coords = np.column_stack([start, stop]).reshape(-1, 2)
+        lines = shapely.linestrings(coords, indices=np.repeat(np.arange(len(ends)), 2))
+        area = shapely.union(area, shapely.buffer(shapely.multilinestrings(lines), buffer))
+    return area
+
+
+def compute_isochrones(graph_proj, destinations, cutoffs, unit='m', walking_speed=WALKING_SPEED,
+                       buffer=25.0, per_destination=False):
+    """Walking catchments around destinations for a list of distance or time cutoffs.
+
+    cutoffs are metres, or minutes with unit='min' at walking_speed metres per
+    minute. One search per destination set (or per destination with
+    per_destination=True) stops at the largest cutoff, so the cost follows the
+    size of the catchment rather than of the city. Returns one row per
+    destination set and cutoff with the reached node ids and a service area
+    polygon built from the reached edges, partly reached edges cut where
+    the cutoff runs out.
+    """
+    if unit not in ('m', 'min'):
+        raise ValueError(f"Unknown unit {unit!r}, expected 'm' or 'min'")
+    CRS = graph_proj.graph['crs']
+    compiled = compile_graph(graph_proj)
+
+    # Cutoffs in metres, largest last
+    cutoffs = sorted(cutoffs)
+    limits = [cutoff * walking_speed if unit == 'min' else cutoff for cutoff in cutoffs]
+
+    # Get the closest node to each destination
+    dest_utm = destinations.to_crs(crs=CRS)
+    destination_nodes = nearest_nodes(G=graph_proj, X=dest_utm.geometry.x, Y=dest_utm.geometry.y)
+    if per_destination:
+        groups = [(label, [node]) for label, node in zip(destinations.index, destination_nodes)]
+    else:
+        groups = [(None, destination_nodes)]
+
+    rows = []
+    for label, nodes in groups:
+        # Searched against edge direction: distances are from each node to the destinations
+        reached, distances, _ = compiled.bounded_multi_source(nodes, limit=limits[-1], reverse=True)
+        for cutoff, limit in zip(cutoffs, limits):
+            in_band = reached[distances <= limit]
+            rows.append({
+                'destination': label,
+                'cutoff': cutoff,
+                'distance': limit,
+                'n_nodes': len(in_band),
+                'nodes': compiled.node_ids[in_band],
+                'geometry': service_area(compiled, reached, distances, limit, buffer=buffer),
+            })
+
+    return gpd.GeoDataFrame(rows, geometry='geometry', crs=CRS)
@@ -1,4 +1,5 @@
 import matplotlib.pyplot as plt
+import profiling
 from random_coord_generator import generate_random_points,plot_source_destination_points
 from nearest_point import get_nearest_point
 from plot_lines_nearest_point import plot_connected_points
@@ -13,6 +14,9 @@ from interactive_map import compute_all_distances_and_paths
 from interactive_map import PointBrowser,PointBrowser2,PointBrowser3
 
 
+# Per-stage times, memory and counts of this run, written to output/profile.json
+profiling.enable(rss=True)
+
 graph_input = 'load'
 
 if graph_input == 'make_city':
@@ -79,23 +83,25 @@ plot_distance_comparison(closest_distances, path_distances,
                           labels=['Straight Lines', 'Shortest Path'],
                           title='Distance Comparison: Straight Lines vs. Shortest Path')
 
+profiling.print_summary()
+profiling.save_report("output/profile.json")
+
 
 
 
 
 
 # if __name__ == '__main__':
-#     import pickle
+#     from routing_engine import compile_graph
+#     from nearest_destination import DestinationField
 #     compute_nodes_destinations = True
     
+#     graph_utm, nodes_utm, edges_utm = project_graph(graph)
 #     if compute_nodes_destinations:
-#         graph_utm, nodes_utm, edges_utm = project_graph(graph)
-#         all_distances, all_paths = compute_all_distances_and_paths(graph_utm, destinations)
-#         with open('data/all_distances_and_paths.pkl', 'wb') as f:
-#             pickle.dump((all_distances, all_paths), f)
+#         all_distances, all_paths = compute_all_distances_and_paths(graph_utm, destinations, engine='csr')
+#         all_distances.field.save('data/all_distances_and_paths')
 #     else:
-#         with open('data/all_distances_and_paths.pkl', 'rb') as f:
-#             all_distances, all_paths = pickle.load(f)
+#         all_distances, all_paths = DestinationField.load('data/all_distances_and_paths', compile_graph(graph_utm)).views()
     
     
     
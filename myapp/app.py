@@ -1,6 +1,7 @@
 import random
 import matplotlib.colors as mcolors
 import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 import osmnx as ox
 import networkx as nx
 import geopandas as gpd
@@ -26,12 +27,17 @@ nodes = ox.graph_to_gdfs(graph_utm, edges=False)
 edges = ox.graph_to_gdfs(graph_utm, nodes=False)
 closest_target_nodes = ox.distance.nearest_nodes(G=graph_utm, X=dest_utm.geometry.x, Y=dest_utm.geometry.y)
 
-fig, ax = plt.subplots()
 crs = graph_utm.graph['crs']
-edges.plot(ax=ax, color='gray', linewidth=0.5, alpha=0.7)
-dest_utm.plot(ax=ax, color='blue', label='Destinations')
-plt.axis('off')
-list_axes_children_before = list(ax.get_children())
+
+
+def session_figure():
+    # Each session draws on its own figure, the graph and GeoDataFrames above are shared read-only
+    fig = Figure()
+    ax = fig.add_subplot()
+    edges.plot(ax=ax, color='gray', linewidth=0.5, alpha=0.7)
+    dest_utm.plot(ax=ax, color='blue', label='Destinations')
+    ax.axis('off')
+    return fig, ax
 
 app_ui = ui.page_fluid(
   
@@ -42,6 +48,9 @@ app_ui = ui.page_fluid(
 )
 
 def server(input: Inputs, output: Outputs, session: Session):
+    fig, ax = session_figure()
+    list_axes_children_before = list(ax.get_children())
+
     def remove_diff_list(temp1, temp2): 
        return [item.remove() for item in temp2 if item not in temp1]
    
@@ -60,8 +69,8 @@ def server(input: Inputs, output: Outputs, session: Session):
 
         nodes.loc[[origin_node]].plot(ax=ax, color='red', label='Origin')
         ax.legend(loc='upper center', bbox_to_anchor=(0.5, -0.1), fancybox=False, shadow=False, ncol=2, fontsize=13)
-        plt.xlabel("x (m)")
-        plt.ylabel("y (m)")
+        ax.set_xlabel("x (m)")
+        ax.set_ylabel("y (m)")
 
         node_id, filtered_distances, filtered_paths = compute_distances_and_paths_from_single_node(origin_node, graph_utm, closest_target_nodes, weight='length')
 
@@ -0,0 +1,199 @@
+import os
+import json
+from collections.abc import Mapping
+import numpy as np
+import shapely
+
+
+class DestinationField:
+    """Distance and predecessor pointer from every node to each destination.
+
+    Built with one search per destination over a CompiledGraph. With
+    reverse=True (the default) the searches run against edge direction, so
+    `distances[d, v]` is the distance *from* node v *to* destination d and
+    `predecessors[d, v]` is the next node on that route. A route for any
+    node is then an array lookup plus a walk along the predecessor chain.
+    """
+
+    def __init__(self, compiled, destination_nodes, distances, predecessors, reverse=True, graph_fingerprint=None):
+        self.compiled = compiled
+        self.destination_nodes = np.asarray(destination_nodes)
+        self.distances = distances
+        self.predecessors = predecessors
+        self.reverse = reverse
+        # CompiledGraph.fingerprint stored with a saved field; None for a field built from compiled
+        self.graph_fingerprint = graph_fingerprint
+
+    @classmethod
+    def build(cls, compiled, destination_nodes, reverse=True, limit=np.inf, chunk_size=16):
+        destination_nodes = np.asarray(destination_nodes)
+        distances = np.empty((len(destination_nodes), len(compiled)), dtype=np.float32)
+        predecessors = np.empty((len(destination_nodes), len(compiled)), dtype=np.int32)
+
+        # Search a few destinations at a time to bound the float64 scratch arrays
+        for start in range(0, len(destination_nodes), chunk_size):
+            chunk = destination_nodes[start:start + chunk_size]
+            dist, pred = compiled.single_source(chunk, limit=limit, reverse=reverse)
+            distances[start:start + chunk_size] = dist
+            predecessors[start:start + chunk_size] = pred
+
+        return cls(compiled, destination_nodes, distances, predecessors, reverse=reverse)
+
+    @classmethod
+    def from_searches(cls, compiled, destination_nodes, results, reverse=False):
+        """Pack (node_id, distances, predecessor) dicts from networkx searches, one per destination"""
+        distances = np.full((len(destination_nodes), len(compiled)), np.inf, dtype=np.float32)
+        predecessors = np.full((len(destination_nodes), len(compiled)), -9999, dtype=np.int32)
+        for row, (node_id, node_distances, node_predecessors) in enumerate(results):
+            if node_distances:
+                distances[row, compiled.index_of(list(node_distances))] = list(node_distances.values())
+            if node_predecessors:
+                predecessors[row, compiled.index_of(list(node_predecessors))] = compiled.index_of(list(node_predecessors.values()))
+        return cls(compiled, destination_nodes, distances, predecessors, reverse=reverse)
+
+    def node_distances(self, node):
+        """Distance between node and every destination, inf where unreachable"""
+        return self.distances[:, self.compiled.index_of(node)]
+
+    def path_indices(self, node_idx, destination_idx):
+        """Node positions of the route between a node and one destination, in travel order"""
+        predecessors = self.predecessors[destination_idx]
+        path = [int(node_idx)]
+        step = predecessors[node_idx]
+        while step >= 0:
+            path.append(int(step))
+            step = predecessors[step]
+        # Forward searches walk back from the node towards the destination
+        if not self.reverse:
+            path.reverse()
+        return path
+
+    def path(self, node, destination_idx):
+        return self.compiled.node_ids[self.path_indices(self.compiled.index_of(node), destination_idx)].tolist()
+
+    def path_coords(self, node_idx, destination_idx):
+        """Coordinates of many routes at once, walking all predecessor chains together.
+
+        Returns the (n, 2) coordinates and, for each coordinate, the position of
+        its route in the input arrays. Routes come out in travel order.
+        """
+        destination_idx = np.asarray(destination_idx)
+        current = np.array(node_idx, dtype=np.int64)
+        active = np.arange(len(current))
+        walkers = [active]
+        steps = [current.copy()]
+        while len(active):
+            following = self.predecessors[destination_idx[active], current[active]]
+            active = active[following >= 0]
+            current[active] = following[following >= 0]
+            walkers.append(active)
+            steps.append(current[active])
+
+        walker = np.concatenate(walkers)
+        step_nodes = np.concatenate(steps)
+        # Stable sort keeps the steps of each route in walking order
+        order = np.argsort(walker, kind='stable')
+        walker, step_nodes = walker[order], step_nodes[order]
+        if not self.reverse:
+            # Forward searches walk from the node back to the destination
+            step = np.arange(len(walker)) - np.searchsorted(walker, walker)
+            order = np.lexsort((-step, walker))
+            walker, step_nodes = walker[order], step_nodes[order]
+        return np.column_stack([self.compiled.x[step_nodes], self.compiled.y[step_nodes]]), walker
+
+    def path_lines(self, node_idx, destination_idx):
+        """Shapely LineStrings through the nodes of each route, shared between repeated routes"""
+        pairs, inverse = np.unique(np.column_stack([destination_idx, node_idx]), axis=0, return_inverse=True)
+        coords, walker = self.path_coords(pairs[:, 1], pairs[:, 0])
+        return shapely.linestrings(coords, indices=walker)[inverse.ravel()]
+
+    def routes(self, node):
+        """Distances and paths to the reachable destinations, keyed by destination node.
+
+        Same output as interactive_map.compute_distances_and_paths_from_single_node
+        without running a search.
+        """
+        node_idx = self.compiled.index_of(node)
+        distances = self.distances[:, node_idx]
+        filtered_distances = {}
+        filtered_paths = {}
+        for destination_idx, destination in enumerate(self.destination_nodes.tolist()):
+            if np.isfinite(distances[destination_idx]):
+                filtered_distances[destination] = float(distances[destination_idx])
+                filtered_paths[destination] = self.compiled.node_ids[self.path_indices(node_idx, destination_idx)].tolist()
+        return filtered_distances, filtered_paths
+
+    def views(self):
+        """Dict-like (all_distances, all_paths) keyed by node then destination node.
+
+        Same layout as the nested dicts compute_all_distances_and_paths used to
+        return, but rows and paths are only built when a node is looked up.
+        """
+        return FieldDistances(self), FieldPaths(self)
+
+    def save(self, path):
+        """Write the arrays as raw .npy files so load can memory-map them"""
+        os.makedirs(path, exist_ok=True)
+        arrays = {'node_ids': self.compiled.node_ids, 'destination_nodes': self.destination_nodes,
+                  'distances': self.distances, 'predecessors': self.predecessors}
+        for name, array in arrays.items():
+            np.save(os.path.join(path, f'{name}.npy'), np.ascontiguousarray(array))
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump({'reverse': self.reverse, 'graph_fingerprint': self.graph_fingerprint or self.compiled.fingerprint}, f)
+
+    @classmethod
+    def load(cls, path, compiled, mmap_mode='r'):
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        arrays = {name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode=mmap_mode)
+                  for name in ['node_ids', 'destination_nodes', 'distances', 'predecessors']}
+        if not np.array_equal(arrays['node_ids'], compiled.node_ids):
+            raise ValueError(f"{path} was built for a different graph")
+        # Fields saved before the fingerprint was stored count as stale in load_or_build_field
+        return cls(compiled, np.asarray(arrays['destination_nodes']), arrays['distances'], arrays['predecessors'],
+                   reverse=meta['reverse'], graph_fingerprint=meta.get('graph_fingerprint', ''))
+
+
+class FieldDistances(Mapping):
+    """node -> {destination node: distance} view of a DestinationField"""
+
+    def __init__(self, field):
+        self.field = field
+
+    def __getitem__(self, node):
+        distances = self.field.node_distances(node)
+        return {destination: float(distance) for destination, distance
+                in zip(self.field.destination_nodes.tolist(), distances) if np.isfinite(distance)}
+
+    def __iter__(self):
+        return iter(self.field.compiled.node_ids.tolist())
+
+    def __len__(self):
+        return len(self.field.compiled)
+
+
+class FieldPaths(FieldDistances):
+    """node -> {destination node: path} view of a DestinationField"""
+
+    def __getitem__(self, node):
+        return self.field.routes(node)[1]
+
+
+def load_or_build_field(compiled, destination_nodes, path, reverse=True):
+    """Load a saved DestinationField, rebuilding and saving it if missing or stale.
+
+    Stale means other destinations, another direction, or a graph whose
+    nodes, edges or weights changed since the field was saved.
+    """
+    if os.path.exists(os.path.join(path, 'meta.json')):
+        try:
+            field = DestinationField.load(path, compiled)
+            if (field.reverse == reverse and np.array_equal(field.destination_nodes, destination_nodes)
+                    and field.graph_fingerprint == compiled.fingerprint):
+                return field
+        except ValueError:
+            pass
+
+    field = DestinationField.build(compiled, destination_nodes, reverse=reverse)
+    field.save(path)
+    return field
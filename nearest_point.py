@@ -1,38 +1,119 @@
 import geopandas as gpd
 from sklearn.neighbors import BallTree
+from concurrent.futures import ThreadPoolExecutor
+from pyproj import CRS, Transformer
 import numpy as np
+import shapely
+from node_snapper import EARTH_RADIUS_M
+from profiling import profiled
 
+
+def point_coords(points, crs):
+    """(n, 2) x/y coordinates of points and their CRS, without a Python loop.
+
+    points can be a GeoSeries/GeoDataFrame (its own CRS wins over crs), an
+    array of shapely points or an (n, 2) coordinate array.
+    """
+    if hasattr(points, 'geometry'):
+        crs = points.crs or crs
+        points = points.geometry.values
+    points = np.asarray(points)
+    if points.dtype == object:
+        points = shapely.get_coordinates(points)
+    return np.asarray(points, dtype=np.float64).reshape(-1, 2), crs
+
+
+def transform_coords(coords, from_crs, to_crs):
+    if CRS.from_user_input(from_crs) == CRS.from_user_input(to_crs):
+        return coords
+    x, y = Transformer.from_crs(from_crs, to_crs, always_xy=True).transform(coords[:, 0], coords[:, 1])
+    return np.column_stack([x, y])
+
+
+class NearestPointIndex:
+    """BallTree on a set of destination points, built once and queried many times.
+
+    With metric='haversine' the tree holds lat/lon radians and distances are
+    great-circle metres, so nothing is reprojected. With metric='euclidean'
+    the destinations are projected once to target_crs.
+    """
+
+    def __init__(self, dest_points, metric='haversine', source_crs='EPSG:4326', target_crs='EPSG:3857', leaf_size=15):
+        if metric not in ('haversine', 'euclidean'):
+            raise ValueError(f"Unknown metric {metric!r}, expected 'haversine' or 'euclidean'")
+        self.metric = metric
+        self.source_crs = source_crs
+        self.target_crs = 'EPSG:4326' if metric == 'haversine' else target_crs
+        self.dest_points = dest_points
+        coords, self.dest_crs = point_coords(dest_points, source_crs)
+        self.tree = BallTree(self._tree_coords(coords, self.dest_crs), leaf_size=leaf_size, metric=metric)
+
+    def _tree_coords(self, coords, crs):
+        coords = transform_coords(coords, crs, self.target_crs)
+        if self.metric == 'haversine':
+            # BallTree's haversine wants (lat, lon) in radians
+            return np.radians(coords[:, ::-1])
+        return coords
+
+    def __len__(self):
+        return self.tree.data.shape[0]
+
+    def _query_coords(self, coords, crs, k):
+        distances, indices = self.tree.query(self._tree_coords(coords, crs), k=min(k, len(self)))
+        if self.metric == 'haversine':
+            distances *= EARTH_RADIUS_M
+        return distances, indices
+
+    def query_chunks(self, src_points, k=1, chunk_size=1_000_000):
+        """Yield (start, distances, indices) for consecutive chunks of the source points"""
+        coords, crs = point_coords(src_points, self.source_crs)
+        for start in range(0, len(coords), chunk_size):
+            yield (start, *self._query_coords(coords[start:start + chunk_size], crs, k))
+
+    def query(self, src_points, k=1, chunk_size=1_000_000, n_jobs=1):
+        """Distances (metres) and indices of the k nearest destinations, as (n, k) arrays.
+
+        Sources are processed chunk_size at a time, across n_jobs threads.
+        """
+        coords, crs = point_coords(src_points, self.source_crs)
+        k = min(k, len(self))
+        distances = np.empty((len(coords), k), dtype=np.float64)
+        indices = np.empty((len(coords), k), dtype=np.int64)
+
+        def run(start):
+            chunk = slice(start, start + chunk_size)
+            distances[chunk], indices[chunk] = self._query_coords(coords[chunk], crs, k)
+
+        starts = range(0, len(coords), chunk_size)
+        if n_jobs > 1:
+            with ThreadPoolExecutor(n_jobs) as pool:
+                list(pool.map(run, starts))
+        else:
+            for start in starts:
+                run(start)
+        return distances, indices
+
+    def nearest_points(self, indices):
+        """Destination geometries at the given indices, in their own CRS"""
+        geometries = self.dest_points.geometry.values if hasattr(self.dest_points, 'geometry') else np.asarray(self.dest_points)
+        return gpd.GeoSeries(geometries[indices], crs=self.dest_crs)
+
+
+@profiled(items=lambda result: len(result[1]))
 def get_nearest_point(src_points, dest_points, k_neighbors=1, source_crs='EPSG:4326', target_crs='EPSG:3857'):
     """Find nearest neighbors for all source points from a set of candidate points"""
-    
-    # Convert to GeoDataFrames with the source CRS
-    src_gdf = gpd.GeoDataFrame(geometry=src_points, crs=source_crs)
-    dest_points_gdf = gpd.GeoDataFrame(geometry=dest_points, crs=source_crs)
-    
-    # Project to the target CRS
-    src_gdf = src_gdf.to_crs(target_crs)
-    dest_points_gdf = dest_points_gdf.to_crs(target_crs)
-    
-    # get coordinates for BallTree
-    src_coords = np.array([geom.coords[0] for geom in src_gdf.geometry])
-    dest_points_coords = np.array([geom.coords[0] for geom in dest_points_gdf.geometry])
-
-    # Create tree from the destination points
-    tree = BallTree(dest_points_coords, leaf_size=15)
 
-    # Find closest points and distances
-    distances, indices = tree.query(src_coords, k=k_neighbors)
+    # Build the tree on the destinations projected to the target CRS
+    index = NearestPointIndex(dest_points, metric='euclidean', source_crs=source_crs, target_crs=target_crs)
 
-    # Transpose to get distances and indices into arrays
-    distances = distances.transpose()
-    indices = indices.transpose()
+    # Find closest points and distances
+    distances, indices = index.query(src_points, k=k_neighbors)
 
-    # Get closest indices and distances (i.e. array at index 0)
-    closest = indices[0]
-    closest_dist = distances[0]
+    # Get closest indices and distances (i.e. column 0)
+    closest = indices[:, 0]
+    closest_dist = distances[:, 0]
 
-    # Convert points back to its original crs
-    closest_points = [dest_points_gdf.geometry.iloc[idx] for idx in closest]
-    closest_points = gpd.GeoSeries(closest_points, crs=target_crs).to_crs(source_crs)
+    # Closest points in their original crs
+    closest_points = index.nearest_points(closest)
 
     return (closest_points, closest_dist)
@@ -0,0 +1,91 @@
+import weakref
+import numpy as np
+from pyproj import CRS
+from scipy.spatial import cKDTree
+
+
+# Same mean earth radius osmnx uses for great-circle distances
+EARTH_RADIUS_M = 6_371_009
+
+# snappers are kept alongside their networkx graph and freed with it
+_snappers = weakref.WeakKeyDictionary()
+
+
+class NodeSnapper:
+    """KD-tree on the node coordinates of a street graph, built once and queried many times.
+
+    Projected graphs are indexed on their planar coordinates. Graphs in
+    lat/lon are indexed on unit-sphere coordinates, so the nearest node is the
+    great-circle nearest, as with osmnx. Snap distances are in metres for both.
+    """
+
+    def __init__(self, node_ids, x, y, crs=None):
+        self.node_ids = np.asarray(node_ids)
+        self.geographic = crs is not None and CRS.from_user_input(crs).is_geographic
+        self.tree = cKDTree(self._tree_coords(x, y))
+
+    @classmethod
+    def from_graph(cls, graph):
+        x = np.fromiter((d for n, d in graph.nodes(data='x')), dtype=np.float64, count=len(graph))
+        y = np.fromiter((d for n, d in graph.nodes(data='y')), dtype=np.float64, count=len(graph))
+        return cls(np.array(list(graph.nodes)), x, y, crs=graph.graph.get('crs'))
+
+    @classmethod
+    def from_compiled(cls, compiled):
+        return cls(compiled.node_ids, compiled.x, compiled.y, crs=compiled.crs)
+
+    def _tree_coords(self, x, y):
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        if not self.geographic:
+            return np.column_stack([x, y])
+        lon, lat = np.radians(x), np.radians(y)
+        return np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+
+    def query(self, X, Y, max_distance=None, workers=1):
+        """Nearest node ids and snap distances in metres for arrays of coordinates.
+
+        Points further than max_distance from every node get node id -1 and an
+        infinite distance.
+        """
+        coords = self._tree_coords(np.atleast_1d(X), np.atleast_1d(Y))
+        bound = np.inf
+        if max_distance is not None:
+            bound = 2 * np.sin(max_distance / (2 * EARTH_RADIUS_M)) if self.geographic else max_distance
+        distances, idx = self.tree.query(coords, distance_upper_bound=bound, workers=workers)
+
+        found = idx < len(self.node_ids)
+        nodes = np.full(len(idx), -1, dtype=self.node_ids.dtype if self.node_ids.dtype.kind in 'iu' else object)
+        nodes[found] = self.node_ids[idx[found]]
+        if self.geographic:
+            # Chord length on the unit sphere to great-circle metres
+            distances = 2 * EARTH_RADIUS_M * np.arcsin(np.clip(distances / 2, 0, 1))
+        distances[~found] = np.inf
+        return nodes, distances
+
+
+def get_node_snapper(graph):
+    """Return the NodeSnapper of a graph, building it on first use.
+
+    The snapper is cached per graph object, so node coordinates must not be
+    modified after the first query.
+    """
+    if graph not in _snappers:
+        _snappers[graph] = NodeSnapper.from_graph(graph)
+    return _snappers[graph]
+
+
+def nearest_nodes(G, X, Y, return_dist=False, max_distance=None):
+    """Drop-in for ox.distance.nearest_nodes that reuses the graph's cached KD-tree.
+
+    Returns lists for array-like input and scalars for scalar input, as the
+    osmnx function does, so the results can go straight to networkx.
+    """
+    nodes, distances = get_node_snapper(G).query(X, Y, max_distance=max_distance)
+    if np.ndim(X) == 0:
+        nodes, distances = nodes[0].item(), distances[0].item()
+    else:
+        nodes, distances = nodes.tolist(), distances.tolist()
+    if return_dist:
+        return nodes, distances
+    return nodes
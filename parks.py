@@ -1,6 +1,7 @@
 import osmnx as ox
 import geopandas as gpd
 import matplotlib.pyplot as plt
+from graph_snapshot import load_graph
 
 # get all building footprints in some neighborhood
 # `True` means retrieve any object with this tag, regardless of value
@@ -8,11 +9,8 @@ place = "Derby,England"
 tags = {"leisure": ["park","nature_reserve"]}
 gdf = ox.geometries_from_place(place, tags)
 
-
-def load_graph(filename):
-    return ox.load_graphml(filename)
-
-graph = load_graph("data/graph.graphml")
+# Only the edges are drawn, so the snapshot (lengths and geometries) is enough
+graph = load_graph("data/graph.graphml", prefer_snapshot=True)
 
 nodes = ox.graph_to_gdfs(graph, edges=False)
 edges = ox.graph_to_gdfs(graph, nodes=False)
@@ -1,42 +1,113 @@
 import matplotlib.pyplot as plt
+from matplotlib import cm, colormaps, colors
 from matplotlib.collections import LineCollection
-from shapely.geometry import LineString
-import geopandas as gpd
+import shapely
 import numpy as np
+from profiling import profiled
+
+
+def point_array(points):
+    """(n, 2) coordinates of points given as a GeoSeries, a sequence of shapely points or an array"""
+    if isinstance(points, np.ndarray) and points.dtype != object:
+        return points[:, :2].astype(np.float64)
+    return shapely.get_coordinates(np.asarray(points, dtype=object))
+
+
+def rasterize_lines(start, end, values, extent, shape, max_samples=4_000_000):
+    """Number of lines through each pixel and the sum of their finite values.
+
+    Every line is sampled about once per pixel along its length and the
+    samples are binned with np.bincount, in batches of at most max_samples
+    samples, so memory stays bounded whatever the number of lines.
+    """
+    xmin, xmax, ymin, ymax = extent
+    height, width = shape
+    # Line ends in pixel units, rows counted from the top
+    px0, px1 = (start[:, 0] - xmin) * width / (xmax - xmin), (end[:, 0] - xmin) * width / (xmax - xmin)
+    py0, py1 = (ymax - start[:, 1]) * height / (ymax - ymin), (ymax - end[:, 1]) * height / (ymax - ymin)
+    steps = np.ceil(np.maximum(np.abs(px1 - px0), np.abs(py1 - py0))).astype(np.int64) + 1
+    finite = np.isfinite(values)
+    values = np.where(finite, values, 0.0)
+
+    density = np.zeros(height * width)
+    value_sum = np.zeros(height * width)
+    value_count = np.zeros(height * width)
+    # Batches of consecutive lines with about max_samples samples each
+    bounds = np.searchsorted(np.cumsum(steps), np.arange(max_samples, steps.sum(), max_samples))
+    for lines in np.split(np.arange(len(steps)), np.unique(bounds)):
+        if not len(lines):
+            continue
+        line_steps = steps[lines]
+        line = np.repeat(lines, line_steps)
+        offset = np.arange(line_steps.sum()) - np.repeat(np.cumsum(line_steps) - line_steps, line_steps)
+        t = offset / np.maximum(steps[line] - 1, 1)
+        col = np.clip((px0[line] + t * (px1[line] - px0[line])).astype(np.int64), 0, width - 1)
+        row = np.clip((py0[line] + t * (py1[line] - py0[line])).astype(np.int64), 0, height - 1)
+        pixel = row * width + col
+        density += np.bincount(pixel, minlength=height * width)
+        value_sum += np.bincount(pixel, weights=values[line], minlength=height * width)
+        value_count += np.bincount(pixel, weights=finite[line], minlength=height * width)
+
+    return density.reshape(shape), value_sum.reshape(shape), value_count.reshape(shape)
+
+
+@profiled
+def plot_connected_points(src_points, closest_points, closest_distances, figsize=(6, 6),
+                          raster_threshold=200_000, resolution=800):
+    """Lines from every source to its closest point, coloured by distance.
+
+    Above raster_threshold pairs the lines are aggregated on a grid of
+    resolution pixels across instead of drawn one by one: each pixel shows
+    the mean distance of the lines through it, more opaque where more lines
+    pass. The colour scale runs from 0 to the 99th percentile of the
+    finite distances.
+    """
+    start, end = point_array(src_points), point_array(closest_points)
+    distances = np.asarray(closest_distances, dtype=np.float64)
+    finite = distances[np.isfinite(distances)]
+    norm = colors.Normalize(0, np.percentile(finite, 99) if len(finite) else 1)
 
-def plot_connected_points(src_points, closest_points, closest_distances, figsize=(6, 6)):
-    
-    destinations = closest_points.drop_duplicates()
-    # Create a GeoDataFrame with LineStrings connecting src_points and closest_points
-    connections = gpd.GeoDataFrame(
-        geometry=[LineString([src, dst]) for src, dst in zip(src_points, closest_points)],
-        data={'distance': closest_distances}
-        #crs=src_points.crs,
-    )
-    
     fig, ax = plt.subplots(1, figsize=figsize)
     plt.title('Nearest Points Connections')
 
-    # Plot the connecting links between points and color them based on distance
-    segments = [np.array(line.coords)[:, :2] for line in connections.geometry]
-    lc = LineCollection(segments, cmap='viridis', alpha=1, lw=1, zorder=1, label='Closest connection')
-    lc.set_array(closest_distances)
-    lc.set_clim(0, 8_000)  # Set color limits
-    ax.add_collection(lc)
-    
+    if len(distances) > raster_threshold:
+        # Line density and mean distance per pixel, drawn as one image
+        xmin, ymin = np.minimum(start.min(axis=0), end.min(axis=0))
+        xmax, ymax = np.maximum(start.max(axis=0), end.max(axis=0))
+        extent = (xmin, xmax, ymin, ymax)
+        shape = (max(1, round(resolution * (ymax - ymin) / (xmax - xmin))), resolution)
+        density, value_sum, value_count = rasterize_lines(start, end, distances, extent, shape)
+
+        rgba = colormaps['viridis'](norm(np.divide(value_sum, value_count, out=np.zeros(shape), where=value_count > 0)))
+        rgba[..., 3] = np.where(density > 0, 0.2 + 0.8 * np.log1p(density) / np.log1p(density.max()), 0)
+        ax.imshow(rgba, extent=extent, origin='upper', zorder=1, interpolation='nearest')
+        ax.plot([], [], color=colormaps['viridis'](0.5), label='Closest connection')
+        mappable = cm.ScalarMappable(norm=norm, cmap='viridis')
+    else:
+        # Plot the connecting links between points and color them based on distance
+        lc = LineCollection(np.stack([start, end], axis=1), cmap='viridis', norm=norm, alpha=1, lw=1, zorder=1, label='Closest connection')
+        lc.set_array(distances)
+        ax.add_collection(lc)
+        mappable = lc
+
+        # Plot the sources, there are too many to see one by one in the raster mode
+        ax.scatter(start[:, 0], start[:, 1], color='blue', s=2, alpha=0.5, zorder=2, label='People (sources)')
+
     # Add color bar
-    cbar = plt.colorbar(lc, ax=ax)
+    cbar = plt.colorbar(mappable, ax=ax, extend='max')
     # Set colorbar label
     cbar.set_label('Distance (m)')
 
-    # Plot the points
-    src_points.plot(ax=ax, color='blue', markersize=2, alpha=0.5, zorder=2, label='People (sources)')
-    destinations.plot(ax=ax, markersize=2, marker='o', color='red', alpha=1, zorder=3, label='Interest (destinations)')
+    # Plot the destinations
+    # Unique points as complex numbers, much faster than np.unique(axis=0) on millions of rows
+    destinations = np.unique(np.ascontiguousarray(end).view(np.complex128).ravel())
+    ax.scatter(destinations.real, destinations.imag, s=2, marker='o', color='red', alpha=1, zorder=3, label='Interest (destinations)')
+    ax.autoscale_view()
 
     # Put a legend below the current axis
     ax.legend(loc='upper center', bbox_to_anchor=(0.5, -0.1), fancybox=False, shadow=False, ncol=2,fontsize = 13,frameon = False)
     plt.xlabel("lon (degrees)")
     plt.ylabel("lat (degrees)")
-    
+
     plt.show()
     return fig,ax
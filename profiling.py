@@ -0,0 +1,240 @@
+"""Stage timers for pipeline runs, with optional memory tracing and a run report.
+
+    import profiling
+    profiling.enable(memory=True)
+    ...  # the pipeline, its functions are decorated with @profiled
+    profiling.print_summary()
+    profiling.save_report('output/profile.json')
+
+Stages are timed with `with stage(name):` blocks or the @profiled decorator.
+Nested stages are reported under their parent (e.g.
+get_nearest_point_graph/dijkstra). While profiling is off (the default) a
+decorated function only pays one flag check per call. With memory=True every
+stage also gets its tracemalloc peak above the memory in use when it started,
+and with rss=True a thread samples the resident set size and every stage
+gets the highest value seen while it ran. The plotting stages include the
+time plt.show() blocks for on an interactive backend.
+"""
+import os
+import sys
+import json
+import time
+import threading
+import tracemalloc
+from functools import wraps
+from contextlib import contextmanager
+from datetime import datetime, timezone
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+
+class Profiler:
+    """Per-stage call counts, times, memory peaks and item counts of one run"""
+
+    def __init__(self, memory=False, rss=False, rss_interval=0.05):
+        self.memory = memory
+        self.rss = rss and current_rss_mb() is not None
+        self.rss_interval = rss_interval
+        self.stages = {}
+        self.started = time.perf_counter()
+        self.started_at = datetime.now(timezone.utc)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._sampler = None
+        self._open_frames = []
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        if self.rss:
+            self._stop = threading.Event()
+            self._sampler = threading.Thread(target=self._sample_rss, daemon=True)
+            self._sampler.start()
+
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    def _sample_rss(self):
+        while not self._stop.wait(self.rss_interval):
+            rss = current_rss_mb()
+            with self._lock:
+                for frame in self._open_frames:
+                    frame['rss_mb'] = max(frame['rss_mb'], rss)
+
+    @contextmanager
+    def stage(self, name, items=None):
+        """Time the block as stage name; set frame['items'] inside the block to record a count"""
+        stack = self._stack()
+        path = '/'.join([frame['name'] for frame in stack] + [name])
+        frame = {'name': name, 'items': items, 'rss_mb': current_rss_mb() if self.rss else 0.0}
+        if self.memory:
+            current, peak = tracemalloc.get_traced_memory()
+            # The parents keep the peak reached so far before it is reset for this stage
+            for parent in stack:
+                parent['traced_peak'] = max(parent['traced_peak'], peak)
+            tracemalloc.reset_peak()
+            frame['traced_start'], frame['traced_peak'] = current, current
+        stack.append(frame)
+        with self._lock:
+            self._open_frames.append(frame)
+            # Registered on entry so the report lists parents before their nested stages
+            self.stages.setdefault(path, {'calls': 0, 'seconds': 0.0, 'max_seconds': 0.0,
+                                          'peak_mb': None, 'rss_mb': None, 'items': None})
+        start = time.perf_counter()
+        try:
+            yield frame
+        finally:
+            seconds = time.perf_counter() - start
+            stack.pop()
+            with self._lock:
+                self._open_frames.remove(frame)
+            peak_mb = None
+            if self.memory:
+                peak = max(frame['traced_peak'], tracemalloc.get_traced_memory()[1])
+                peak_mb = (peak - frame['traced_start']) / 2**20
+                for parent in stack:
+                    parent['traced_peak'] = max(parent['traced_peak'], peak)
+            if self.rss:
+                frame['rss_mb'] = max(frame['rss_mb'], current_rss_mb())
+            self._record(path, seconds, peak_mb, frame['rss_mb'] if self.rss else None, frame['items'])
+
+    def _record(self, path, seconds, peak_mb, rss_mb, items):
+        with self._lock:
+            record = self.stages[path]
+            record['calls'] += 1
+            record['seconds'] += seconds
+            record['max_seconds'] = max(record['max_seconds'], seconds)
+            if peak_mb is not None:
+                record['peak_mb'] = max(record['peak_mb'] or 0.0, peak_mb)
+            if rss_mb is not None:
+                record['rss_mb'] = max(record['rss_mb'] or 0.0, rss_mb)
+            if items is not None:
+                record['items'] = (record['items'] or 0) + int(items)
+
+    def close(self):
+        if self._sampler is not None:
+            self._stop.set()
+            self._sampler.join()
+            self._sampler = None
+
+    def report(self):
+        """The run as a JSON-ready dict, stages in the order they first started"""
+        return {
+            'started': self.started_at.isoformat(timespec='seconds'),
+            'wall_seconds': time.perf_counter() - self.started,
+            'argv': sys.argv,
+            'python': sys.version.split()[0],
+            'memory': self.memory,
+            'rss': self.rss,
+            'peak_rss_mb': peak_rss_mb(),
+            'stages': self.stages,
+        }
+
+    def summary(self):
+        """Console table of the stages, indented by nesting"""
+        lines = [f"{'stage':<48} {'calls':>6} {'seconds':>9} {'peak MB':>9} {'RSS MB':>9} {'items':>10}"]
+        for path, record in self.stages.items():
+            depth = path.count('/')
+            name = '  ' * depth + path.rsplit('/', 1)[-1]
+            peak = f"{record['peak_mb']:9.1f}" if record['peak_mb'] is not None else f"{'-':>9}"
+            rss = f"{record['rss_mb']:9.1f}" if record['rss_mb'] is not None else f"{'-':>9}"
+            items = f"{record['items']:>10}" if record['items'] is not None else f"{'-':>10}"
+            lines.append(f"{name:<48} {record['calls']:>6} {record['seconds']:9.3f} {peak} {rss} {items}")
+        peak_rss = peak_rss_mb()
+        lines.append(f"Wall time {time.perf_counter() - self.started:.1f} s" + (f", peak RSS {peak_rss:.0f} MB" if peak_rss is not None else ""))
+        return '\n'.join(lines)
+
+
+def current_rss_mb():
+    # Resident set size from /proc, None where there is no /proc
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / 2**20 if sys.platform == 'darwin' else maxrss / 2**10
+
+
+# The active profiler, None while profiling is off
+_profiler = None
+
+
+def enable(memory=False, rss=False, rss_interval=0.05):
+    """Start a new run report; earlier stages are dropped"""
+    global _profiler
+    disable()
+    _profiler = Profiler(memory=memory, rss=rss, rss_interval=rss_interval)
+    return _profiler
+
+
+def disable():
+    global _profiler
+    if _profiler is not None:
+        _profiler.close()
+    _profiler = None
+
+
+def get_profiler():
+    return _profiler
+
+
+@contextmanager
+def stage(name, items=None):
+    """Time a block as a stage of the active run; a no-op while profiling is off"""
+    if _profiler is None:
+        yield {}
+        return
+    with _profiler.stage(name, items) as frame:
+        yield frame
+
+
+def profiled(func=None, name=None, items=None):
+    """Decorator timing every call of a function as a stage.
+
+    items is an optional callable taking the function's return value and
+    giving the number of items processed, e.g. items=len.
+    """
+    def decorator(func):
+        stage_name = name or func.__name__
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if _profiler is None:
+                return func(*args, **kwargs)
+            with _profiler.stage(stage_name) as frame:
+                result = func(*args, **kwargs)
+                if items is not None:
+                    frame['items'] = items(result)
+                return result
+        return wrapper
+
+    return decorator(func) if func is not None else decorator
+
+
+def report():
+    return _profiler.report() if _profiler is not None else None
+
+
+def save_report(path):
+    """Write the run report as JSON"""
+    if _profiler is None:
+        return None
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(_profiler.report(), f, indent=1)
+    return path
+
+
+def print_summary():
+    if _profiler is not None:
+        print(_profiler.summary())
@@ -0,0 +1,415 @@
+import weakref
+import hashlib
+import heapq
+import math
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+
+
+ENGINES = ('networkx', 'csr')
+POINT_TO_POINT_METHODS = ('astar', 'bidirectional', 'dijkstra')
+
+# compiled graphs are kept alongside their networkx graph and freed with it
+_compiled_graphs = weakref.WeakKeyDictionary()
+
+
+def node_positions(node_ids, sorter, nodes):
+    """Positions of nodes in node_ids, given the argsort of node_ids"""
+    nodes = np.asarray(nodes)
+    pos = np.searchsorted(node_ids, nodes, sorter=sorter)
+    pos = np.clip(pos, 0, len(node_ids) - 1)
+    idx = sorter[pos]
+    missing = node_ids[idx] != nodes
+    if np.any(missing):
+        raise KeyError(f"Nodes not in graph: {nodes[missing][:5].tolist()}")
+    return idx
+
+
+def check_engine(engine):
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown routing engine {engine!r}, expected one of {ENGINES}")
+
+
+class CompiledGraph:
+    """Integer-indexed CSR adjacency of a street graph for shortest path queries.
+
+    Nodes are addressed by their original ids in every public method; the
+    position of a node in `node_ids` is its index in the CSR arrays.
+    """
+
+    def __init__(self, node_ids, indptr, indices, weights, x=None, y=None, crs=None):
+        self.node_ids = np.asarray(node_ids)
+        self.indptr = np.asarray(indptr)
+        self.indices = np.asarray(indices)
+        self.weights = np.asarray(weights)
+        self.x = None if x is None else np.asarray(x, dtype=np.float64)
+        self.y = None if y is None else np.asarray(y, dtype=np.float64)
+        self.crs = crs
+        self._sorter = np.argsort(self.node_ids, kind='stable')
+        self._matrix = None
+        self._reverse_matrix = None
+        self._adjacency = None
+        self._coordinates = None
+        self._heuristic_scale = None
+
+    @classmethod
+    def from_graph(cls, graph, weight='length', dtype=np.float64):
+        node_ids = np.array(list(graph.nodes))
+        index = {node: idx for idx, node in enumerate(node_ids.tolist())}
+
+        # Edge endpoints as positions, missing weights count as 1 like networkx
+        edges = graph.edges(data=weight, default=1)
+        u = np.fromiter((index[a] for a, b, w in edges), dtype=np.int64, count=len(edges))
+        v = np.fromiter((index[b] for a, b, w in edges), dtype=np.int64, count=len(edges))
+        w = np.fromiter((w for a, b, w in edges), dtype=np.float64, count=len(edges))
+        if not graph.is_directed():
+            u, v, w = np.concatenate([u, v]), np.concatenate([v, u]), np.concatenate([w, w])
+
+        # Keep node coordinates when the graph has them (osmnx graphs do)
+        x = y = None
+        first = next(iter(graph.nodes(data=True)), (None, {}))[1]
+        if 'x' in first and 'y' in first:
+            x = np.fromiter((d for n, d in graph.nodes(data='x')), dtype=np.float64, count=len(node_ids))
+            y = np.fromiter((d for n, d in graph.nodes(data='y')), dtype=np.float64, count=len(node_ids))
+
+        return cls.from_edges(node_ids, u, v, w, x=x, y=y, crs=graph.graph.get('crs'), dtype=dtype)
+
+    @classmethod
+    def from_edges(cls, node_ids, u, v, weights, x=None, y=None, crs=None, dtype=np.float64):
+        """Build from edge endpoint positions, keeping the shortest of parallel edges"""
+        n = len(node_ids)
+        u = np.asarray(u, dtype=np.int64)
+        v = np.asarray(v, dtype=np.int64)
+        weights = np.asarray(weights, dtype=np.float64)
+
+        # Sort by (u, v, weight) so the first edge of every (u, v) run is the shortest
+        order = np.lexsort((weights, v, u))
+        u, v, weights = u[order], v[order], weights[order]
+        keep = np.ones(len(u), dtype=bool)
+        keep[1:] = (u[1:] != u[:-1]) | (v[1:] != v[:-1])
+        u, v, weights = u[keep], v[keep], weights[keep]
+
+        indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(u, minlength=n), out=indptr[1:])
+        return cls(node_ids, indptr, v.astype(np.int32), weights.astype(dtype), x=x, y=y, crs=crs)
+
+    def __len__(self):
+        return len(self.node_ids)
+
+    @property
+    def n_edges(self):
+        return len(self.indices)
+
+    @property
+    def nbytes(self):
+        arrays = [self.node_ids, self.indptr, self.indices, self.weights, self._sorter, self.x, self.y]
+        return sum(array.nbytes for array in arrays if array is not None)
+
+    @property
+    def fingerprint(self):
+        """Digest of the nodes, edges and weights, to tell whether data derived from the graph is stale"""
+        digest = hashlib.sha1()
+        for array in (self.node_ids, self.indptr, self.indices, self.weights):
+            digest.update(np.ascontiguousarray(array).tobytes())
+        return digest.hexdigest()
+
+    @property
+    def matrix(self):
+        if self._matrix is None:
+            self._matrix = csr_matrix((self.weights, self.indices, self.indptr), shape=(len(self), len(self)))
+        return self._matrix
+
+    @property
+    def reverse_matrix(self):
+        if self._reverse_matrix is None:
+            self._reverse_matrix = self.matrix.transpose().tocsr()
+        return self._reverse_matrix
+
+    def index_of(self, nodes):
+        """Positions of the given node ids in the CSR arrays"""
+        return node_positions(self.node_ids, self._sorter, nodes)
+
+    def _dijkstra(self, indices, limit, reverse, **kwargs):
+        matrix = self.reverse_matrix if reverse else self.matrix
+        return dijkstra(matrix, directed=True, indices=indices, limit=limit, return_predecessors=True, **kwargs)
+
+    def single_source(self, source, limit=np.inf, reverse=False):
+        """Distances and predecessor positions from one node to every node.
+
+        With reverse=True the search runs against edge direction, so distances
+        are *to* the source and predecessors point to the next hop towards it.
+        """
+        return self._dijkstra(self.index_of(source), limit, reverse)
+
+    def multi_source(self, sources, limit=np.inf, reverse=False):
+        """Distance to the closest source, predecessors and the position of that source"""
+        return self._dijkstra(self.index_of(sources), limit, reverse, min_only=True)
+
+    def many_to_many(self, sources, targets, limit=np.inf, reverse=False, chunk_size=64):
+        """Dense (sources x targets) distance matrix, searching a chunk of sources at a time"""
+        src_idx = np.atleast_1d(self.index_of(sources))
+        tgt_idx = np.atleast_1d(self.index_of(targets))
+        matrix = self.reverse_matrix if reverse else self.matrix
+        distances = np.empty((len(src_idx), len(tgt_idx)), dtype=np.float64)
+        for start in range(0, len(src_idx), chunk_size):
+            block = dijkstra(matrix, directed=True, indices=src_idx[start:start + chunk_size], limit=limit)
+            distances[start:start + chunk_size] = block[:, tgt_idx]
+        return distances
+
+    def adjacency_lists(self):
+        """Forward and reverse CSR arrays as Python lists for the heap-based searches"""
+        if self._adjacency is None:
+            reverse = self.reverse_matrix
+            self._adjacency = (
+                (self.indptr.tolist(), self.indices.tolist(), self.weights.tolist()),
+                (reverse.indptr.tolist(), reverse.indices.tolist(), reverse.data.tolist()),
+            )
+        return self._adjacency
+
+    def bounded_multi_source(self, sources, limit, reverse=False):
+        """Multi-source search that stops at limit, with cost proportional to the area reached.
+
+        Returns the positions of the reached nodes in the order they were
+        settled, their distances and the position of their closest source.
+        """
+        forward, backward = self.adjacency_lists()
+        indptr, indices, weights = backward if reverse else forward
+        heap = [(0.0, s, s) for s in np.atleast_1d(self.index_of(sources)).tolist()]
+        heapq.heapify(heap)
+        distances = {}
+        settled = {}
+        while heap:
+            d, u, origin = heapq.heappop(heap)
+            if u in settled:
+                continue
+            settled[u] = (d, origin)
+            for e in range(indptr[u], indptr[u + 1]):
+                v = indices[e]
+                nd = d + weights[e]
+                if nd <= limit and nd < distances.get(v, math.inf):
+                    distances[v] = nd
+                    heapq.heappush(heap, (nd, v, origin))
+
+        reached = np.fromiter(settled.keys(), dtype=np.int64, count=len(settled))
+        reached_distances = np.fromiter((d for d, _ in settled.values()), dtype=np.float64, count=len(settled))
+        origins = np.fromiter((o for _, o in settled.values()), dtype=np.int64, count=len(settled))
+        return reached, reached_distances, origins
+
+    def k_nearest_sources(self, sources, k, limit=np.inf, reverse=False):
+        """Distances to the k closest sources of every node, in one multi-label search.
+
+        Every node is settled at most k times, once per source and in order of
+        distance, so the cost is about k times one multi-source search rather
+        than one search per source. Sources on the same node count separately.
+        Returns (n_nodes, k) distances, inf where fewer than k sources are
+        within limit, and labels, the position in sources of each (-1 there).
+        """
+        forward, backward = self.adjacency_lists()
+        indptr, indices, weights = backward if reverse else forward
+        n = len(self)
+        heap = [(0.0, s, label) for label, s in enumerate(np.atleast_1d(self.index_of(sources)).tolist())]
+        heapq.heapify(heap)
+        count = [0] * n
+        found = [None] * n
+        settled_nodes, settled_distances, settled_labels, ranks = [], [], [], []
+        while heap:
+            d, u, label = heapq.heappop(heap)
+            rank = count[u]
+            if rank >= k:
+                continue
+            labels_at_u = found[u]
+            if labels_at_u is None:
+                found[u] = labels_at_u = []
+            elif label in labels_at_u:
+                continue
+            labels_at_u.append(label)
+            count[u] = rank + 1
+            settled_nodes.append(u)
+            settled_distances.append(d)
+            settled_labels.append(label)
+            ranks.append(rank)
+            for e in range(indptr[u], indptr[u + 1]):
+                v = indices[e]
+                nd = d + weights[e]
+                # A node with k labels, or with this one, has nothing more to learn from it
+                if nd <= limit and count[v] < k and (found[v] is None or label not in found[v]):
+                    heapq.heappush(heap, (nd, v, label))
+
+        distances = np.full((n, k), np.inf)
+        labels = np.full((n, k), -1, dtype=np.int64)
+        distances[settled_nodes, ranks] = settled_distances
+        labels[settled_nodes, ranks] = settled_labels
+        return distances, labels
+
+    def edges_within(self, node_idx):
+        """Endpoint positions of the edges with both ends among node_idx"""
+        node_idx = np.asarray(node_idx)
+        starts = self.indptr[node_idx]
+        counts = self.indptr[node_idx + 1] - starts
+        # Concatenated CSR ranges of the given nodes
+        offsets = np.repeat(np.cumsum(counts) - counts, counts)
+        edge_pos = np.repeat(starts, counts) + np.arange(counts.sum()) - offsets
+        u = np.repeat(node_idx, counts)
+        v = self.indices[edge_pos]
+        inside = np.isin(v, node_idx)
+        return u[inside], v[inside]
+
+    def heuristic_scale(self):
+        """Largest c <= 1 with c * straight-line distance <= length on every edge.
+
+        c times the straight-line distance to the target is then a consistent
+        A* heuristic even where edge lengths are slightly shorter than the
+        projected distance between their nodes.
+        """
+        if self._heuristic_scale is None:
+            u = np.repeat(np.arange(len(self)), np.diff(self.indptr))
+            straight = np.hypot(self.x[u] - self.x[self.indices], self.y[u] - self.y[self.indices])
+            ratios = self.weights[straight > 0] / straight[straight > 0]
+            self._heuristic_scale = float(min(1.0, ratios.min())) if len(ratios) else 1.0
+        return self._heuristic_scale
+
+    def _astar(self, s, t, use_heuristic=True):
+        (indptr, indices, weights), _ = self.adjacency_lists()
+        if use_heuristic:
+            if self.x is None:
+                raise ValueError("A* needs node coordinates, compile a graph with x/y node attributes")
+            if self._coordinates is None:
+                self._coordinates = (self.x.tolist(), self.y.tolist())
+            x, y = self._coordinates
+            scale = self.heuristic_scale()
+            tx, ty = x[t], y[t]
+
+        distances = {s: 0.0}
+        predecessors = {s: -1}
+        settled = set()
+        # Without the heuristic the priority is the distance itself, with no per-query coordinate lists
+        heap = [(scale * math.hypot(x[s] - tx, y[s] - ty) if use_heuristic else 0.0, 0.0, s)]
+        while heap:
+            _, d, u = heapq.heappop(heap)
+            if u in settled:
+                continue
+            settled.add(u)
+            if u == t:
+                return d, self._unwind(predecessors, t), len(settled)
+            for e in range(indptr[u], indptr[u + 1]):
+                v = indices[e]
+                nd = d + weights[e]
+                if nd < distances.get(v, math.inf):
+                    distances[v] = nd
+                    predecessors[v] = u
+                    heapq.heappush(heap, (nd + scale * math.hypot(x[v] - tx, y[v] - ty) if use_heuristic else nd, nd, v))
+        return math.inf, [], len(settled)
+
+    def _bidirectional(self, s, t):
+        adjacency = self.adjacency_lists()
+        distances = ({s: 0.0}, {t: 0.0})
+        predecessors = ({s: -1}, {t: -1})
+        settled = (set(), set())
+        heaps = ([(0.0, s)], [(0.0, t)])
+        best, meeting = (0.0, s) if s == t else (math.inf, None)
+
+        while heaps[0] and heaps[1]:
+            # No path through unsettled nodes can beat the best meeting found so far
+            if heaps[0][0][0] + heaps[1][0][0] >= best:
+                break
+            side = 0 if heaps[0][0][0] <= heaps[1][0][0] else 1
+            d, u = heapq.heappop(heaps[side])
+            if u in settled[side]:
+                continue
+            settled[side].add(u)
+            indptr, indices, weights = adjacency[side]
+            other = distances[1 - side]
+            for e in range(indptr[u], indptr[u + 1]):
+                v = indices[e]
+                nd = d + weights[e]
+                if nd < distances[side].get(v, math.inf):
+                    distances[side][v] = nd
+                    predecessors[side][v] = u
+                    heapq.heappush(heaps[side], (nd, v))
+                if v in other and distances[side][v] + other[v] < best:
+                    best, meeting = distances[side][v] + other[v], v
+
+        n_settled = len(settled[0]) + len(settled[1])
+        if meeting is None:
+            return math.inf, [], n_settled
+        # Forward half from the source, backward half walks on towards the target
+        path = self._unwind(predecessors[0], meeting)
+        step = predecessors[1][meeting]
+        while step >= 0:
+            path.append(step)
+            step = predecessors[1][step]
+        return best, path, n_settled
+
+    @staticmethod
+    def _unwind(predecessors, target):
+        path = [target]
+        while predecessors[path[-1]] >= 0:
+            path.append(predecessors[path[-1]])
+        path.reverse()
+        return path
+
+    def point_to_point(self, source, target, method='astar'):
+        """Shortest distance, node path and number of settled nodes between two nodes.
+
+        'astar' is guided by the straight-line distance to the target (the graph
+        must carry node coordinates), 'bidirectional' grows searches from both
+        ends and 'dijkstra' is the unguided search stopped at the target.
+        """
+        if method not in POINT_TO_POINT_METHODS:
+            raise ValueError(f"Unknown method {method!r}, expected one of {POINT_TO_POINT_METHODS}")
+        s, t = (int(idx) for idx in self.index_of([source, target]))
+        if method == 'bidirectional':
+            distance, path, settled = self._bidirectional(s, t)
+        else:
+            distance, path, settled = self._astar(s, t, use_heuristic=method == 'astar')
+        return distance, self.node_ids[path].tolist(), settled
+
+    def point_to_point_batch(self, sources, targets, method='astar', return_paths=False):
+        """point_to_point over paired sources and targets.
+
+        Returns distances and settled-node counts as arrays, plus the list of
+        node paths when return_paths is True.
+        """
+        sources, targets = np.asarray(sources), np.asarray(targets)
+        distances = np.empty(len(sources), dtype=np.float64)
+        settled = np.empty(len(sources), dtype=np.int64)
+        paths = []
+        for i, (source, target) in enumerate(zip(sources.tolist(), targets.tolist())):
+            distances[i], path, settled[i] = self.point_to_point(source, target, method=method)
+            if return_paths:
+                paths.append(path)
+        if return_paths:
+            return distances, settled, paths
+        return distances, settled
+
+    def path_indices(self, predecessors, target_idx):
+        """Positions along the predecessor chain, from the search root to target_idx"""
+        path = [int(target_idx)]
+        step = predecessors[target_idx]
+        while step >= 0:
+            path.append(int(step))
+            step = predecessors[step]
+        path.reverse()
+        return path
+
+    def path(self, predecessors, target):
+        """Node ids from the search root to target"""
+        return self.node_ids[self.path_indices(predecessors, self.index_of(target))].tolist()
+
+
+def compile_graph(graph, weight='length'):
+    """Return the CompiledGraph of a networkx graph, building it on first use.
+
+    The result is cached per graph object, so the graph must not be modified
+    after it has been compiled.
+    """
+    cache = _compiled_graphs.setdefault(graph, {})
+    if weight not in cache:
+        cache[weight] = CompiledGraph.from_graph(graph, weight=weight)
+    return cache[weight]
+
+
+def register_compiled(graph, compiled, weight='length'):
+    """Attach an already compiled graph, e.g. one loaded from a snapshot, to its networkx graph"""
+    _compiled_graphs.setdefault(graph, {})[weight] = compiled
@@ -0,0 +1,112 @@
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from graph_snapshot import is_snapshot, load_snapshot, save_snapshot
+from node_snapper import NodeSnapper
+
+
+# Compiled graph, snapper and snapped sources, set once in every worker process
+_scenario_state = {}
+
+
+def position_snapper(snapshot):
+    """KD-tree on the projected node coordinates that returns node positions instead of ids"""
+    x, y = snapshot.node_coords(projected=True)
+    return NodeSnapper(np.arange(len(snapshot.node_ids)), x, y, crs=snapshot.crs(projected=True))
+
+
+def _init_worker(snapshot_path, sources_path, thresholds, max_snap_distance):
+    snapshot = load_snapshot(snapshot_path)
+    _scenario_state['compiled'] = snapshot.compiled_graph(projected=True)
+    _scenario_state['snapper'] = position_snapper(snapshot)
+    _scenario_state['source_idx'] = np.load(sources_path, mmap_mode='r')
+    _scenario_state['thresholds'] = thresholds
+    _scenario_state['max_snap_distance'] = max_snap_distance
+
+
+def scenario_distances(compiled, source_idx, destination_idx):
+    """Network distance from each destination set to every source node, as get_nearest_point_graph"""
+    distance = np.full(len(source_idx), np.inf)
+    if len(destination_idx):
+        node_distances, _, _ = compiled.multi_source(compiled.node_ids[destination_idx])
+        snapped = source_idx >= 0
+        distance[snapped] = node_distances[source_idx[snapped]]
+    return distance
+
+
+def summarize(distance, thresholds):
+    """Mean, median and 90th percentile over the reached sources, and the share of all sources within each threshold"""
+    reached = distance[np.isfinite(distance)]
+    row = {'n_sources': len(distance), 'n_reached': len(reached)}
+    if len(reached):
+        row.update({'mean': reached.mean(), 'median': np.median(reached), 'p90': np.percentile(reached, 90), 'max': reached.max()})
+    else:
+        row.update({'mean': np.nan, 'median': np.nan, 'p90': np.nan, 'max': np.nan})
+    for threshold in thresholds:
+        row[f'within_{threshold:g}m'] = (distance <= threshold).mean() if len(distance) else np.nan
+    return row
+
+
+def evaluate_scenario(name, dest_x, dest_y):
+    """Summary statistics of one destination set, in a worker"""
+    state = _scenario_state
+    destination_idx, _ = state['snapper'].query(dest_x, dest_y, max_distance=state['max_snap_distance'])
+    snapped = destination_idx >= 0
+    destination_idx = np.unique(destination_idx[snapped])
+    distance = scenario_distances(state['compiled'], np.asarray(state['source_idx']), destination_idx)
+    return {'scenario': name, 'n_destinations_input': len(dest_x), 'n_destinations_snapped': int(snapped.sum()),
+            'n_destination_nodes': len(destination_idx), **summarize(distance, state['thresholds'])}
+
+
+def evaluate_scenarios(graph, sources, scenarios, thresholds=(400, 800), max_workers=None, max_snap_distance=None):
+    """Nearest-destination statistics for many candidate destination sets over one city graph.
+
+    graph is a graph snapshot directory (see graph_snapshot.save_snapshot) or
+    a networkx graph, written to a temporary snapshot first; a path that is
+    not a snapshot raises ValueError. scenarios maps
+    names to destination points (GeoSeries or GeoDataFrames in any CRS); a
+    list is numbered. The sources are snapped once here, and every worker
+    memory-maps the snapshot and the snapped sources and compiles the graph
+    once, then runs one multi-source search per scenario. Destinations
+    further than max_snap_distance from the network are left out, as are
+    sources (they count as unreached). Returns one row per scenario with
+    the number of destinations given, snapped and distinct destination
+    nodes, the mean, median, 90th percentile and maximum distance over the
+    reached sources and the share of all sources within each threshold in
+    metres.
+    """
+    if not isinstance(scenarios, dict):
+        scenarios = dict(enumerate(scenarios))
+
+    with tempfile.TemporaryDirectory(prefix='scenarios_') as work_dir:
+        if isinstance(graph, (str, os.PathLike)):
+            if not is_snapshot(graph):
+                raise ValueError(f"{graph} is not a graph snapshot, see graph_snapshot.save_snapshot")
+            snapshot_path = graph
+        else:
+            snapshot_path = os.path.join(work_dir, 'graph.snapshot')
+            save_snapshot(graph, snapshot_path)
+        snapshot = load_snapshot(snapshot_path)
+        crs = snapshot.crs(projected=True)
+
+        # Sources are the same for every scenario: snap them once and share them through a memory map
+        src_proj = sources.geometry.to_crs(crs=crs)
+        source_idx, _ = position_snapper(snapshot).query(src_proj.x.values, src_proj.y.values, max_distance=max_snap_distance)
+        sources_path = os.path.join(work_dir, 'source_idx.npy')
+        np.save(sources_path, source_idx)
+
+        # Destination sets as projected coordinate arrays, small enough to send with every task
+        jobs = []
+        for name, destinations in scenarios.items():
+            dest_proj = destinations.geometry.to_crs(crs=crs)
+            jobs.append((name, dest_proj.x.values, dest_proj.y.values))
+
+        workers = max(1, min(max_workers or os.cpu_count() or 1, len(jobs)))
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(snapshot_path, sources_path, tuple(thresholds), max_snap_distance)) as pool:
+            futures = [pool.submit(evaluate_scenario, *job) for job in jobs]
+            rows = [future.result() for future in futures]
+
+    return pd.DataFrame(rows).set_index('scenario')
@@ -3,6 +3,12 @@ from shapely.geometry import LineString
 import osmnx as ox
 from nearest_point import get_nearest_point
 import pandas as pd
+import numpy as np
+from scipy.spatial import cKDTree
+import shapely
+from routing_engine import check_engine, compile_graph
+from nearest_destination import DestinationField
+from node_snapper import nearest_nodes
 
 def shortest_route_graph(G_proj, origin, destination, k_neighbors=5):
     nodes = ox.graph_to_gdfs(G_proj, edges=False)
@@ -19,7 +25,7 @@ def shortest_route_graph(G_proj, origin, destination, k_neighbors=5):
     for oidx, orig in origin_proj.iterrows():
 
         # Find closest node from the graph
-        closest_origin_node = ox.distance.nearest_nodes(G=G_proj, X=orig.geometry.x, Y=orig.geometry.y)
+        closest_origin_node = nearest_nodes(G=G_proj, X=orig.geometry.x, Y=orig.geometry.y)
 
         # Create a GeoDataFrame for the current origin
         current_origin_gdf = gpd.GeoDataFrame(geometry=gpd.GeoSeries(orig.geometry), crs=CRS)
@@ -30,9 +36,9 @@ def shortest_route_graph(G_proj, origin, destination, k_neighbors=5):
         # Find the shortest path and its distance for each origin-destination pair
         shortest_path_info = min(
             (
-                (ox.distance.shortest_path(G_proj, closest_origin_node, ox.distance.nearest_nodes(G_proj, X=target_geom.x, Y=target_geom.y), weight='length', cpus=-1), target_geom)
+                (ox.distance.shortest_path(G_proj, closest_origin_node, nearest_nodes(G_proj, X=target_geom.x, Y=target_geom.y), weight='length', cpus=-1), target_geom)
                 for tidx, target_geom in closest_destinations.items()
-                if closest_origin_node != ox.distance.nearest_nodes(G_proj, X=target_geom.x, Y=target_geom.y)
+                if closest_origin_node != nearest_nodes(G_proj, X=target_geom.x, Y=target_geom.y)
             ),
             key=lambda x: LineString(nodes.loc[x[0]].geometry.values).length,
             default=(None, None)
@@ -60,9 +66,106 @@ def shortest_route_graph(G_proj, origin, destination, k_neighbors=5):
     return routes, origin_proj, destination_proj
 
 
+def shortest_route_graph_batch(G_proj, origin, destination, k_neighbors=5, geometry=True):
+    """Batched shortest_route_graph for large numbers of origins.
 
+    Origins and destinations are snapped in one call each, the k straight-line
+    nearest destinations are shortlisted for all origins at once and the winner
+    is the shortlisted destination with the smallest network distance, read
+    from one reverse search per destination. 'distance' is that network
+    distance in metres. Memory grows with destinations x graph nodes. With
+    geometry=False the routes are not drawn and a plain DataFrame is returned.
+    """
+    CRS = G_proj.graph['crs']
+    compiled = compile_graph(G_proj)
 
-def shortest_path_v0(G_proj, origin, destination):    
+    # Reproject all data
+    origin_proj = origin.to_crs(crs=CRS)
+    destination_proj = destination.to_crs(crs=CRS)
+    origin_xy = np.column_stack([origin_proj.geometry.x, origin_proj.geometry.y])
+    destination_xy = np.column_stack([destination_proj.geometry.x, destination_proj.geometry.y])
+
+    # Snap every origin and destination to its closest node in one call each
+    origin_nodes = nearest_nodes(G=G_proj, X=origin_xy[:, 0], Y=origin_xy[:, 1])
+    destination_nodes = nearest_nodes(G=G_proj, X=destination_xy[:, 0], Y=destination_xy[:, 1])
+    origin_idx = compiled.index_of(origin_nodes)
+    destination_idx = compiled.index_of(destination_nodes)
+
+    # Shortlist the k straight-line closest destinations of every origin at once
+    k = min(k_neighbors, len(destination_xy))
+    _, candidates = cKDTree(destination_xy).query(origin_xy, k=k)
+    candidates = candidates.reshape(len(origin_xy), k)
+
+    # Network distance from every node to each destination, one reverse search per destination
+    field = DestinationField.build(compiled, destination_nodes, reverse=True)
+    distances = field.distances[candidates, origin_idx[:, None]].astype(np.float64)
+    # Like shortest_route_graph, skip destinations that snap to the origin's node
+    distances[destination_idx[candidates] == origin_idx[:, None]] = np.inf
+
+    best = np.argmin(distances, axis=1)
+    best_distance = distances[np.arange(len(best)), best]
+    found = np.isfinite(best_distance)
+    winner = candidates[found, best[found]]
+
+    # Build the output in one shot
+    destination_points = destination.to_crs(origin.crs).geometry.values
+    routes = pd.DataFrame({
+        'id': 'R' + (origin_proj.index[found] + 1).astype(str),
+        'origin': origin.geometry.values[found],
+        'destination': destination_points[winner],
+        'distance': best_distance[found],
+    })
+    if geometry:
+        routes = gpd.GeoDataFrame(routes, geometry=field.path_lines(origin_idx[found], winner), crs=CRS)
+
+    return routes.reset_index(drop=True), origin_proj, destination_proj
+
+
+def shortest_path_pairs(G_proj, origin, destination, method='astar'):
+    """shortest_path_v0 over the compiled graph with point-to-point searches.
+
+    method is 'astar', 'bidirectional' or 'dijkstra'. Adds the network
+    'distance' and the number of nodes each search 'settled'.
+    """
+    CRS = G_proj.graph['crs']
+    compiled = compile_graph(G_proj)
+
+    # Reproject all data
+    origin_proj = origin.to_crs(crs=CRS)
+    destination_proj = destination.to_crs(crs=CRS)
+
+    # Snap all points at once and pair every origin with every destination
+    origin_nodes = np.asarray(nearest_nodes(G=G_proj, X=origin_proj.geometry.x, Y=origin_proj.geometry.y))
+    destination_nodes = np.asarray(nearest_nodes(G=G_proj, X=destination_proj.geometry.x, Y=destination_proj.geometry.y))
+    oidx, tidx = np.meshgrid(np.arange(len(origin_nodes)), np.arange(len(destination_nodes)), indexing='ij')
+    oidx, tidx = oidx.ravel(), tidx.ravel()
+
+    # Check if origin and target nodes are the same
+    same = origin_nodes[oidx] == destination_nodes[tidx]
+    if same.any():
+        print(f"{same.sum()} pairs with the same origin and destination node. Skipping ..")
+    oidx, tidx = oidx[~same], tidx[~same]
+
+    distances, settled, paths = compiled.point_to_point_batch(origin_nodes[oidx], destination_nodes[tidx], method=method, return_paths=True)
+    found = np.isfinite(distances)
+
+    # Create LineStrings out of the routes in one go
+    paths = [path for path, ok in zip(paths, found) if ok]
+    path_idx = compiled.index_of(np.concatenate(paths)) if paths else np.array([], dtype=np.int64)
+    geometry = shapely.linestrings(np.column_stack([compiled.x[path_idx], compiled.y[path_idx]]),
+                                   indices=np.repeat(np.arange(len(paths)), [len(path) for path in paths]))
+
+    route_ids = [f"O{o+1}_D{t+1}" for o, t in zip(origin_proj.index[oidx[found]], destination_proj.index[tidx[found]])]
+    routes = gpd.GeoDataFrame({'id': route_ids, 'distance': distances[found], 'settled': settled[found]},
+                              geometry=geometry, crs=CRS)
+
+    return routes, origin_proj, destination_proj
+
+
+def shortest_path_v0(G_proj, origin, destination, engine='networkx', method='astar'):
+    check_engine(engine)
+    if engine == 'csr':
+        return shortest_path_pairs(G_proj, origin, destination, method=method)
     
     nodes = ox.graph_to_gdfs(G_proj, edges=False)
     CRS = nodes.crs
@@ -77,12 +180,12 @@ def shortest_path_v0(G_proj, origin, destination):
     # Iterate over origins and destinations
     for oidx, orig in origin_proj.iterrows():
         # Find the closest node from the graph
-        closest_origin_node = ox.distance.nearest_nodes(G=G_proj, X=orig.geometry.x, Y=orig.geometry.y)
+        closest_origin_node = nearest_nodes(G=G_proj, X=orig.geometry.x, Y=orig.geometry.y)
         
         # Iterate over targets
         for tidx, target in destination_proj.iterrows():
             # Find the closest node from the graph
-            closest_target_node = ox.distance.nearest_nodes(G_proj, X=target.geometry.x, Y=target.geometry.y)
+            closest_target_node = nearest_nodes(G_proj, X=target.geometry.x, Y=target.geometry.y)
             
             # Check if origin and target nodes are the same
             if closest_origin_node == closest_target_node:
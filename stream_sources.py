@@ -0,0 +1,127 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from routing_engine import compile_graph
+from node_snapper import get_node_snapper, nearest_nodes
+
+
+def read_source_chunks(path, chunksize=100_000, x='x', y='y', crs='EPSG:4326', layer=None):
+    """Yield source points from a GPKG/SHP, CSV or Parquet file as GeoDataFrames of chunksize rows.
+
+    CSV files and Parquet files without a geometry column need point
+    coordinates in the x and y columns, in crs.
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.csv':
+        for chunk in pd.read_csv(path, chunksize=chunksize):
+            yield gpd.GeoDataFrame(chunk, geometry=gpd.points_from_xy(chunk[x], chunk[y]), crs=crs)
+
+    elif ext in ('.parquet', '.geoparquet'):
+        import pyarrow.parquet as pq
+        parquet = pq.ParquetFile(path)
+        # GeoParquet keeps its geometry as WKB and the CRS in the 'geo' metadata
+        metadata = parquet.schema_arrow.metadata or {}
+        geo = json.loads(metadata[b'geo']) if b'geo' in metadata else None
+        for batch in parquet.iter_batches(batch_size=chunksize):
+            chunk = batch.to_pandas()
+            if geo is not None:
+                column = geo['primary_column']
+                geo_crs = geo['columns'][column].get('crs', 'EPSG:4326')
+                geometry = gpd.GeoSeries.from_wkb(chunk.pop(column), crs=geo_crs)
+                yield gpd.GeoDataFrame(chunk, geometry=geometry.values)
+            else:
+                yield gpd.GeoDataFrame(chunk, geometry=gpd.points_from_xy(chunk[x], chunk[y]), crs=crs)
+
+    else:
+        start = 0
+        while True:
+            chunk = gpd.read_file(path, layer=layer, rows=slice(start, start + chunksize))
+            if chunk.empty:
+                break
+            chunk.index = pd.RangeIndex(start, start + len(chunk))
+            yield chunk
+            start += len(chunk)
+
+
+class ChunkWriter:
+    """Append DataFrames to a CSV or Parquet file one chunk at a time"""
+
+    def __init__(self, path):
+        self.path = path
+        self.parquet = os.path.splitext(path)[1].lower() == '.parquet'
+        self._writer = None
+        self.rows = 0
+
+    def write(self, df):
+        if self.parquet:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            if self._writer is None:
+                self._writer = pq.ParquetWriter(self.path, table.schema)
+            self._writer.write_table(table)
+        else:
+            df.to_csv(self.path, mode='w' if self.rows == 0 else 'a', header=self.rows == 0, index=False)
+        self.rows += len(df)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def stream_nearest_distances(sources_path, graph_proj, destinations, out_path, chunksize=100_000,
+                             id_column=None, max_snap_distance=None, stats=None, weight_column=None, **read_kwargs):
+    """Network distance to the nearest destination for every source point in a file.
+
+    The routing state (compiled graph, one multi-source search from all
+    destinations and a KD-tree on the nodes) is built once. Sources are then
+    read, snapped and looked up chunk by chunk and appended to out_path (CSV,
+    or Parquet with pyarrow), so peak memory does not grow with the input.
+    Sources further than max_snap_distance from the network get node -1 and
+    an infinite distance. When stats (a streaming_stats.DistanceStats) is
+    given it is updated with every chunk of distances, weighted by
+    weight_column if set. Returns the number of rows written.
+    """
+    CRS = graph_proj.graph['crs']
+    compiled = compile_graph(graph_proj)
+
+    # Distance from every node to its nearest destination, walking towards it
+    dest_utm = destinations.to_crs(crs=CRS)
+    destination_nodes = nearest_nodes(G=graph_proj, X=dest_utm.geometry.x, Y=dest_utm.geometry.y)
+    node_distances, _, nearest = compiled.multi_source(destination_nodes, reverse=True)
+
+    # Destination row served by every node, -1 where no destination is reachable
+    destination_of_node = {node: label for label, node in reversed(list(zip(destinations.index, compiled.index_of(destination_nodes).tolist())))}
+    node_destination = np.array([destination_of_node.get(node, -1) for node in nearest.tolist()])
+
+    snapper = get_node_snapper(graph_proj)
+
+    with ChunkWriter(out_path) as writer:
+        for chunk in read_source_chunks(sources_path, chunksize=chunksize, **read_kwargs):
+            points = chunk.geometry.to_crs(crs=CRS)
+            nodes, snap_distance = snapper.query(points.x, points.y, max_distance=max_snap_distance)
+            snapped = nodes != -1
+            node_idx = compiled.index_of(nodes[snapped])
+
+            distance = np.full(len(nodes), np.inf)
+            distance[snapped] = node_distances[node_idx]
+            destination = np.full(len(nodes), -1, dtype=node_destination.dtype)
+            destination[snapped] = node_destination[node_idx]
+            if stats is not None:
+                stats.update(distance, chunk[weight_column].values if weight_column else None)
+            writer.write(pd.DataFrame({
+                'source_id': chunk[id_column].values if id_column else chunk.index.values,
+                'node': nodes,
+                'snap_distance': snap_distance,
+                'distance': distance,
+                'destination': destination,
+            }))
+        return writer.rows
@@ -0,0 +1,163 @@
+import numpy as np
+
+
+class TDigest:
+    """Mergeable quantile sketch (merging t-digest with the arcsine scale function).
+
+    Values are buffered and folded into weighted centroids that are small
+    near the tails and larger around the median, so extreme quantiles stay
+    accurate with a few hundred centroids whatever the number of values
+    (about 0.5% relative error at the 99.9th percentile with the default).
+    """
+
+    def __init__(self, compression=500, buffer_size=None):
+        self.compression = compression
+        self.buffer_size = buffer_size or 20 * compression
+        self.means = np.empty(0)
+        self.weights = np.empty(0)
+        self._buffer_values = []
+        self._buffer_weights = []
+        self._buffered = 0
+
+    def update(self, values, weights):
+        self._buffer_values.append(np.asarray(values, dtype=np.float64))
+        self._buffer_weights.append(np.asarray(weights, dtype=np.float64))
+        self._buffered += len(self._buffer_values[-1])
+        if self._buffered >= self.buffer_size:
+            self._compress()
+
+    def merge(self, other):
+        other._compress()
+        self.update(other.means, other.weights)
+        return self
+
+    def _compress(self):
+        if not self._buffered:
+            return
+        means = np.concatenate([self.means] + self._buffer_values)
+        weights = np.concatenate([self.weights] + self._buffer_weights)
+        self._buffer_values, self._buffer_weights, self._buffered = [], [], 0
+
+        order = np.argsort(means, kind='stable')
+        means, weights = means[order], weights[order]
+        total = weights.sum()
+        # Centroids whose centres fall within the same unit of k = d/(2 pi) asin(2q - 1) are merged
+        q = (np.cumsum(weights) - weights / 2) / total
+        k = np.floor(self.compression / (2 * np.pi) * np.arcsin(np.clip(2 * q - 1, -1, 1)))
+        starts = np.flatnonzero(np.r_[True, k[1:] != k[:-1]])
+        self.weights = np.add.reduceat(weights, starts)
+        self.means = np.add.reduceat(means * weights, starts) / self.weights
+
+    def quantile(self, q, vmin, vmax):
+        """Quantiles q (scalar or array in [0, 1]), interpolated between centroid centres"""
+        self._compress()
+        if not len(self.means):
+            return np.full(np.shape(q), np.nan)
+        total = self.weights.sum()
+        centres = np.cumsum(self.weights) - self.weights / 2
+        return np.interp(np.asarray(q) * total, np.r_[0, centres, total], np.r_[vmin, self.means, vmax])
+
+
+class DistanceStats:
+    """Running statistics of a stream of distances, mergeable across chunks, workers and cities.
+
+    update() takes one chunk of values at a time, optionally with per-point
+    weights (e.g. the population of each source point). Mean and variance
+    are combined with Welford's parallel update, quantiles come from a
+    TDigest and the histogram uses fixed bin_edges so two accumulators with
+    the same edges can be merged. Non-finite distances (unreachable points)
+    are counted in n_nonfinite and otherwise left out.
+    """
+
+    def __init__(self, bin_edges=None, compression=500):
+        self.bin_edges = np.linspace(0, 10_000, 201) if bin_edges is None else np.asarray(bin_edges, dtype=np.float64)
+        self.counts = np.zeros(len(self.bin_edges) - 1)
+        self.underflow = 0.0
+        self.overflow = 0.0
+        self.n = 0
+        self.n_nonfinite = 0
+        self.weight = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.digest = TDigest(compression)
+
+    @classmethod
+    def from_array(cls, values, weights=None, **kwargs):
+        return cls(**kwargs).update(values, weights)
+
+    def update(self, values, weights=None):
+        values = np.asarray(values, dtype=np.float64).ravel()
+        weights = np.ones(len(values)) if weights is None else np.asarray(weights, dtype=np.float64).ravel()
+        finite = np.isfinite(values)
+        self.n_nonfinite += int((~finite).sum())
+        values, weights = values[finite], weights[finite]
+        if not len(values) or weights.sum() <= 0:
+            return self
+
+        chunk_weight = weights.sum()
+        chunk_mean = np.dot(weights, values) / chunk_weight
+        chunk_m2 = np.dot(weights, (values - chunk_mean) ** 2)
+        self._combine(len(values), chunk_weight, chunk_mean, chunk_m2, values.min(), values.max())
+
+        self.digest.update(values, weights)
+        counts, _ = np.histogram(values, bins=self.bin_edges, weights=weights)
+        self.counts += counts
+        self.underflow += weights[values < self.bin_edges[0]].sum()
+        self.overflow += weights[values > self.bin_edges[-1]].sum()
+        return self
+
+    def _combine(self, n, weight, mean, m2, vmin, vmax):
+        # Chan et al. pairwise form of Welford's update
+        total = self.weight + weight
+        delta = mean - self.mean
+        self.mean += delta * weight / total
+        self.m2 += m2 + delta ** 2 * self.weight * weight / total
+        self.weight = total
+        self.n += n
+        self.min = min(self.min, vmin)
+        self.max = max(self.max, vmax)
+
+    def merge(self, other):
+        """Fold another accumulator (same bin_edges) into this one"""
+        if not np.array_equal(self.bin_edges, other.bin_edges):
+            raise ValueError("Cannot merge DistanceStats with different bin edges")
+        self.n_nonfinite += other.n_nonfinite
+        if other.weight > 0:
+            self._combine(other.n, other.weight, other.mean, other.m2, other.min, other.max)
+            self.digest.merge(other.digest)
+            self.counts += other.counts
+            self.underflow += other.underflow
+            self.overflow += other.overflow
+        return self
+
+    def __add__(self, other):
+        merged = DistanceStats(self.bin_edges, self.digest.compression)
+        return merged.merge(self).merge(other)
+
+    @property
+    def var(self):
+        # Population variance, as np.var
+        return self.m2 / self.weight if self.weight > 0 else np.nan
+
+    @property
+    def std(self):
+        return np.sqrt(self.var)
+
+    def quantile(self, q):
+        return self.digest.quantile(q, self.min, self.max)
+
+    @property
+    def median(self):
+        return float(self.quantile(0.5))
+
+    def stats(self):
+        """Same keys as descriptive_stats.distance_stats"""
+        return {
+            'min': self.min,
+            'max': self.max,
+            'mean': self.mean,
+            'median': self.median,
+            'std': self.std,
+        }
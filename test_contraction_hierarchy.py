@@ -0,0 +1,31 @@
+import os
+import numpy as np
+import pytest
+import networkx as nx
+from scipy.sparse.csgraph import dijkstra
+from contraction_hierarchy import ContractionHierarchy, load_or_build_hierarchy
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_contraction_hierarchy_matches_dijkstra(random_graph, seed):
+    compiled, dense, rng = random_graph(seed)
+    sources = compiled.node_ids[rng.choice(len(compiled), 10, replace=False)]
+    targets = compiled.node_ids[rng.choice(len(compiled), 10, replace=False)]
+    ch = ContractionHierarchy.build(compiled)
+
+    expected = dijkstra(dense, indices=compiled.index_of(sources))[:, compiled.index_of(targets)]
+    np.testing.assert_allclose(ch.many_to_many(sources, targets), expected)
+
+
+def test_hierarchy_cache_is_rebuilt_when_weights_change(tmp_path):
+    graph = nx.MultiDiGraph()
+    graph.add_weighted_edges_from([(1, 2, 10.0), (2, 3, 10.0), (1, 3, 30.0)], weight='length')
+    filename = str(tmp_path / 'hierarchy')
+    assert load_or_build_hierarchy(graph, filename).many_to_many([1], [3])[0, 0] == 20.0
+    # np.savez adds .npz, the cache must be found under that name
+    assert os.path.exists(filename + '.npz')
+
+    # A new graph object, compiled graphs are cached per graph
+    graph = graph.copy()
+    graph.edges[1, 3, 0]['length'] = 5.0
+    assert load_or_build_hierarchy(graph, filename).many_to_many([1], [3])[0, 0] == 5.0
@@ -0,0 +1,25 @@
+import numpy as np
+from benchmark import synthetic_graph, sample_points
+from import_graphs import get_nearest_point_graph
+from node_snapper import nearest_nodes
+
+
+def test_nearest_nodes_returns_lists_like_osmnx():
+    graph = synthetic_graph(100)
+    points = sample_points(graph, 5, seed=0)
+    nodes, distances = nearest_nodes(graph, X=points.x, Y=points.y, return_dist=True)
+    assert isinstance(nodes, list) and isinstance(distances, list)
+    node = nearest_nodes(graph, X=points.x[0], Y=points.y[0])
+    assert isinstance(node, int) and node == nodes[0]
+
+
+def test_nearest_point_graph_engines_agree():
+    graph = synthetic_graph(400)
+    destinations = sample_points(graph, 8, seed=1)
+    sources = sample_points(graph, 50, seed=2)
+
+    # The default engine is the one main.py runs
+    _, _, networkx_distances = get_nearest_point_graph(graph, destinations, sources)
+    _, _, csr_distances = get_nearest_point_graph(graph, destinations, sources, engine='csr')
+    assert len(networkx_distances) == len(sources)
+    np.testing.assert_allclose(networkx_distances.values, csr_distances.values)
@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+from scipy.sparse.csgraph import dijkstra
+from incremental_accessibility import AccessibilityState
+
+
+def reference_state(dense, slot_nodes, active, reverse):
+    """Distance from every node to the nearest open destination the slow way"""
+    nodes = [node for node, open_ in zip(slot_nodes, active) if open_]
+    if not nodes:
+        return np.full(len(dense), np.inf), None
+    distances = dijkstra(dense.T if reverse else dense, indices=nodes)
+    return distances.min(axis=0), distances
+
+
+@pytest.mark.parametrize('reverse', [False, True])
+@pytest.mark.parametrize('seed', range(5))
+def test_incremental_updates_match_dijkstra(random_graph, seed, reverse):
+    compiled, dense, rng = random_graph(seed)
+    state = AccessibilityState.build(compiled, compiled.node_ids[rng.choice(len(compiled), 4)], reverse=reverse)
+    for _ in range(20):
+        open_slots = [slot for slot, open_ in enumerate(state.active) if open_]
+        if open_slots and rng.random() < 0.5:
+            state.remove_destination(int(rng.choice(open_slots)))
+        else:
+            state.add_destination(compiled.node_ids[rng.integers(len(compiled))])
+
+        expected, per_slot = reference_state(dense, state.slot_nodes, state.active, reverse)
+        np.testing.assert_allclose(state.distances, expected)
+        reached = np.flatnonzero(np.isfinite(expected))
+        np.testing.assert_array_equal(np.flatnonzero(state.labels >= 0), reached)
+        # Ties may go to either destination, but the label must be one at that distance
+        for node in reached:
+            slot = state.labels[node]
+            assert state.active[slot]
+            row = [s for s, open_ in enumerate(state.active) if open_].index(slot)
+            assert per_slot[row, node] == pytest.approx(state.distances[node])
@@ -0,0 +1,16 @@
+import numpy as np
+from routing_engine import CompiledGraph
+from nearest_destination import load_or_build_field
+
+
+def test_saved_field_is_rebuilt_when_weights_change(random_graph, tmp_path):
+    compiled, _, _ = random_graph(0)
+    destinations = compiled.node_ids[:3]
+    path = str(tmp_path / 'field')
+    field = load_or_build_field(compiled, destinations, path)
+    assert np.array_equal(load_or_build_field(compiled, destinations, path).distances, field.distances)
+
+    # Same nodes, every edge twice as long
+    heavier = CompiledGraph(compiled.node_ids, compiled.indptr, compiled.indices, compiled.weights * 2)
+    rebuilt = load_or_build_field(heavier, destinations, path)
+    np.testing.assert_allclose(rebuilt.distances, np.asarray(field.distances) * 2)
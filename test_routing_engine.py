@@ -0,0 +1,20 @@
+import numpy as np
+import pytest
+from scipy.sparse.csgraph import dijkstra
+
+
+@pytest.mark.parametrize('reverse', [False, True])
+@pytest.mark.parametrize('seed', range(5))
+def test_k_nearest_sources_match_dijkstra(random_graph, seed, reverse):
+    compiled, dense, rng = random_graph(seed)
+    k = 3
+    sources = compiled.node_ids[rng.choice(len(compiled), 6, replace=False)]
+    distances, labels = compiled.k_nearest_sources(sources, k, reverse=reverse)
+
+    per_source = dijkstra(dense.T if reverse else dense, indices=compiled.index_of(sources))
+    expected = np.sort(per_source, axis=0)[:k].T
+    np.testing.assert_allclose(distances, expected)
+    found = labels >= 0
+    np.testing.assert_array_equal(found, np.isfinite(expected))
+    nodes = np.nonzero(found)[0]
+    np.testing.assert_allclose(per_source[labels[found], nodes], distances[found])
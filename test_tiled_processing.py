@@ -0,0 +1,43 @@
+import numpy as np
+import pandas as pd
+import networkx as nx
+import geopandas as gpd
+from graph_snapshot import save_snapshot
+from routing_engine import compile_graph
+from tiled_processing import tiled_nearest_destination
+
+
+def grid_graph(side=30, spacing=100.0, crs='EPSG:32630'):
+    """Projected square grid with every street in both directions, whole rows and columns on tile edges"""
+    col, row = np.divmod(np.arange(side * side), side)
+    x, y = 500_000.0 + col * spacing, 5_000_000.0 + row * spacing
+    graph = nx.MultiDiGraph(crs=crs)
+    graph.add_nodes_from((node, {'x': a, 'y': b}) for node, a, b in zip(range(side * side), x.tolist(), y.tolist()))
+    index = np.arange(side * side).reshape(side, side)
+    pairs = np.concatenate([np.column_stack([index[:-1].ravel(), index[1:].ravel()]),
+                            np.column_stack([index[:, :-1].ravel(), index[:, 1:].ravel()])]).tolist()
+    graph.add_edges_from((u, v, 0, {'length': spacing}) for u, v in pairs)
+    graph.add_edges_from((v, u, 0, {'length': spacing}) for u, v in pairs)
+    return graph
+
+
+def test_nodes_on_tile_edges_are_written_once(tmp_path):
+    graph = grid_graph()
+    save_snapshot(graph, str(tmp_path / 'graph.snapshot'))
+    destination_nodes = [0, 455, 899]
+    destinations = gpd.GeoDataFrame(geometry=gpd.points_from_xy([graph.nodes[n]['x'] for n in destination_nodes],
+                                                                [graph.nodes[n]['y'] for n in destination_nodes]),
+                                    crs=graph.graph['crs'])
+
+    cutoff = 800.0
+    rows = tiled_nearest_destination(str(tmp_path / 'graph.snapshot'), destinations, cutoff, str(tmp_path / 'out.csv'),
+                                     tile_size=1000.0, max_workers=2)
+    result = pd.read_csv(tmp_path / 'out.csv')
+    assert rows == len(graph) == len(result)
+    assert result['node'].is_unique
+
+    # Same distances as one search over the whole graph
+    compiled = compile_graph(graph)
+    distances, _, _ = compiled.multi_source(destination_nodes, reverse=True)
+    expected = pd.Series(np.where(distances <= cutoff, distances, np.inf), index=compiled.node_ids)
+    np.testing.assert_allclose(result.set_index('node')['distance'].reindex(expected.index), expected)
@@ -0,0 +1,204 @@
+import os
+import math
+from collections import deque
+from itertools import islice
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from routing_engine import CompiledGraph
+from node_snapper import NodeSnapper
+from graph_snapshot import load_snapshot
+from stream_sources import ChunkWriter
+
+
+TILE_ARRAYS = ['node_order', 'tile_offsets', 'edge_order', 'edge_indptr']
+
+
+def build_tile_index(snapshot, tile_size, path, chunk_size=5_000_000):
+    """Group the nodes of a snapshot by square tile and its edges by start node.
+
+    Written as .npy files in path so tile workers can memory-map them. This
+    pass needs a few integer arrays the size of the whole graph; everything
+    after it only ever holds one tile.
+    """
+    os.makedirs(path, exist_ok=True)
+    x, y = snapshot.node_coords(projected=True)
+    x0, y0 = float(np.min(x)), float(np.min(y))
+    n_cols = int((float(np.max(x)) - x0) // tile_size) + 1
+    n_rows = int((float(np.max(y)) - y0) // tile_size) + 1
+
+    # Tile of every node, read from the memmap a chunk at a time
+    tile = np.empty(len(x), dtype=np.int64)
+    for start in range(0, len(x), chunk_size):
+        chunk = slice(start, start + chunk_size)
+        col = ((x[chunk] - x0) // tile_size).astype(np.int64)
+        row = ((y[chunk] - y0) // tile_size).astype(np.int64)
+        tile[chunk] = row * n_cols + col
+    node_order = np.argsort(tile, kind='stable')
+    tile_offsets = np.searchsorted(tile[node_order], np.arange(n_rows * n_cols + 1))
+    del tile
+
+    # Outgoing edges of every node, CSR style
+    u = np.asarray(snapshot.u)
+    edge_order = np.argsort(u, kind='stable')
+    edge_indptr = np.zeros(len(x) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(u, minlength=len(x)), out=edge_indptr[1:])
+
+    arrays = {'node_order': node_order, 'tile_offsets': tile_offsets,
+              'edge_order': edge_order, 'edge_indptr': edge_indptr}
+    for name, array in arrays.items():
+        np.save(os.path.join(path, f'{name}.npy'), array)
+    np.save(os.path.join(path, 'grid.npy'), np.array([x0, y0, tile_size, n_cols, n_rows], dtype=np.float64))
+
+
+def load_tile_index(path):
+    index = {name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r') for name in TILE_ARRAYS}
+    x0, y0, tile_size, n_cols, n_rows = np.load(os.path.join(path, 'grid.npy'))
+    index['grid'] = (x0, y0, tile_size, int(n_cols), int(n_rows))
+    return index
+
+
+def tile_bounds(index, tile):
+    x0, y0, tile_size, n_cols, n_rows = index['grid']
+    row, col = divmod(tile, n_cols)
+    return x0 + col * tile_size, y0 + row * tile_size, x0 + (col + 1) * tile_size, y0 + (row + 1) * tile_size
+
+
+def tile_nodes(index, tile):
+    """Positions of the snapshot nodes build_tile_index assigned to a tile, sorted"""
+    offsets = index['tile_offsets']
+    return np.sort(index['node_order'][offsets[tile]:offsets[tile + 1]])
+
+
+def nodes_in_box(snapshot, index, box):
+    """Positions of the snapshot nodes inside box, reading only the tiles it overlaps"""
+    x0, y0, tile_size, n_cols, n_rows = index['grid']
+    xmin, ymin, xmax, ymax = box
+    col_min, col_max = max(int((xmin - x0) // tile_size), 0), min(int((xmax - x0) // tile_size), n_cols - 1)
+    row_min, row_max = max(int((ymin - y0) // tile_size), 0), min(int((ymax - y0) // tile_size), n_rows - 1)
+    offsets = index['tile_offsets']
+    nodes = [index['node_order'][offsets[row * n_cols + col_min]:offsets[row * n_cols + col_max + 1]]
+             for row in range(row_min, row_max + 1)]
+    nodes = np.sort(np.concatenate(nodes)) if nodes else np.empty(0, dtype=np.int64)
+
+    x, y = snapshot.node_coords(projected=True)
+    x, y = x[nodes], y[nodes]
+    inside = (x >= xmin) & (x <= xmax) & (y >= ymin) & (y <= ymax)
+    return nodes[inside]
+
+
+def subgraph(snapshot, index, nodes):
+    """CompiledGraph of the edges between the given (sorted) snapshot node positions"""
+    indptr = index['edge_indptr']
+    starts, ends = indptr[nodes], indptr[nodes + 1]
+    counts = ends - starts
+    # Concatenated edge ranges of the nodes
+    offsets = np.repeat(np.cumsum(counts) - counts, counts)
+    edges = np.asarray(index['edge_order'][np.repeat(starts, counts) + np.arange(counts.sum()) - offsets])
+    edges.sort()
+
+    u = np.searchsorted(nodes, snapshot.u[edges])
+    v_global = np.asarray(snapshot.v[edges])
+    v = np.clip(np.searchsorted(nodes, v_global), 0, len(nodes) - 1)
+    inside = nodes[v] == v_global
+    x, y = snapshot.node_coords(projected=True)
+    return CompiledGraph.from_edges(np.asarray(snapshot.node_ids[nodes]), u[inside], v[inside], snapshot.length[edges][inside],
+                                    x=x[nodes], y=y[nodes], crs=snapshot.crs(projected=True))
+
+
+def process_tile(snapshot_path, index_path, tile, cutoff, dest_x, dest_y, dest_labels, max_snap_distance=500.0):
+    """Nearest destination within cutoff for every node of one tile.
+
+    The tile is routed on the subgraph within cutoff of it. Network paths are
+    never shorter than the straight line between their ends, so every path of
+    up to cutoff metres from a node of the tile stays inside that subgraph.
+    Nodes are loaded max_snap_distance further out again, so destinations
+    are snapped to the same node as on the full graph.
+    """
+    snapshot = load_snapshot(snapshot_path)
+    index = load_tile_index(index_path)
+    xmin, ymin, xmax, ymax = tile_bounds(index, tile)
+    # The tile's own nodes as the index assigned them, a node on a shared tile edge belongs to one tile only
+    core = tile_nodes(index, tile)
+    if len(core) == 0:
+        # Same dtypes as a full tile, the Parquet schema is taken from the first chunk written
+        node_dtype = snapshot.node_ids.dtype
+        return pd.DataFrame({'node': np.empty(0, dtype=node_dtype), 'distance': np.empty(0, dtype=np.float64),
+                             'destination_node': np.empty(0, dtype=node_dtype), 'destination': np.empty(0, dtype=np.int64)})
+
+    search_buffer = cutoff + max_snap_distance
+    nodes = nodes_in_box(snapshot, index, (xmin - search_buffer - max_snap_distance, ymin - search_buffer - max_snap_distance,
+                                           xmax + search_buffer + max_snap_distance, ymax + search_buffer + max_snap_distance))
+    compiled = subgraph(snapshot, index, nodes)
+
+    # Destinations close enough to matter, snapped to the loaded nodes
+    near = ((dest_x >= xmin - search_buffer) & (dest_x <= xmax + search_buffer) &
+            (dest_y >= ymin - search_buffer) & (dest_y <= ymax + search_buffer))
+    destination_nodes, _ = NodeSnapper.from_compiled(compiled).query(dest_x[near], dest_y[near], max_distance=max_snap_distance)
+    labels = np.asarray(dest_labels)[near][destination_nodes != -1]
+    destination_nodes = destination_nodes[destination_nodes != -1]
+
+    core_idx = np.searchsorted(nodes, core)
+    distance = np.full(len(core), np.inf)
+    destination_node = np.full(len(core), -1, dtype=compiled.node_ids.dtype)
+    destination = np.full(len(core), -1, dtype=np.int64)
+    if len(destination_nodes):
+        node_distances, _, origin = compiled.multi_source(destination_nodes, limit=cutoff, reverse=True)
+        distance = node_distances[core_idx]
+        reached = np.flatnonzero(np.isfinite(distance))
+        origin_nodes = compiled.node_ids[origin[core_idx[reached]]]
+        destination_node[reached] = origin_nodes
+        # First destination row snapped to each node, as in stream_sources
+        label_of_node = dict(zip(destination_nodes.tolist()[::-1], labels.tolist()[::-1]))
+        destination[reached] = np.fromiter((label_of_node[node] for node in origin_nodes.tolist()), dtype=np.int64, count=len(reached))
+
+    return pd.DataFrame({'node': compiled.node_ids[core_idx], 'distance': distance,
+                         'destination_node': destination_node, 'destination': destination})
+
+
+def tiled_nearest_destination(snapshot_path, destinations, cutoff, out_path, tile_size=None,
+                              max_snap_distance=500.0, max_workers=None, index_path=None):
+    """Network distance from every node to its nearest destination, tile by tile.
+
+    Works from a graph snapshot (see graph_snapshot.save_snapshot) without
+    ever building the whole graph: each worker memory-maps the snapshot and
+    routes one tile plus a buffer of cutoff metres, so peak memory follows the
+    tile size. Distances up to cutoff are exact; nodes further than cutoff
+    from every destination get an infinite distance. Results are appended to
+    out_path (CSV, or Parquet with pyarrow), one node per row, with the row
+    position of its destination in destinations (-1 for none). Returns the
+    number of rows written.
+    """
+    if tile_size is None:
+        tile_size = 4 * cutoff
+    snapshot = load_snapshot(snapshot_path)
+    if index_path is None:
+        index_path = os.path.join(os.path.dirname(os.path.abspath(out_path)), f'tiles_{int(tile_size)}')
+    if not os.path.exists(os.path.join(index_path, 'grid.npy')):
+        build_tile_index(snapshot, tile_size, index_path)
+    index = load_tile_index(index_path)
+    if not math.isclose(index['grid'][2], tile_size):
+        raise ValueError(f"{index_path} was built with tiles of {index['grid'][2]} m, not {tile_size} m")
+
+    # Destinations as projected coordinate arrays, small enough to send to every worker
+    dest_proj = destinations.geometry.to_crs(crs=snapshot.crs(projected=True))
+    dest_x, dest_y = dest_proj.x.values, dest_proj.y.values
+    # Destinations are labelled by row position, -1 where none is within cutoff, as in stream_sources
+    dest_labels = np.arange(len(destinations))
+
+    tiles = iter(np.flatnonzero(np.diff(index['tile_offsets']) > 0).tolist())
+    workers = max_workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as pool, ChunkWriter(out_path) as writer:
+        def submit(tile):
+            return pool.submit(process_tile, snapshot_path, index_path, tile, cutoff,
+                               dest_x, dest_y, dest_labels, max_snap_distance)
+
+        # A few tiles in flight per worker, so finished results never pile up
+        pending = deque(submit(tile) for tile in islice(tiles, 2 * workers))
+        while pending:
+            result = pending.popleft().result()
+            pending.extend(submit(tile) for tile in islice(tiles, 1))
+            # Every node belongs to exactly one tile, so merging is appending
+            if len(result):
+                writer.write(result)
+        return writer.rows